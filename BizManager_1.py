@@ -13,18 +13,22 @@ def ensure_flask():
         print("Done!")
 ensure_flask()
 
-import os,sqlite3,hashlib,hmac,secrets,threading,webbrowser,time
+import os,re,io,sqlite3,hashlib,hmac,secrets,threading,webbrowser,time,json,shutil,queue,asyncio,heapq,tracemalloc
+import urllib.request,urllib.error,urllib.parse,http.client
 from datetime import datetime,timezone
-from functools import wraps
+from decimal import Decimal,InvalidOperation,ROUND_HALF_UP
+from functools import wraps,lru_cache,partial
+from collections import OrderedDict,namedtuple,deque
+from concurrent.futures import Future,ThreadPoolExecutor,TimeoutError as FutureTimeout
 from pathlib import Path
-from flask import Flask,request,session,redirect,jsonify,g,make_response
+from flask import Flask,Response,request,session,redirect,jsonify,g,make_response,has_app_context,send_file
 from markupsafe import escape
 
 APP_DIR=Path(__file__).parent
 DB_PATH=APP_DIR/"bizmanager.db"
-PORT=5000
+PORT=int(os.environ.get("BIZ_PORT","5000"))
 app=Flask(__name__)
-app.secret_key=secrets.token_hex(32)
+app.secret_key=os.environ.get("BIZ_SECRET_KEY") or secrets.token_hex(32)  # set it when several processes share sessions
 
 SCHEMA="""
 CREATE TABLE IF NOT EXISTS users(
@@ -33,52 +37,354 @@ CREATE TABLE IF NOT EXISTS users(
     full_name TEXT NOT NULL,role TEXT NOT NULL DEFAULT 'employee',
     status TEXT NOT NULL DEFAULT 'active',
     payment_status TEXT NOT NULL DEFAULT 'unpaid',
-    position TEXT DEFAULT '',phone TEXT DEFAULT '',created_at TEXT NOT NULL
+    position TEXT DEFAULT '',phone TEXT DEFAULT '',created_at INTEGER NOT NULL,
+    owner_id INTEGER,last_paid_on INTEGER
 );
 CREATE TABLE IF NOT EXISTS invite_codes(
     id INTEGER PRIMARY KEY AUTOINCREMENT,code TEXT UNIQUE NOT NULL,
     owner_id INTEGER NOT NULL,used_by_id INTEGER,label TEXT DEFAULT '',
-    is_active INTEGER DEFAULT 1,created_at TEXT NOT NULL
+    is_active INTEGER DEFAULT 1,created_at INTEGER NOT NULL
 );
 CREATE TABLE IF NOT EXISTS payment_records(
     id INTEGER PRIMARY KEY AUTOINCREMENT,employee_id INTEGER NOT NULL,
-    amount REAL NOT NULL,currency TEXT DEFAULT 'USD',period TEXT DEFAULT '',
+    amount_minor INTEGER NOT NULL,currency TEXT DEFAULT 'USD',period TEXT DEFAULT '',
     method TEXT DEFAULT '',reference TEXT DEFAULT '',notes TEXT DEFAULT '',
-    paid_on TEXT NOT NULL
+    paid_on INTEGER NOT NULL,owner_id INTEGER
 );
 CREATE TABLE IF NOT EXISTS notes(
     id INTEGER PRIMARY KEY AUTOINCREMENT,employee_id INTEGER NOT NULL,
-    author_id INTEGER NOT NULL,content TEXT NOT NULL,created_at TEXT NOT NULL
+    author_id INTEGER NOT NULL,content TEXT NOT NULL,created_at INTEGER NOT NULL,
+    owner_id INTEGER
 );
+CREATE INDEX IF NOT EXISTS users_tenant ON users(owner_id,role,full_name);
+CREATE INDEX IF NOT EXISTS invites_tenant ON invite_codes(owner_id,created_at);
+CREATE INDEX IF NOT EXISTS payments_tenant ON payment_records(owner_id,employee_id,paid_on);
+CREATE INDEX IF NOT EXISTS notes_tenant ON notes(owner_id,employee_id,created_at);
+CREATE TABLE IF NOT EXISTS jobs(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,kind TEXT NOT NULL,owner_id INTEGER,
+    payload TEXT NOT NULL DEFAULT '{}',status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,max_attempts INTEGER NOT NULL DEFAULT 3,
+    progress REAL NOT NULL DEFAULT 0,message TEXT DEFAULT '',result TEXT DEFAULT '',
+    run_after INTEGER NOT NULL,created_at INTEGER NOT NULL,updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status,run_after);
+CREATE INDEX IF NOT EXISTS jobs_kind ON jobs(kind,created_at);
+CREATE TABLE IF NOT EXISTS payroll_monthly(
+    owner_id INTEGER NOT NULL,month TEXT NOT NULL,currency TEXT NOT NULL,
+    period TEXT NOT NULL,method TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,payments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(owner_id,month,currency,period,method)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS payroll_monthly_add AFTER INSERT ON payment_records BEGIN
+    INSERT INTO payroll_monthly(owner_id,month,currency,period,method,total,payments)
+    VALUES(COALESCE(NEW.owner_id,0),strftime('%Y-%m',NEW.paid_on,'unixepoch'),NEW.currency,COALESCE(NEW.period,''),COALESCE(NEW.method,''),NEW.amount_minor,1)
+    ON CONFLICT(owner_id,month,currency,period,method) DO UPDATE SET total=total+excluded.total,payments=payments+1;
+END;
+CREATE TABLE IF NOT EXISTS changes(
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,owner_id INTEGER,tbl TEXT NOT NULL,
+    row_id INTEGER NOT NULL,op TEXT NOT NULL,at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_owner ON changes(owner_id,seq);
+CREATE TABLE IF NOT EXISTS maint_log(
+    at INTEGER NOT NULL,file TEXT NOT NULL,db_bytes INTEGER NOT NULL,wal_bytes INTEGER NOT NULL,
+    free_pages INTEGER NOT NULL,vacuumed INTEGER NOT NULL DEFAULT 0,checkpoint TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS maint_log_file ON maint_log(file,at);
+CREATE TABLE IF NOT EXISTS pay_periods(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,owner_id INTEGER NOT NULL,starts_at INTEGER NOT NULL,
+    ends_at INTEGER,cycle TEXT NOT NULL DEFAULT 'manual',paid INTEGER,unpaid INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS pay_periods_open ON pay_periods(owner_id) WHERE ends_at IS NULL;
+CREATE INDEX IF NOT EXISTS pay_periods_owner ON pay_periods(owner_id,starts_at);
 """
+# Change feed: every insert/update/delete on these tables appends to `changes` from a trigger, so
+# the log entry commits or rolls back with the write itself. Deletes leave tombstones (op=delete).
+CHANGE_TABLES=("users","invite_codes","payment_records","notes")
+SCHEMA+="".join(f"""CREATE TRIGGER IF NOT EXISTS {t}_{op}_log AFTER {op.upper()} ON {t} BEGIN
+    INSERT INTO changes(owner_id,tbl,row_id,op,at) VALUES({r}.owner_id,'{t}',{r}.id,'{op}',CAST(strftime('%s','now') AS INTEGER));
+END;
+""" for t in CHANGE_TABLES for op,r in (("insert","NEW"),("update","NEW"),("delete","OLD")))
+
+# Schema changes for databases created before the current SCHEMA; fresh files get SCHEMA directly.
+# Each entry runs once, in order, tracked by PRAGMA user_version.
+MIGRATIONS=[]
+def migration(fn): MIGRATIONS.append(fn); return fn
+
+@migration
+def mig_tenants(db):
+    """owner_id on users/payments/notes: owners own themselves, employees belong to their invite's owner."""
+    for t in ("users","payment_records","notes"):
+        if "owner_id" not in table_cols(db,t): db.execute(f"ALTER TABLE {t} ADD COLUMN owner_id INTEGER")
+    db.execute("UPDATE users SET owner_id=id WHERE role='owner'")
+    db.execute("UPDATE users SET owner_id=(SELECT owner_id FROM invite_codes WHERE used_by_id=users.id) WHERE role='employee'")
+    db.execute("UPDATE users SET owner_id=(SELECT MIN(id) FROM users WHERE role='owner') WHERE owner_id IS NULL")
+    for t in ARCHIVED: db.execute(f"UPDATE {t} SET owner_id=(SELECT owner_id FROM users WHERE id={t}.employee_id)")
+    db.commit()
+    for name in attach_archives(db):
+        for t in ARCHIVED: db.execute(f"UPDATE {name}.{t} SET owner_id=(SELECT owner_id FROM main.users WHERE id={t}.employee_id)")
+        db.commit(); db.execute(f"DETACH DATABASE {name}")
+
+@migration
+def mig_minor_units(db):
+    """REAL payment amounts -> integer minor units (cents for USD), in the hot table and every archive.
+    The rollup and its trigger are dropped here; init_db recreates and rebuilds them."""
+    db.execute("DROP TRIGGER IF EXISTS payroll_monthly_add"); db.execute("DROP TABLE IF EXISTS payroll_monthly")
+    db.create_function("minor_units",2,lambda a,c: to_minor(a,c or "USD",exact=False),deterministic=True)
+    db.commit()
+    for s in ["main"]+attach_archives(db):
+        if "amount" not in table_cols(db,"payment_records",s): continue
+        db.execute(f"ALTER TABLE {s}.payment_records ADD COLUMN amount_minor INTEGER NOT NULL DEFAULT 0")
+        db.execute(f"UPDATE {s}.payment_records SET amount_minor=minor_units(amount,currency)")
+        drop_column(db,"payment_records","amount",s); db.commit()
+    for name in attach_archives(db): db.execute(f"DETACH DATABASE {name}")
+
+TIMESTAMPS={"users":("created_at",),"invite_codes":("created_at",),"payment_records":("paid_on",),
+            "notes":("created_at",),"jobs":("run_after","created_at","updated_at")}
+
+def retype_table(db,table,cols,schema="main"):
+    """SQLite can't change a column's declared type in place, so copy the table into one whose
+    CREATE statement declares cols INTEGER (converting text timestamps to epoch seconds) and swap
+    it in. Indexes and triggers go with the old table; SCHEMA/ensure_archive_tables recreate them."""
+    row=db.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type='table' AND name=?",[table]).fetchone()
+    if not row: return  # not created yet: SCHEMA will create it with the new types
+    sql=row[0]
+    for c in cols: sql=re.sub(rf"\b{c}\s+TEXT\b",f"{c} INTEGER",sql)
+    names=table_cols(db,table,schema)
+    swap_table(db,table,sql,names,[f"CASE WHEN typeof({c})='text' THEN CAST(strftime('%s',{c}) AS INTEGER) ELSE {c} END" if c in cols else c for c in names],schema)
+
+def swap_table(db,table,sql,names,sel,schema="main"):
+    """Create table from its edited CREATE statement under a temporary name, copy names (as sel) across, swap it in."""
+    sql=re.sub(rf'^CREATE TABLE(\s+IF NOT EXISTS)?\s+"?{table}"?',f"CREATE TABLE {schema}.{table}_new",sql)
+    db.execute(sql); db.execute(f"INSERT INTO {schema}.{table}_new({','.join(names)}) SELECT {','.join(sel)} FROM {schema}.{table}")
+    db.execute(f"DROP TABLE {schema}.{table}"); db.execute(f"ALTER TABLE {schema}.{table}_new RENAME TO {table}"); db.commit()
+
+def drop_column(db,table,col,schema="main"):
+    """ALTER TABLE ... DROP COLUMN needs SQLite 3.35+; older libraries get retype_table's copy-and-swap."""
+    if sqlite3.sqlite_version_info>=(3,35,0): db.execute(f"ALTER TABLE {schema}.{table} DROP COLUMN {col}"); return
+    sql=db.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type='table' AND name=?",[table]).fetchone()[0]
+    sql,n=re.subn(rf",\s*\b{col}\b[^,]*?(?=,|\)\s*$)","",sql,count=1)  # any but the first column
+    if not n: sql=re.sub(rf"(?<=\()\s*\b{col}\b[^,]*,\s*","",sql,count=1)
+    names=[c for c in table_cols(db,table,schema) if c!=col]; swap_table(db,table,sql,names,names,schema)
+
+@migration
+def mig_epoch_timestamps(db):
+    """TEXT 'YYYY-MM-DD HH:MM:SS' (UTC) timestamps -> INTEGER epoch seconds, hot tables and archives."""
+    db.commit()
+    for t,cols in TIMESTAMPS.items(): retype_table(db,t,cols)
+    for name in attach_archives(db):
+        for t in ARCHIVED: retype_table(db,t,TIMESTAMPS[t],name)
+        ensure_archive_tables(db,name); db.commit(); db.execute(f"DETACH DATABASE {name}")
+
+@migration
+def mig_incremental_vacuum(db):
+    """auto_vacuum only changes through a full VACUUM; after this one, maintenance frees pages in bounded steps."""
+    db.commit()
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0]!=2: db.execute("PRAGMA auto_vacuum=INCREMENTAL"); db.execute("VACUUM")
+
+@migration
+def mig_last_paid(db):
+    """users.last_paid_on (latest payment, epoch seconds), which pay period rollover derives
+    payment_status from. When sharded, the directory database reads it from every tenant file."""
+    if "last_paid_on" not in table_cols(db,"users"): db.execute("ALTER TABLE users ADD COLUMN last_paid_on INTEGER")
+    def backfill(src):
+        db.execute(f"""UPDATE users SET last_paid_on=COALESCE((SELECT MAX(paid_on) FROM {src}.payment_records
+                         WHERE owner_id=users.owner_id AND employee_id=users.id),last_paid_on) WHERE role='employee'""")
+    backfill("main"); db.commit()
+    # one shard at a time: SQLite attaches at most 10 databases to a connection
+    if SHARDED and Path(db.execute("PRAGMA database_list").fetchone()[2]).resolve()==DB_PATH.resolve():
+        for f in sorted(TENANT_DIR.glob("owner-*.db")):
+            db.execute("ATTACH DATABASE ? AS shard",[str(f)]); backfill("shard"); db.commit(); db.execute("DETACH DATABASE shard")
 
-def init_db():
-    with sqlite3.connect(str(DB_PATH)) as db:
-        db.executescript(SCHEMA);db.commit()
+def init_db(path=None):
+    with sqlite3.connect(str(path or DB_PATH)) as db:
+        ver=db.execute("PRAGMA user_version").fetchone()[0]
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name='users'").fetchone():
+            for i,fn in enumerate(MIGRATIONS[ver:],ver+1): fn(db); db.execute(f"PRAGMA user_version={i}"); db.commit()
+        else: db.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only takes effect before the first table exists
+        had_rollup=db.execute("SELECT 1 FROM sqlite_master WHERE name='payroll_monthly'").fetchone()
+        had_changes=db.execute("SELECT 1 FROM sqlite_master WHERE name='changes'").fetchone()
+        db.executescript(SCHEMA); db.execute(f"PRAGMA user_version={len(MIGRATIONS)}"); db.commit()
+        if not had_rollup: rebuild_rollups(db)  # new or dropped by a migration: derive it from the payments
+        if not had_changes:  # rows that predate the feed enter it as inserts, so since=0 is a full sync
+            for t in CHANGE_TABLES:
+                db.execute(f"INSERT INTO changes(owner_id,tbl,row_id,op,at) SELECT owner_id,'{t}',id,'insert',{TIMESTAMPS[t][0]} FROM {t} ORDER BY id")
+            db.commit()
 
-def get_db():
-    if "db" not in g:
-        g.db=sqlite3.connect(str(DB_PATH))
-        g.db.row_factory=sqlite3.Row
-        g.db.execute("PRAGMA journal_mode=WAL")
-    return g.db
+# Tenancy: every owner is a tenant and employees carry their owner's id in owner_id, so a
+# user's tenant is always u["owner_id"]. With BIZ_SHARDED=1 the tenant tables live in
+# tenants/owner-<id>.db; users, invite codes and jobs stay in the directory database.
+SHARDED=os.environ.get("BIZ_SHARDED")=="1"
+TENANT_DIR=APP_DIR/"tenants"
+TENANT_TABLES=("payment_records","notes")
+_ready_shards=set()
+
+def db_file(tenant=None):
+    return TENANT_DIR/f"owner-{int(tenant)}.db" if SHARDED and tenant is not None else DB_PATH
+
+def db_files(): return [DB_PATH]+(sorted(TENANT_DIR.glob("owner-*.db")) if SHARDED else [])
+
+def connect(path):
+    if REPLICA_OF: return replica_connect(path)
+    if path!=DB_PATH and path not in _ready_shards:
+        TENANT_DIR.mkdir(exist_ok=True); init_db(path); _ready_shards.add(path)
+    db=sqlite3.connect(str(path)); db.row_factory=sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL"); return db
+
+def get_db(tenant=None):
+    """Per-request connection: the directory database, or the tenant's shard when sharded."""
+    path=db_file(tenant)
+    if path==DB_PATH:
+        if "db" not in g: g.db=connect(DB_PATH)
+        return g.db
+    shards=g.setdefault("shards",{})
+    if path not in shards: shards[path]=connect(path)
+    return shards[path]
 
 @app.teardown_appcontext
 def close_db(e=None):
-    db=g.pop("db",None)
-    if db:db.close()
+    for db in [g.pop("db",None)]+list(g.pop("shards",{}).values()):
+        if db:db.close()
 
-def q(sql,args=(),one=False):
-    cur=get_db().execute(sql,args);rv=cur.fetchall()
+def q(sql,args=(),one=False,tenant=None,rec=False):
+    """rec=True returns compact rowtype() records instead of sqlite3.Row; use it with an explicit
+    column list, since the record type is built from the result's column names."""
+    t0=time.perf_counter(); cur=get_db(tenant).cursor(); cur.execute(sql,args)
+    if rec and cur.description:
+        T=rowtype(tuple(d[0] for d in cur.description)); cur.row_factory=lambda c,r: tuple.__new__(T,r)
+    rv=cur.fetchall(); db_timed(t0,sql)
     return (rv[0] if rv else None) if one else rv
 
-def m(sql,args=()):
-    db=get_db();cur=db.execute(sql,args);db.commit();return cur.lastrowid
+@lru_cache(maxsize=256)
+def rowtype(cols):
+    """Record class for one projection: a namedtuple with no per-row dict that also reads like
+    sqlite3.Row (r["col"], r[0], r.keys(), dict(r)), so views don't care which they get."""
+    idx={c:i for i,c in enumerate(cols)}
+    class Rec(namedtuple("Rec",cols,rename=True)):
+        __slots__=()
+        def __getitem__(self,k): return tuple.__getitem__(self,idx[k] if isinstance(k,str) else k)
+        def keys(self): return cols
+    return Rec
+
+def m(sql,args=(),tenant=None,ev=None,tags=()):
+    """Write and commit. ev=(owner_id,type,data) is published to that owner's /events stream after
+    the commit if the statement changed any rows; for INSERTs data gains the new row's id.
+    tags names the cached fragments the write makes stale (see FRAGMENT CACHE)."""
+    def op(db): cur=db.execute(sql,args); return cur.lastrowid,cur.rowcount
+    rowid,n=mw(op,tenant,sql)
+    if n>0 and written_table(sql)=="users": IDS.bump()
+    if tags and n>0: invalidate(*tags)
+    if ev and n>0: BUS.publish(ev[0],ev[1],dict({"id":rowid} if sql.lstrip()[:6].upper()=="INSERT" else {},**ev[2]))
+    return rowid
+
+WRITE_SQL=re.compile(r"\s*(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)",re.I)
+def written_table(sql): w=WRITE_SQL.match(sql); return w and w.group(1).lower()
+
+def mw(fn,tenant=None,sql=None):
+    """Run fn(db) as one write on the tenant's file and return its result once committed.
+    fn runs on the writer thread's connection, so it must not call q()/m() itself. sql only
+    labels the write in profiles."""
+    t0=time.perf_counter()
+    try:
+        if SINGLE_WRITER: return writer(db_file(tenant)).submit(fn)
+        db=get_db(tenant)
+        try: r=fn(db); db.commit(); return r
+        except BaseException: db.rollback(); raise
+    finally: db_timed(t0,sql or getattr(fn,"__qualname__","write"))
+
+def db_timed(t0,what=""):
+    """Charge one q()/mw() call (queueing for the writer included) to the current request's
+    db_ms and queries, which the access log reports, and to its timeline when it is profiled."""
+    if has_app_context():
+        dt=time.perf_counter()-t0; g.db_time=g.get("db_time",0.0)+dt; g.queries=g.get("queries",0)+1
+        tl=g.get("prof_sql")
+        if tl is not None: tl.append((t0,dt,what))
+
+# Single writer: SQLite takes one write lock per file, so instead of every request thread racing
+# for it, each file gets one thread that owns a connection and drains a queue of writes. Whatever
+# is queued when it wakes (up to WRITE_BATCH ops) shares one transaction and one commit; each op
+# runs under its own SAVEPOINT so a failing op rolls back alone. Readers keep their own connections.
+# A writer that can't open its file, or dies, fails everything queued and drops out of WRITERS so
+# the next write starts a fresh one; a write still waiting after WRITE_TIMEOUT is abandoned.
+SINGLE_WRITER=os.environ.get("BIZ_SINGLE_WRITER","1")=="1"
+WRITE_BATCH=int(os.environ.get("BIZ_WRITE_BATCH","64"))
+WRITE_TIMEOUT=float(os.environ.get("BIZ_WRITE_TIMEOUT","30"))  # seconds a request waits for its write
+WRITERS={}; _writers_lock=threading.Lock()
+
+class Writer:
+    def __init__(self,path):
+        self.path=path; self.q=queue.Queue(); self.batch=[]; self.dead=None
+        threading.Thread(target=self.run,daemon=True,name=f"writer-{path.stem}").start()
+    def submit(self,fn):
+        if self.dead: raise self.dead
+        fut=Future(); self.q.put((fn,fut))
+        try: return fut.result(timeout=WRITE_TIMEOUT)
+        except FutureTimeout:
+            if fut.cancel(): raise FutureTimeout(f"writer for {self.path.name} busy for {WRITE_TIMEOUT}s; write abandoned") from None
+            return fut.result()  # it started meanwhile
+    def run(self):
+        db=None
+        try:
+            db=connect(self.path); db.isolation_level=None
+            while True: self.drain(db)
+        except BaseException as e:
+            with _writers_lock:
+                if WRITERS.get(self.path) is self: del WRITERS[self.path]
+                self.dead=e
+            if db is not None: db.close()
+            pending=[fut for _,fut in self.batch]
+            while True:
+                try: pending.append(self.q.get_nowait()[1])
+                except queue.Empty: break
+            for fut in pending:
+                if not fut.done(): fut.set_exception(e)
+    def drain(self,db):
+        self.batch=[self.q.get()]
+        while len(self.batch)<WRITE_BATCH:
+            try: self.batch.append(self.q.get_nowait())
+            except queue.Empty: break
+        batch=[(fn,fut) for fn,fut in self.batch if fut.set_running_or_notify_cancel()]  # skip abandoned writes
+        done=[]
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for fn,fut in batch:
+                db.execute("SAVEPOINT op")
+                try: done.append((fut,fn(db),None)); db.execute("RELEASE op")
+                except Exception as e: db.execute("ROLLBACK TO op"); db.execute("RELEASE op"); done.append((fut,None,e))
+            db.execute("COMMIT")
+        except Exception as e:
+            if db.in_transaction: db.execute("ROLLBACK")
+            done=[(fut,None,e) for _,fut in batch]
+        for fut,res,err in done: fut.set_exception(err) if err else fut.set_result(res)
+        self.batch=[]
+
+def writer(path):
+    with _writers_lock:
+        if path not in WRITERS or WRITERS[path].dead: WRITERS[path]=Writer(path)
+        return WRITERS[path]
+
+def now(off=0): return int(time.time())+off  # timestamps are stored as epoch seconds (UTC)
+def epoch(y,mo=1,d=1): return int(datetime(y,mo,d,tzinfo=timezone.utc).timestamp())
+def fts(ts): return datetime.fromtimestamp(int(ts),timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+# ISO 4217 minor-unit exponents; anything unlisted is treated as 2 decimal places.
+CURRENCIES={"USD":2,"EUR":2,"GBP":2,"CAD":2,"AUD":2,"CHF":2,"JPY":0,"KWD":3}
+def cur_exp(cur): return CURRENCIES.get(cur,2)
+def to_minor(amount,cur="USD",exact=True):
+    """Decimal amount ("12.34", 12.34) -> integer minor units. Raises ValueError on junk, or on
+    precision finer than the currency's minor unit unless exact=False (then rounds half up)."""
+    try: d=Decimal(str(amount).strip()).scaleb(cur_exp(cur))
+    except InvalidOperation: raise ValueError(f"invalid amount {amount!r}")
+    if not d.is_finite() or (exact and d!=d.to_integral_value()): raise ValueError(f"invalid amount {amount!r}")
+    return int(d.to_integral_value(ROUND_HALF_UP))
+def from_minor(minor,cur="USD"): return Decimal(minor or 0).scaleb(-cur_exp(cur))
+def money(minor,cur="USD"): return f"{escape(cur)} {from_minor(minor,cur):,.{cur_exp(cur)}f}"
+def cur_options(sel="USD"): return "".join(f'<option {"selected" if c==sel else ""}>{c}</option>' for c in CURRENCIES)
 
-def now(): return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-def fdate(s):
-    try:return datetime.strptime(str(s)[:10],"%Y-%m-%d").strftime("%b %d, %Y")
-    except:return str(s)
+@lru_cache(maxsize=4096)
+def fday(day): return datetime.fromtimestamp(day*86400,timezone.utc).strftime("%b %d, %Y")
+def fdate(ts):
+    """Epoch seconds -> 'Jan 05, 2026'; each distinct day is formatted once."""
+    try:return fday(int(ts)//86400)
+    except (TypeError,ValueError):return str(ts)
 
 def hash_pw(pw):
     salt=secrets.token_hex(16)
@@ -92,7 +398,10 @@ def check_pw(pw,stored):
         return hmac.compare_digest(h.hex(),hx)
     except:return False
 
-def me(): uid=session.get("user_id"); return q("SELECT * FROM users WHERE id=?",[uid],one=True) if uid else None
+def me():
+    """The signed-in user, loaded once per request (login_required/owner_req and the view share it)."""
+    if "me" not in g: uid=session.get("user_id"); g.me=q(f"SELECT {USER_COLS} FROM users WHERE id=?",[uid],one=True,rec=True) if uid else None
+    return g.me
 def initials(n): p=n.strip().split(); return (p[0][0]+p[-1][0]).upper() if len(p)>=2 else n[:2].upper()
 
 def login_required(f):
@@ -110,17 +419,316 @@ def owner_req(f):
         return f(*a,**k)
     return d
 
+# Owners sign themselves up, one tenant each, so pages about the whole process (cache, logs,
+# admission, memory, replication) are for the operators listed in BIZ_ADMIN_EMAILS only.
+ADMINS={e.strip().lower() for e in os.environ.get("BIZ_ADMIN_EMAILS","").split(",") if e.strip()}
+
+def admin_req(f):
+    @wraps(f)
+    def d(*a,**k):
+        u=me()
+        if not u or u["role"]!="owner": return redir("/login")
+        if u["email"].lower() not in ADMINS: flash("That page is for administrators.","danger"); return redir("/dashboard")
+        return f(*a,**k)
+    return d
+
 def redir(url,code=302):
     r=make_response("",code);r.headers["Location"]=url;return r
 
 def flash(msg,cat="info"):
     session.setdefault("_f",[]).append({"m":msg,"c":cat})
 
+COMMANDS={}
+def command(name,usage=""):
+    """Register fn(*argv) as `python BizManager_1.py <name> ...`."""
+    def reg(fn): COMMANDS[name]=(fn,usage); return fn
+    return reg
+
+def hist_link(url,arch,tenant):
+    """Toggle between recent (hot) rows and full history including archived years."""
+    if not arch and not archive_years(db_file(tenant).stem): return ""
+    return (f'<a href="{url}" class="btn btn-ghost btn-sm">Recent only</a>' if arch
+            else f'<a href="{url}?history=all" class="btn btn-ghost btn-sm">Full history</a>')
+
 def flash_html():
     msgs=session.pop("_f",[])
     icons={"success":"✓","danger":"✕","info":"ℹ","warning":"⚠"}
     return "".join(f'<div class="alert alert-{x["c"]}">{icons.get(x["c"],"ℹ")} {escape(x["m"])}</div>' for x in msgs)
 
+# ═══════════════════════════════════════════════════════════════════════════
+#  DATA ACCESS (shared by HTML views and /api/v1)
+# ═══════════════════════════════════════════════════════════════════════════
+def fetch(table,where=(),args=(),cols="*",order="id",after=None,limit=None,ids=None,pk="id",tenant=None):
+    """SELECT with optional batch-get (ids), keyset pagination (after) and LIMIT."""
+    w=list(where); a=list(args)
+    if ids is not None: w.append(f"{pk} IN ({','.join('?'*len(ids))})" if ids else "0"); a+=list(ids)
+    if after is not None: w.append(f"{pk}>?"); a.append(after)
+    sql=f"SELECT {cols} FROM {table}"+(" WHERE "+" AND ".join(w) if w else "")+f" ORDER BY {order}"
+    if limit: sql+=" LIMIT ?"; a.append(limit)
+    return q(sql,a,tenant=tenant,rec=cols!="*")
+
+def find_employees(oid,qp="",st="",py="",**kw):
+    w=["owner_id=?","role='employee'"]; a=[oid]
+    if qp: w.append("(full_name LIKE ? OR email LIKE ?)"); a+=[f"%{qp}%",f"%{qp}%"]
+    if st: w.append("status=?"); a.append(st)
+    if py: w.append("payment_status=?"); a.append(py)
+    return fetch("users",w,a,**kw)
+
+# Explicit projections: list views never need password_hash, and narrower rows are cheaper to build.
+USER_COLS="id,email,full_name,role,status,payment_status,position,phone,created_at,owner_id"
+EMP_ROW="id,full_name,email,position,status,payment_status"          # dashboard table
+EMP_CARD="id,full_name,email,phone,position,status,payment_status,created_at"  # /employees cards
+
+# /employees filter results: the ordered id list per (owner, filters) is kept in a small LRU and
+# hydrated in one WHERE id IN (...) batch. Any write to users through m() bumps IDS.gen and drops
+# every list; BIZ_QUERY_TTL (seconds, 0 = none) also bounds staleness from other processes' writes.
+class IdCache:
+    def __init__(self,size,ttl):
+        self.size=size; self.ttl=ttl; self.gen=0; self.items=OrderedDict(); self.lock=threading.Lock()
+        self.stats=dict(hits=0,misses=0,bumps=0)
+    def bump(self):
+        with self.lock: self.gen+=1; self.items.clear(); self.stats["bumps"]+=1
+    def get(self,key):
+        with self.lock:
+            e=self.items.get(key); hit=e is not None and (not self.ttl or time.monotonic()-e[1]<self.ttl)
+            if hit: self.items.move_to_end(key)
+            self.stats["hits" if hit else "misses"]+=1
+            return e[0] if hit else None
+    def put(self,key,ids,gen):
+        """Store ids computed under generation gen; dropped if a users write landed meanwhile."""
+        with self.lock:
+            if gen!=self.gen: return
+            self.items[key]=(ids,time.monotonic()); self.items.move_to_end(key)
+            while len(self.items)>self.size: self.items.popitem(last=False)
+    def info(self):
+        with self.lock: return dict(self.stats,gen=self.gen,entries=len(self.items),size=self.size,ttl=self.ttl)
+IDS=IdCache(int(os.environ.get("BIZ_QUERY_CACHE","256")),float(os.environ.get("BIZ_QUERY_TTL","0")))
+
+def employee_list(oid,qp="",st="",py="",cols=EMP_CARD):
+    """find_employees(...,order="full_name") served from IDS. LIKE ignores ASCII case, so ASCII
+    searches share one entry regardless of case."""
+    key=(oid,qp.strip().lower() if qp.isascii() else qp.strip(),st,py)
+    ids=IDS.get(key)
+    if ids is None:
+        gen=IDS.gen; ids=tuple(r["id"] for r in find_employees(*key,cols="id",order="full_name")); IDS.put(key,ids,gen)
+    rows={r["id"]:r for r in fetch("users",cols=cols,ids=ids)}
+    return [rows[i] for i in ids if i in rows]
+
+def get_employee(oid,eid): return q(f"SELECT {USER_COLS} FROM users WHERE id=? AND owner_id=? AND role='employee'",[eid,oid],one=True,rec=True)
+
+def emp_payments(oid,eid=None,archived=False,**kw):
+    kw.setdefault("order","paid_on DESC")
+    return fetch(history("payment_records",get_db(oid)) if archived else "payment_records",
+                 ["owner_id=?"]+(["employee_id=?"] if eid else []),[oid]+([eid] if eid else []),tenant=oid,**kw)
+
+def emp_notes(oid,eid=None,author=False,archived=False,**kw):
+    kw.setdefault("order","created_at DESC")
+    rows=fetch(history("notes",get_db(oid)) if archived else "notes",
+               ["owner_id=?"]+(["employee_id=?"] if eid else []),[oid]+([eid] if eid else []),tenant=oid,**kw)
+    if not author: return rows
+    names=user_names({n["author_id"] for n in rows})  # users may live in another file when sharded
+    return [dict(n,aname=names.get(n["author_id"],"—")) for n in rows]
+
+def user_names(ids):
+    return {r["id"]:r["full_name"] for r in fetch("users",cols="id,full_name",ids=sorted(ids))} if ids else {}
+
+def owner_codes(oid,**kw):
+    kw.setdefault("order","created_at DESC")
+    return fetch("invite_codes",["owner_id=?"],[oid],**kw)
+
+def invite_list(oid,limit=None):
+    """Owner's codes, newest first, with the redeeming employee's name joined in (used_by_name)."""
+    return q(f"""SELECT c.id,c.code,c.label,c.is_active,c.used_by_id,c.created_at,u.full_name used_by_name
+                 FROM invite_codes c LEFT JOIN users u ON u.id=c.used_by_id
+                 WHERE c.owner_id=? ORDER BY c.created_at DESC{" LIMIT ?" if limit else ""}""",
+             [oid]+([limit] if limit else []),rec=True)
+
+def create_user(email,pw,name,role="employee",position="",phone="",owner_id=None):
+    """Owners get owner_id=their own id (they are the tenant); employees need their owner's id."""
+    ev=(owner_id,"employee",{"full_name":name,"email":email,"position":position,"initials":initials(name)}) if role=="employee" else None
+    uid=m("INSERT INTO users(email,password_hash,full_name,role,status,payment_status,position,phone,created_at,owner_id) VALUES(?,?,?,?,?,?,?,?,?,?)",
+          [email,hash_pw(pw),name,role,"active","paid" if role=="owner" else "unpaid",position,phone,now(),owner_id],ev=ev,
+          tags=(f"emps:{owner_id}",) if role=="employee" else ())
+    if role=="owner": m("UPDATE users SET owner_id=id WHERE id=?",[uid])
+    return uid
+
+def user_errors(email,pw,name,pw2=None):
+    errors=[]
+    if not name: errors.append("Full name required.")
+    if "@" not in email: errors.append("Valid email required.")
+    if len(pw)<8: errors.append("Password must be 8+ characters.")
+    if pw2 is not None and pw!=pw2: errors.append("Passwords don\'t match.")
+    if email and q("SELECT id FROM users WHERE email=?",[email],one=True): errors.append("Email already in use.")
+    return errors
+
+def pay_totals(oid,eid=None,archived=False):
+    """Exact per-currency totals summed in SQL: [{currency,total,payments}] with total in minor units."""
+    src=history("payment_records",get_db(oid)) if archived else "payment_records"
+    return q(f"""SELECT currency,SUM(amount_minor) total,COUNT(*) payments FROM {src}
+                 WHERE owner_id=?{" AND employee_id=?" if eid else ""} GROUP BY currency ORDER BY currency""",
+             [oid]+([eid] if eid else []),tenant=oid)
+
+def add_payment(oid,eid,amount,currency="USD",period="",method="",reference="",notes=""):
+    """Record a payment and mark the employee paid for the current pay period. amount is a decimal
+    amount in the currency's major unit; raises ValueError on a bad or negative amount."""
+    currency=currency or "USD"; amt=to_minor(amount,currency)
+    if amt<0: raise ValueError("negative amount")
+    ts=now(); period,method,reference=period or "",method or "",reference or ""
+    pid=m("INSERT INTO payment_records(owner_id,employee_id,amount_minor,currency,period,method,reference,notes,paid_on) VALUES(?,?,?,?,?,?,?,?,?)",
+          [oid,eid,amt,currency,period,method,reference,notes or "",ts],tenant=oid,
+          ev=(oid,"payment",{"employee_id":eid,"amount_minor":amt,"currency":currency,"exp":cur_exp(currency),"amount":money(amt,currency),
+                             "period":period,"method":method,"reference":reference,"paid_on":fdate(ts)}))
+    # last_paid_on first: a rollover landing between the two statements then already counts this payment
+    m("UPDATE users SET last_paid_on=? WHERE id=? AND owner_id=?",[ts,eid,oid])
+    m("UPDATE users SET payment_status='paid' WHERE id=? AND owner_id=? AND payment_status!='paid'",[eid,oid],ev=(oid,"paid",{"id":eid}),tags=(f"emps:{oid}",))
+    return pid
+
+# Pay periods: each owner has at most one open period (ends_at NULL). payment_status is derived,
+# not edited: 'paid' means a payment since the open period started. add_payment keeps it current
+# within a period; rollover() closes the period and re-derives every employee's status with one
+# UPDATE, either on demand or from the pay_periods job for owners on a weekly/biweekly/monthly cycle.
+PAY_CYCLES=("manual","weekly","biweekly","monthly")
+
+def pay_period(oid):
+    """The owner's open pay period, or None before the first rollover."""
+    return q("SELECT id,starts_at,cycle FROM pay_periods WHERE owner_id=? AND ends_at IS NULL",[oid],one=True,rec=True)
+
+def period_end(start,cycle):
+    """When a period that began at start ends on its own; None for manual periods."""
+    if cycle=="weekly": return start+7*86400
+    if cycle=="biweekly": return start+14*86400
+    if cycle=="monthly":
+        d=datetime.fromtimestamp(start,timezone.utc)
+        return int(datetime(d.year+d.month//12,d.month%12+1,1,tzinfo=timezone.utc).timestamp())
+    return None
+
+def rollover(oid,at=None,cycle=None):
+    """Close the owner's open period (recording its paid/unpaid counts) and open one at `at`, keeping
+    the cycle unless given. One transaction; returns how many employees changed status."""
+    at=at or now()
+    def op(db):
+        cur=db.execute("SELECT cycle FROM pay_periods WHERE owner_id=? AND ends_at IS NULL",[oid]).fetchone()
+        db.execute("""UPDATE pay_periods SET ends_at=?1,
+                        paid=(SELECT COUNT(*) FROM users WHERE owner_id=?2 AND role='employee' AND payment_status='paid'),
+                        unpaid=(SELECT COUNT(*) FROM users WHERE owner_id=?2 AND role='employee' AND payment_status='unpaid')
+                      WHERE owner_id=?2 AND ends_at IS NULL""",[at,oid])
+        db.execute("INSERT INTO pay_periods(owner_id,starts_at,cycle) VALUES(?,?,?)",[oid,at,cycle or (cur[0] if cur else "manual")])
+        return db.execute("""UPDATE users SET payment_status=CASE WHEN last_paid_on>=?1 THEN 'paid' ELSE 'unpaid' END
+                             WHERE owner_id=?2 AND role='employee' AND (payment_status='paid')!=(COALESCE(last_paid_on,0)>=?1)""",[at,oid]).rowcount
+    n=mw(op); IDS.bump(); invalidate(f"emps:{oid}")
+    BUS.publish(oid,"period",{"starts_at":fdate(at),"changed":n})
+    return n
+
+def set_pay_cycle(oid,cycle):
+    if cycle not in PAY_CYCLES: raise ValueError(f"unknown pay cycle {cycle!r}")
+    if pay_period(oid): m("UPDATE pay_periods SET cycle=? WHERE owner_id=? AND ends_at IS NULL",[cycle,oid],tags=(f"emps:{oid}",))
+    else: rollover(oid,cycle=cycle)  # the first period starts when a cycle is chosen
+
+def add_note(oid,eid,author_id,content):
+    ts=now()
+    return m("INSERT INTO notes(owner_id,employee_id,author_id,content,created_at) VALUES(?,?,?,?,?)",
+             [oid,eid,author_id,content,ts],tenant=oid,
+             ev=(oid,"note",{"employee_id":eid,"author":user_names({author_id}).get(author_id,"—"),"content":content,"created_at":fdate(ts)}))
+
+def create_invite(oid,label=""):
+    code=gen_code()
+    cid=m("INSERT INTO invite_codes(code,owner_id,label,is_active,created_at) VALUES(?,?,?,1,?)",[code,oid,label or "",now()],tags=(f"invites:{oid}",))
+    return cid,code
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  ARCHIVE (old payments/notes moved to per-year files, read back on demand)
+# ═══════════════════════════════════════════════════════════════════════════
+ARCHIVE_DIR=APP_DIR/"archive"
+ARCHIVE_AFTER_DAYS=int(os.environ.get("BIZ_ARCHIVE_AFTER_DAYS","365"))
+ARCHIVED={"payment_records":"paid_on","notes":"created_at"}  # table -> timestamp column
+ARCHIVE_FILES=8  # archive files per database; SQLite attaches at most 10, and archiving/migrations need one or two more
+
+def archive_path(year,stem=None): return ARCHIVE_DIR/f"{stem or DB_PATH.stem}-{year}.db"
+def archive_years(stem=None): return sorted(int(p.stem.rsplit("-",1)[1]) for p in ARCHIVE_DIR.glob(f"{stem or DB_PATH.stem}-[0-9][0-9][0-9][0-9].db"))
+def db_stem(db): return Path(db.execute("PRAGMA database_list").fetchone()[2]).stem
+def table_cols(db,table,schema="main"): return [r[1] for r in db.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def ensure_archive_tables(db,schema):
+    """Create/extend the archive copies so their columns track the hot tables."""
+    for t in ARCHIVED:
+        have=set(table_cols(db,t,schema)); info=list(db.execute(f"PRAGMA main.table_info({t})"))
+        if not have:
+            cols=",".join("id INTEGER PRIMARY KEY" if r[1]=="id" else f"{r[1]} {r[2]}" for r in info)
+            db.execute(f"CREATE TABLE {schema}.{t}({cols})")
+        for r in info:
+            if r[1] not in have and have: db.execute(f"ALTER TABLE {schema}.{t} ADD COLUMN {r[1]} {r[2]}")
+        db.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{t}_emp ON {t}(employee_id,{ARCHIVED[t]})")
+
+def attach_archives(db=None):
+    """ATTACH every archive year to the connection (outside a transaction); returns schema names.
+    archive_file folds old years together so there are never more than ARCHIVE_FILES of them."""
+    db=db or get_db(); have={r[1] for r in db.execute("PRAGMA database_list")}; names=[]; stem=db_stem(db)
+    for y in archive_years(stem):
+        name=f"a{y}"
+        if name not in have:
+            db.execute("ATTACH DATABASE ? AS "+name,[str(archive_path(y,stem))]); ensure_archive_tables(db,name)
+        names.append(name)
+    return names
+
+def history(table,db=None):
+    """FROM-clause source covering the hot table plus every attached archive year."""
+    names=attach_archives(db)
+    if not names: return table
+    cols=",".join(table_cols(db or get_db(),table))
+    return "("+" UNION ALL ".join(f"SELECT {cols} FROM {s}.{table}" for s in ["main"]+names)+")"
+
+def archive_rows(days=None):
+    """Move rows older than the cutoff into their year's archive file, for every database file.
+    Each year is copied then deleted in one transaction; a crash between files at worst leaves
+    copies that the next run removes from the hot table."""
+    cutoff=now(-86400*(ARCHIVE_AFTER_DAYS if days is None else days))
+    return sum(archive_file(path,cutoff) for path in db_files())
+
+def archive_file(path,cutoff):
+    db=sqlite3.connect(str(path),isolation_level=None); moved=0
+    try:
+        years=sorted({int(r[0]) for t,c in ARCHIVED.items()
+                      for r in db.execute(f"SELECT DISTINCT strftime('%Y',{c},'unixepoch') FROM {t} WHERE {c}<?",[cutoff]) if r[0]})
+        if years: ARCHIVE_DIR.mkdir(exist_ok=True)
+        for y in years:
+            db.execute("ATTACH DATABASE ? AS arc",[str(archive_path(y,path.stem))]); ensure_archive_tables(db,"arc")
+            lo,hi=epoch(y),epoch(y+1)
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                head=db.execute("SELECT COALESCE(MAX(seq),0) FROM main.changes").fetchone()[0]
+                for t,c in ARCHIVED.items():
+                    cols=",".join(table_cols(db,t)); rng=f"{c}<? AND {c}>=? AND {c}<?"
+                    db.execute(f"INSERT OR IGNORE INTO arc.{t}({cols}) SELECT {cols} FROM main.{t} WHERE {rng}",[cutoff,lo,hi])
+                    moved+=db.execute(f"DELETE FROM main.{t} WHERE {rng}",[cutoff,lo,hi]).rowcount
+                db.execute("UPDATE main.changes SET op='archive' WHERE seq>? AND op='delete'",[head])  # moved, not deleted
+                db.execute("COMMIT")
+            except Exception: db.execute("ROLLBACK"); raise
+            finally: db.execute("DETACH DATABASE arc")
+        fold_archives(db,path.stem)
+    finally: db.close()
+    return moved
+
+def fold_archives(db,stem):
+    """Past ARCHIVE_FILES years, copy the oldest into the oldest file kept (named for its newest year)
+    and delete theirs. Rows keep their ids, so a crash before the unlink only leaves copies the next
+    run ignores."""
+    years=archive_years(stem)
+    if len(years)<=ARCHIVE_FILES: return
+    *old,into=years[:len(years)-ARCHIVE_FILES+1]
+    db.execute("ATTACH DATABASE ? AS arc",[str(archive_path(into,stem))]); ensure_archive_tables(db,"arc")
+    try:
+        for y in old:
+            db.execute("ATTACH DATABASE ? AS old",[str(archive_path(y,stem))]); ensure_archive_tables(db,"old")
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for t in ARCHIVED:
+                    cols=",".join(table_cols(db,t)); db.execute(f"INSERT OR IGNORE INTO arc.{t}({cols}) SELECT {cols} FROM old.{t}")
+                db.execute("COMMIT")
+            except Exception: db.execute("ROLLBACK"); raise
+            finally: db.execute("DETACH DATABASE old")
+            archive_path(y,stem).unlink()
+    finally: db.execute("DETACH DATABASE arc")
+
 CSS = """
 
 :root{
@@ -541,6 +1149,26 @@ document.addEventListener('DOMContentLoaded',()=>{
     });
   });
 
+  // Lazy fragments and in-place fragment forms
+  const frags=document.querySelectorAll('[data-frag]');
+  if(frags.length){
+    const io=window.IntersectionObserver&&new IntersectionObserver(es=>es.forEach(e=>{
+      if(e.isIntersecting){io.unobserve(e.target);loadFrag(e.target);}
+    }),{rootMargin:'200px'});
+    frags.forEach(el=>io?io.observe(el):loadFrag(el));
+  }
+  document.querySelectorAll('form[data-frag-post]').forEach(f=>{
+    f.addEventListener('submit',async e=>{
+      e.preventDefault();
+      const r=await fetch(f.dataset.fragPost,{method:'POST',body:new FormData(f)});
+      const t=await r.text();
+      if(!r.ok){showToast(t||'Request failed','danger');return;}
+      document.getElementById('frag-'+f.dataset.fragTarget).innerHTML=t;f.reset();
+      (f.dataset.fragAlso||'').split(' ').filter(Boolean).forEach(n=>loadFrag(document.getElementById('frag-'+n)));
+      const mo=f.closest('.modal-overlay');if(mo)mo.classList.remove('open');
+    });
+  });
+
   // Password strength
   const pw=document.getElementById('pw');const ps=document.getElementById('pwStrength');
   if(pw&&ps){
@@ -553,6 +1181,22 @@ document.addEventListener('DOMContentLoaded',()=>{
   }
 });
 
+// Live updates: live({type:fn(data),...}) listens on /events; a reset means we fell behind, so reload.
+function live(h){
+  if(!window.EventSource)return;
+  const es=new EventSource('/events');
+  Object.keys(h).forEach(k=>es.addEventListener(k,e=>h[k](JSON.parse(e.data))));
+  es.addEventListener('reset',()=>{es.close();location.reload();});
+}
+function esc(s){const d=document.createElement('div');d.textContent=s==null?'':s;return d.innerHTML;}
+function bump(k,n){document.querySelectorAll('[data-live="'+k+'"]').forEach(e=>e.textContent=Math.max(0,(parseInt(e.textContent)||0)+n));}
+
+// Fragments: <div data-frag="/url" id="frag-NAME"> loads when it scrolls into view. A form with
+// data-frag-post posts there and swaps frag-<data-frag-target> (plus any data-frag-also) in place.
+function loadFrag(el){
+  return fetch(el.dataset.frag).then(r=>r.text()).then(h=>{el.innerHTML=h;el.dataset.loaded=1;});
+}
+
 function showToast(msg,type){
   type=type||'info';
   const t=document.createElement('div');
@@ -581,6 +1225,8 @@ I = {
   "del":    '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M6 19c0 1.1.9 2 2 2h8c1.1 0 2-.9 2-2V7H6v12zM19 4h-3.5l-1-1h-5l-1 1H5v2h14V4z"/></svg>',
   "lnk":    '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M3.9 12c0-1.71 1.39-3.1 3.1-3.1h4V7H7c-2.76 0-5 2.24-5 5s2.24 5 5 5h4v-1.9H7c-1.71 0-3.1-1.39-3.1-3.1zM8 13h8v-2H8v2zm9-6h-4v1.9h4c1.71 0 3.1 1.39 3.1 3.1s-1.39 3.1-3.1 3.1h-4V17h4c2.76 0 5-2.24 5-5s-2.24-5-5-5z"/></svg>',
   "chk":    '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M9 16.17L4.83 12l-1.42 1.41L9 19 21 7l-1.41-1.41z"/></svg>',
+  "clk":    '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M11.99 2C6.47 2 2 6.48 2 12s4.47 10 9.99 10C17.52 22 22 17.52 22 12S17.52 2 11.99 2zM12 20c-4.42 0-8-3.58-8-8s3.58-8 8-8 8 3.58 8 8-3.58 8-8 8zm.5-13H11v6l5.25 3.15.75-1.23-4.5-2.67z"/></svg>',
+  "chart":  '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M5 9.2h3V19H5zM10.6 5h2.8v14h-2.8zm5.6 8H19v6h-2.8z"/></svg>',
   "x":      '<svg viewBox="0 0 24 24" fill="currentColor"><path d="M19 6.41L17.59 5 12 10.59 6.41 5 5 6.41 10.59 12 5 17.59 6.41 19 12 13.41 17.59 19 19 17.59 13.41 12z"/></svg>',
 }
 
@@ -592,11 +1238,13 @@ def head(title):
 <title>{title} — BizManager</title>
 {FONTS}<style>{CSS}</style></head>"""
 
-def layout(title, content, user, nav_active=""):
+def sidebar(user, nav_active):
     nav_cfg = ([
         ("/dashboard","grid","Dashboard"),
         ("/employees","ppl","Employees"),
         ("/invites","tkt","Invite Codes"),
+        ("/analytics","chart","Analytics"),
+        ("/jobs","clk","Jobs"),
         ("/profile","usr","My Profile"),
     ] if user["role"]=="owner" else [
         ("/dashboard","grid","Dashboard"),
@@ -605,11 +1253,7 @@ def layout(title, content, user, nav_active=""):
     nav = "".join(f'<a href="{h}" class="nav-link {"active" if nav_active.startswith(h) else ""}">{I[ic]} {lb}</a>'
                   for h,ic,lb in nav_cfg)
     ini = initials(user["full_name"])
-    return f"""{head(title)}<body>
-<div id="sidebarOverlay" style="display:none;position:fixed;inset:0;background:rgba(15,23,42,.45);backdrop-filter:blur(4px);z-index:99;"></div>
-<button id="sidebarToggle" class="sidebar-toggle">&#9776;</button>
-<div class="app-wrapper">
-<aside id="sidebar" class="sidebar">
+    return f"""<aside id="sidebar" class="sidebar">
   <a href="/dashboard" class="sidebar-brand">
     <div class="brand-icon">{I["bag"]}</div><span>BizManager</span>
   </a>
@@ -626,7 +1270,15 @@ def layout(title, content, user, nav_active=""):
     </div>
     <a href="/logout" class="nav-link" style="color:rgba(255,130,130,.9);">{I["out"]} Sign Out</a>
   </div>
-</aside>
+</aside>"""
+
+def layout(title, content, user, nav_active=""):
+    side = cached(("sidebar",user["id"],nav_active),(f"user:{user['id']}",),lambda: sidebar(user,nav_active))
+    return f"""{head(title)}<body>
+<div id="sidebarOverlay" style="display:none;position:fixed;inset:0;background:rgba(15,23,42,.45);backdrop-filter:blur(4px);z-index:99;"></div>
+<button id="sidebarToggle" class="sidebar-toggle">&#9776;</button>
+<div class="app-wrapper">
+{side}
 <main class="main-content">
   {flash_html()}
   {content}
@@ -699,14 +1351,9 @@ def register_owner():
         fd=request.form
         name=fd.get("full_name","").strip(); email=fd.get("email","").strip().lower()
         pw=fd.get("password",""); pw2=fd.get("confirm_password","")
-        if not name: errors.append("Full name required.")
-        if "@" not in email: errors.append("Valid email required.")
-        if len(pw)<8: errors.append("Password must be 8+ characters.")
-        if pw!=pw2: errors.append("Passwords don\'t match.")
-        if q("SELECT id FROM users WHERE email=?",[email],one=True): errors.append("Email already in use.")
+        errors+=user_errors(email,pw,name,pw2)
         if not errors:
-            m("INSERT INTO users(email,password_hash,full_name,role,status,payment_status,created_at) VALUES(?,?,?,?,?,?,?)",
-              [email,hash_pw(pw),name,"owner","active","paid",now()])
+            create_user(email,pw,name,"owner")
             flash("Owner account created! Please sign in.","success")
             return redir("/login")
     errs="".join(f'<div class="alert alert-danger">&#x2715; {e}</div>' for e in errors)
@@ -745,15 +1392,10 @@ def register_employee():
         pw=fd.get("password",""); pw2=fd.get("confirm_password","")
         inv=q("SELECT * FROM invite_codes WHERE code=?",[code_s],one=True)
         if not inv or not inv["is_active"] or inv["used_by_id"]: errors.append("Invalid or already-used invite code.")
-        if not name: errors.append("Full name required.")
-        if "@" not in email: errors.append("Valid email required.")
-        if len(pw)<8: errors.append("Password must be 8+ characters.")
-        if pw!=pw2: errors.append("Passwords don\'t match.")
-        if email and q("SELECT id FROM users WHERE email=?",[email],one=True): errors.append("Email already in use.")
+        errors+=user_errors(email,pw,name,pw2)
         if not errors:
-            uid=m("INSERT INTO users(email,password_hash,full_name,role,status,payment_status,created_at) VALUES(?,?,?,?,?,?,?)",
-                  [email,hash_pw(pw),name,"employee","active","unpaid",now()])
-            m("UPDATE invite_codes SET used_by_id=? WHERE id=?",[uid,inv["id"]])
+            uid=create_user(email,pw,name,owner_id=inv["owner_id"])
+            m("UPDATE invite_codes SET used_by_id=? WHERE id=?",[uid,inv["id"]],ev=(inv["owner_id"],"invite_used",{"id":inv["id"],"used_by_id":uid,"name":name}),tags=(f"invites:{inv['owner_id']}",))
             flash("Account created! Please sign in.","success")
             return redir("/login")
     errs="".join(f'<div class="alert alert-danger">&#x2715; {e}</div>' for e in errors)
@@ -796,29 +1438,34 @@ def dashboard():
     return owner_dash(u) if u["role"]=="owner" else emp_dash(u)
 
 def owner_dash(u):
-    emps=q("SELECT * FROM users WHERE role='employee'")
+    oid=u["id"]; cnt=cached(("dash",oid),(f"user:{oid}",f"emps:{oid}",f"invites:{oid}"),lambda: dash_body(u))
+    return layout("Dashboard",cnt,u,"/dashboard")
+
+def dash_body(u):
+    emps=find_employees(u["id"],order="id",cols=EMP_ROW)
     total=len(emps); active=sum(1 for e in emps if e["status"]=="active")
     unpaid=sum(1 for e in emps if e["payment_status"]=="unpaid")
-    codes=q("SELECT * FROM invite_codes WHERE owner_id=? ORDER BY created_at DESC LIMIT 8",[u["id"]])
+    codes=invite_list(u["id"],limit=8)
     open_inv=sum(1 for c in codes if c["is_active"] and not c["used_by_id"])
+    per=pay_period(u["id"]); cyc=per["cycle"] if per else "manual"; ends=per and period_end(per["starts_at"],cyc)
+    period=(f"Pay period since {fdate(per['starts_at'])}"+(f", rolls over {fdate(ends)}" if ends else "") if per
+            else "No pay period started yet")
+    cycles="".join(f'<option value="{c}" {"selected" if c==cyc else ""}>{c.capitalize()}</option>' for c in PAY_CYCLES)
     rows=""
     for e in emps[:8]:
         ini=initials(e["full_name"])
-        rows+=f"""<tr>
+        rows+=f"""<tr id="emp-{e["id"]}">
           <td><div class="d-flex align-center gap-2">
             <div class="emp-avatar" style="width:34px;height:34px;font-size:12px;">{ini}</div>
             <div><div style="font-weight:600;font-size:13px;">{escape(e["full_name"])}</div>
             <div class="text-muted text-xs">{escape(e["position"] or e["email"])}</div></div></div></td>
           <td><span class="badge badge-{e["status"]}">{e["status"]}</span></td>
-          <td><span class="badge badge-{e["payment_status"]}">{e["payment_status"]}</span></td>
+          <td><span class="badge badge-{e["payment_status"]}" data-pay>{e["payment_status"]}</span></td>
           <td><a href="/employees/{e["id"]}" class="btn btn-ghost btn-sm btn-icon">{I["arr"]}</a></td></tr>"""
     if not rows: rows='<tr><td colspan="4" style="text-align:center;padding:40px;color:var(--gray-400);">No employees yet. Generate an invite code to get started.</td></tr>'
     codeshtml=""
     for c in codes:
-        ub=""
-        if c["used_by_id"]:
-            r=q("SELECT full_name FROM users WHERE id=?",[c["used_by_id"]],one=True)
-            ub=f" by {escape(r['full_name'])}" if r else ""
+        ub=f" by {escape(c['used_by_name'])}" if c["used_by_name"] else ""
         valid=c["is_active"] and not c["used_by_id"]
         bg="rgba(16,185,129,.06)" if valid else "rgba(100,116,139,.06)"
         bc="rgba(16,185,129,.15)" if valid else "rgba(226,232,240,.8)"
@@ -826,41 +1473,47 @@ def owner_dash(u):
         st="Active" if valid else ("Used"+ub if c["used_by_id"] else "Off")
         bclass="badge-active" if valid else "badge-inactive"
         lb="Open" if valid else ("Used" if c["used_by_id"] else "Off")
-        codeshtml+=f"""<div style="display:flex;align-items:center;justify-content:space-between;
+        codeshtml+=f"""<div id="code-{c["id"]}" style="display:flex;align-items:center;justify-content:space-between;
           padding:12px 14px;background:{bg};border-radius:var(--radius-md);border:1px solid {bc};">
           <div><div style="font-family:monospace;font-weight:700;font-size:13px;color:{tc};">{c["code"]}</div>
-          <div class="text-xs text-muted mt-1">{st}</div></div>
-          <span class="badge {bclass}">{lb}</span></div>"""
+          <div class="text-xs text-muted mt-1" data-st>{st}</div></div>
+          <span class="badge {bclass}" data-badge>{lb}</span></div>"""
     if not codeshtml: codeshtml='<p class="text-muted text-sm text-center" style="padding:16px;">No codes yet.</p>'
     first=u["full_name"].split()[0]
     cnt=f"""
     <div class="topbar">
       <div><div class="page-title">Dashboard</div>
-      <div class="page-subtitle">Good to see you, {escape(first)} &#128075;</div></div>
+      <div class="page-subtitle">Good to see you, {escape(first)} &#128075; &middot; {period}</div></div>
       <div class="topbar-actions">
+        <form method="POST" action="/pay-period" class="d-flex align-center gap-2">
+          <select name="cycle" class="form-control" style="width:auto;padding:6px 10px;font-size:13px;" title="Pay cycle"
+                  onchange="this.form.submit()">{cycles}</select>
+          <button name="action" value="rollover" class="btn btn-secondary btn-sm"
+                  onclick="return confirm('Start a new pay period? Employees without a payment in it show as unpaid.')">{I["cash"]} New Pay Period</button>
+        </form>
         <a href="/employees" class="btn btn-secondary btn-sm">{I["ppl"]} Employees</a>
         <a href="/invites" class="btn btn-primary btn-sm">{I["plus"]} New Invite</a>
       </div>
     </div>
     <div class="stats-grid">
       <div class="stat-card"><div class="stat-icon blue">{I["ppl"]}</div>
-        <div class="stat-value">{total}</div><div class="stat-label">Total Employees</div></div>
+        <div class="stat-value" data-live="total">{total}</div><div class="stat-label">Total Employees</div></div>
       <div class="stat-card"><div class="stat-icon green">{I["chk"]}</div>
-        <div class="stat-value">{active}</div><div class="stat-label">Active</div></div>
+        <div class="stat-value" data-live="active">{active}</div><div class="stat-label">Active</div></div>
       <div class="stat-card"><div class="stat-icon orange">{I["cash"]}</div>
-        <div class="stat-value">{unpaid}</div><div class="stat-label">Unpaid</div></div>
+        <div class="stat-value" data-live="unpaid">{unpaid}</div><div class="stat-label">Unpaid</div></div>
       <div class="stat-card"><div class="stat-icon blue">{I["tkt"]}</div>
-        <div class="stat-value">{open_inv}</div><div class="stat-label">Open Invites</div></div>
+        <div class="stat-value" data-live="open">{open_inv}</div><div class="stat-label">Open Invites</div></div>
     </div>
     <div style="display:grid;grid-template-columns:1fr 360px;gap:24px;" class="rg">
       <div class="card">
         <div class="card-header">
-          <div><div class="card-title">Recent Employees</div><div class="card-subtitle">{total} total</div></div>
+          <div><div class="card-title">Recent Employees</div><div class="card-subtitle"><span data-live="total">{total}</span> total</div></div>
           <a href="/employees" class="btn btn-ghost btn-sm">{I["arr"]} View all</a>
         </div>
         <div class="table-wrap"><table>
           <thead><tr><th>Employee</th><th>Status</th><th>Payment</th><th></th></tr></thead>
-          <tbody>{rows}</tbody></table></div>
+          <tbody id="empRows">{rows}</tbody></table></div>
       </div>
       <div class="card">
         <div class="card-header">
@@ -871,12 +1524,52 @@ def owner_dash(u):
         <div class="mt-4"><a href="/invites" class="btn btn-primary w-100">{I["plus"]} Generate New Code</a></div>
       </div>
     </div>
-    <style>@media(max-width:900px){{.rg{{grid-template-columns:1fr!important;}}}}</style>"""
-    return layout("Dashboard",cnt,u,"/dashboard")
+    <style>@media(max-width:900px){{.rg{{grid-template-columns:1fr!important;}}}}</style>
+    <script>
+    document.addEventListener("DOMContentLoaded",()=>live({{
+      employee:d=>{{
+        const tb=document.getElementById("empRows");if(tb.querySelector("td[colspan]"))tb.innerHTML="";
+        tb.insertAdjacentHTML("afterbegin",`<tr id="emp-${{d.id}}">
+          <td><div class="d-flex align-center gap-2">
+            <div class="emp-avatar" style="width:34px;height:34px;font-size:12px;">${{esc(d.initials)}}</div>
+            <div><div style="font-weight:600;font-size:13px;">${{esc(d.full_name)}}</div>
+            <div class="text-muted text-xs">${{esc(d.position||d.email)}}</div></div></div></td>
+          <td><span class="badge badge-active">active</span></td>
+          <td><span class="badge badge-unpaid" data-pay>unpaid</span></td>
+          <td><a href="/employees/${{d.id}}" class="btn btn-ghost btn-sm btn-icon">{I["arr"]}</a></td></tr>`);
+        while(tb.rows.length>8)tb.deleteRow(-1);
+        bump("total",1);bump("active",1);bump("unpaid",1);
+      }},
+      paid:d=>{{
+        const b=document.querySelector(`#emp-${{d.id}} [data-pay]`);
+        if(b){{b.className="badge badge-paid";b.textContent="paid";}}
+        bump("unpaid",-1);
+      }},
+      invite_used:d=>{{
+        const c=document.getElementById("code-"+d.id);if(!c)return;
+        c.querySelector("[data-st]").textContent="Used by "+d.name;
+        const b=c.querySelector("[data-badge]");b.className="badge badge-inactive";b.textContent="Used";
+        bump("open",-1);
+      }},
+      period:()=>location.reload(),
+    }}));
+    </script>"""
+    return cnt
+
+@app.route("/pay-period", methods=["POST"])
+@owner_req
+def new_pay_period():
+    u=me()
+    if request.form.get("action")=="rollover":
+        n=rollover(u["id"]); flash(f"New pay period started; {n} employee{'' if n==1 else 's'} changed payment status.","success")
+    else:
+        try: set_pay_cycle(u["id"],request.form.get("cycle","")); flash("Pay cycle updated.","success")
+        except ValueError as e: flash(str(e),"danger")
+    return redir("/dashboard")
 
 def emp_dash(u):
-    pays=q("SELECT * FROM payment_records WHERE employee_id=? ORDER BY paid_on DESC LIMIT 5",[u["id"]])
-    nts=q("SELECT * FROM notes WHERE employee_id=? ORDER BY created_at DESC LIMIT 5",[u["id"]])
+    pays=emp_payments(u["owner_id"],u["id"],limit=5)
+    nts=emp_notes(u["owner_id"],u["id"],limit=5)
     ini=initials(u["full_name"]); first=u["full_name"].split()[0]
     sc="green" if u["status"]=="active" else "red" if u["status"]=="suspended" else "orange"
     pc="green" if u["payment_status"]=="paid" else "orange"
@@ -884,7 +1577,7 @@ def emp_dash(u):
       padding:12px 14px;background:rgba(16,185,129,.05);border:1px solid rgba(16,185,129,.12);border-radius:var(--radius-md);">
       <div><div style="font-weight:600;font-size:13px;">{escape(p["period"] or "Payment")}</div>
       <div class="text-xs text-muted mt-1">{fdate(p["paid_on"])}</div></div>
-      <span style="font-weight:800;font-size:15px;color:var(--success);">{p["currency"]} {float(p["amount"]):.2f}</span>
+      <span style="font-weight:800;font-size:15px;color:var(--success);">{money(p["amount_minor"],p["currency"])}</span>
     </div>""" for p in pays) or '<p class="text-muted text-sm text-center" style="padding:16px;">No payments yet.</p>'
     nitems="".join(f"""<div style="padding:12px 14px;background:rgba(245,158,11,.06);
       border:1px solid rgba(245,158,11,.15);border-radius:var(--radius-md);">
@@ -894,7 +1587,7 @@ def emp_dash(u):
       <div class="card-header"><div class="card-title">{I["nte"]} Notes from Management</div></div>
       <div style="display:grid;grid-template-columns:repeat(auto-fill,minmax(250px,1fr));gap:14px;">{nitems}</div>
     </div>""" if nts else ""
-    cnt_pays=q("SELECT COUNT(*) as c FROM payment_records WHERE employee_id=?",[u["id"]],one=True)["c"]
+    cnt_pays=q("SELECT COUNT(*) as c FROM payment_records WHERE owner_id=? AND employee_id=?",[u["owner_id"],u["id"]],one=True,tenant=u["owner_id"])["c"]
     cnt=f"""
     <div class="topbar">
       <div><div class="page-title">My Dashboard</div>
@@ -909,7 +1602,7 @@ def emp_dash(u):
         <div class="stat-value" style="font-size:20px;margin-top:4px;">{u["payment_status"].capitalize()}</div>
         <div class="stat-label">Payment Status</div></div>
       <div class="stat-card"><div class="stat-icon blue">{I["ppl"]}</div>
-        <div class="stat-value" style="font-size:18px;margin-top:4px;">{fdate(u["created_at"][:10])}</div>
+        <div class="stat-value" style="font-size:18px;margin-top:4px;">{fdate(u["created_at"])}</div>
         <div class="stat-label">Member Since</div></div>
       <div class="stat-card"><div class="stat-icon green">{I["cash"]}</div>
         <div class="stat-value" style="font-size:20px;margin-top:4px;">{cnt_pays}</div>
@@ -956,17 +1649,19 @@ def profile():
     if request.method=="POST":
         phone=request.form.get("phone","").strip()
         npw=request.form.get("new_password",""); cpw=request.form.get("confirm_password","")
+        tags=(f"user:{u['id']}",f"emps:{u['owner_id']}")
         if npw:
             if npw!=cpw: flash("Passwords don\'t match.","danger"); return redir("/profile")
             if len(npw)<8: flash("Password must be 8+ characters.","danger"); return redir("/profile")
-            m("UPDATE users SET phone=?,password_hash=? WHERE id=?",[phone,hash_pw(npw),u["id"]])
-        else: m("UPDATE users SET phone=? WHERE id=?",[phone,u["id"]])
+            m("UPDATE users SET phone=?,password_hash=? WHERE id=?",[phone,hash_pw(npw),u["id"]],tags=tags)
+        else: m("UPDATE users SET phone=? WHERE id=?",[phone,u["id"]],tags=tags)
         flash("Profile updated.","success"); return redir("/profile")
-    u=me(); pays=q("SELECT * FROM payment_records WHERE employee_id=? ORDER BY paid_on DESC",[u["id"]])
+    arch=request.args.get("history")=="all"
+    u=me(); pays=emp_payments(u["owner_id"],u["id"],archived=arch)
     ini=initials(u["full_name"])
     prows="".join(f"""<tr>
       <td><div style="font-weight:600;">{escape(p["period"] or "—")}</div></td>
-      <td><span style="font-weight:700;color:var(--success);">{p["currency"]} {float(p["amount"]):.2f}</span></td>
+      <td><span style="font-weight:700;color:var(--success);">{money(p["amount_minor"],p["currency"])}</span></td>
       <td class="text-muted text-sm">{escape(p["method"] or "—")}</td>
       <td class="text-muted text-sm">{fdate(p["paid_on"])}</td></tr>""" for p in pays) or \
       '<tr><td colspan="4" class="text-center text-muted" style="padding:24px;">No payments yet.</td></tr>'
@@ -1006,7 +1701,7 @@ def profile():
         <button type="submit" class="btn btn-primary w-100">{I["chk"]} Save Changes</button>
       </form>
       <div class="card">
-        <div class="card-header"><div class="card-title">{I["crd"]} Payment History</div></div>
+        <div class="card-header"><div class="card-title">{I["crd"]} Payment History</div>{hist_link("/profile",arch,u["owner_id"])}</div>
         <div class="table-wrap"><table>
           <thead><tr><th>Period</th><th>Amount</th><th>Method</th><th>Date</th></tr></thead>
           <tbody>{prows}</tbody></table></div>
@@ -1022,12 +1717,11 @@ def profile():
 def employees():
     u=me(); qp=request.args.get("q","").strip()
     st=request.args.get("status",""); py=request.args.get("payment","")
-    sql="SELECT * FROM users WHERE role=\'employee\'"; args=[]
-    if qp: sql+=" AND (full_name LIKE ? OR email LIKE ?)"; args+=[f"%{qp}%",f"%{qp}%"]
-    if st: sql+=" AND status=?"; args.append(st)
-    if py: sql+=" AND payment_status=?"; args.append(py)
-    sql+=" ORDER BY full_name"
-    emps=q(sql,args)
+    cnt=cached(("employees",u["id"],qp,st,py),(f"emps:{u['id']}",),lambda: employees_body(u["id"],qp,st,py))
+    return layout("Employees",cnt,u,"/employees")
+
+def employees_body(oid,qp,st,py):
+    emps=employee_list(oid,qp,st,py)
     cards=""
     for e in emps:
         ini=initials(e["full_name"])
@@ -1045,7 +1739,7 @@ def employees():
           <div class="text-xs text-muted" style="margin-top:10px;">&#128231; {escape(e["email"])}</div>
           {ph}
           <div class="text-xs text-muted" style="margin-top:8px;padding-top:8px;border-top:1px solid var(--gray-200);">
-            Joined {fdate(e["created_at"][:10])}</div>
+            Joined {fdate(e["created_at"])}</div>
         </a>"""
     if not cards: cards=f"""<div class="card" style="text-align:center;padding:60px 20px;">
       <div style="font-size:48px;margin-bottom:16px;">&#128101;</div>
@@ -1077,75 +1771,49 @@ def employees():
       {clr}
     </form>
     <div class="employee-grid">{cards}</div>"""
-    return layout("Employees",cnt,u,"/employees")
+    return cnt
 
 @app.route("/employees/<int:eid>", methods=["GET","POST"])
 @owner_req
 def employee_detail(eid):
-    u=me(); emp=q("SELECT * FROM users WHERE id=? AND role=\'employee\'",[eid],one=True)
+    u=me(); emp=get_employee(u["id"],eid)
     if not emp: flash("Employee not found.","danger"); return redir("/employees")
     if request.method=="POST":
         act=request.form.get("action")
         if act=="update_profile":
-            m("UPDATE users SET full_name=?,position=?,phone=?,status=?,payment_status=? WHERE id=?",
+            m("UPDATE users SET full_name=?,position=?,phone=?,status=? WHERE id=?",
               [request.form.get("full_name",emp["full_name"]).strip(),
                request.form.get("position","").strip(),
                request.form.get("phone","").strip(),
-               request.form.get("status",emp["status"]),
-               request.form.get("payment_status",emp["payment_status"]),eid])
+               request.form.get("status",emp["status"]),eid],tags=(f"user:{eid}",f"emps:{u['id']}"))
             flash("Profile updated.","success")
         elif act=="add_payment":
             try:
-                amt=float(request.form.get("amount",0))
-                m("INSERT INTO payment_records(employee_id,amount,currency,period,method,reference,notes,paid_on) VALUES(?,?,?,?,?,?,?,?)",
-                  [eid,amt,request.form.get("currency","USD"),request.form.get("period",""),
-                   request.form.get("method",""),request.form.get("reference",""),
-                   request.form.get("payment_notes",""),now()])
-                m("UPDATE users SET payment_status=\'paid\' WHERE id=?",[eid])
+                f=request.form
+                add_payment(u["id"],eid,f.get("amount",0),f.get("currency","USD"),f.get("period",""),
+                            f.get("method",""),f.get("reference",""),f.get("payment_notes",""))
                 flash("Payment recorded.","success")
             except ValueError: flash("Invalid amount.","danger")
         elif act=="add_note":
             cn=request.form.get("note_content","").strip()
             if cn:
-                m("INSERT INTO notes(employee_id,author_id,content,created_at) VALUES(?,?,?,?)",
-                  [eid,u["id"],cn,now()])
+                add_note(u["id"],eid,u["id"],cn)
                 flash("Note added.","success")
         return redir(f"/employees/{eid}")
-    emp=q("SELECT * FROM users WHERE id=?",[eid],one=True)
-    pays=q("SELECT * FROM payment_records WHERE employee_id=? ORDER BY paid_on DESC",[eid])
-    nts=q("""SELECT n.*,u.full_name as aname FROM notes n
-             JOIN users u ON n.author_id=u.id WHERE n.employee_id=? ORDER BY n.created_at DESC""",[eid])
-    ini=initials(emp["full_name"])
-    total=sum(float(p["amount"]) for p in pays)
-    prows="".join(f"""<tr>
-      <td><div style="font-weight:600;">{escape(p["period"] or "—")}</div>
-          {f'<div class="text-xs text-muted">Ref: {escape(p["reference"])}</div>' if p["reference"] else ""}</td>
-      <td><span style="font-weight:700;color:var(--success);">{p["currency"]} {float(p["amount"]):.2f}</span></td>
-      <td>{escape(p["method"] or "—")}</td>
-      <td class="text-muted text-sm">{fdate(p["paid_on"])}</td></tr>""" for p in pays) or \
-      '<tr><td colspan="4" class="text-center text-muted" style="padding:30px;">No payments yet.</td></tr>'
-    trow=f"""<div style="margin-top:16px;padding:14px 16px;background:rgba(16,185,129,.08);
-      border-radius:var(--radius-md);display:flex;justify-content:space-between;align-items:center;">
-      <span style="font-weight:600;">Total Paid</span>
-      <span style="font-size:18px;font-weight:800;color:var(--success);">USD {total:.2f}</span></div>""" if pays else ""
-    nhtml="".join(f"""<div id="note-{n["id"]}" style="padding:12px 14px;background:rgba(245,158,11,.06);
-      border:1px solid rgba(245,158,11,.15);border-radius:var(--radius-md);">
-      <p style="font-size:13px;color:var(--gray-700);">{escape(n["content"])}</p>
-      <div style="display:flex;justify-content:space-between;align-items:center;">
-        <span class="text-xs text-muted">{escape(n["aname"])} · {fdate(n["created_at"])}</span>
-        <button onclick="delNote({n["id"]})" class="btn btn-danger btn-sm btn-icon">{I["del"]}</button>
-      </div></div>""" for n in nts) or '<p class="text-muted text-sm text-center" style="padding:16px;">No notes yet.</p>'
+    arch=request.args.get("history")=="all"; qs="?history=all" if arch else ""
+    frag=lambda name: f'''<div id="frag-{name}" data-frag="/employees/{eid}/{name}{qs}">
+      <p class="text-muted text-sm text-center" style="padding:24px;">Loading…</p></div>'''
     sel=lambda a,b: "selected" if a==b else ""
     cnt=f"""
     <div class="topbar">
       <div style="display:flex;align-items:center;gap:16px;">
         <a href="/employees" class="btn btn-ghost btn-sm btn-icon">{I["bck"]}</a>
         <div><div class="page-title">{escape(emp["full_name"])}</div>
-        <div class="page-subtitle">{escape(emp["position"] or "Employee")} · Joined {fdate(emp["created_at"][:10])}</div></div>
+        <div class="page-subtitle">{escape(emp["position"] or "Employee")} · Joined {fdate(emp["created_at"])}</div></div>
       </div>
       <div class="d-flex gap-2">
         <span class="badge badge-{emp["status"]}" style="font-size:13px;padding:7px 14px;">{emp["status"]}</span>
-        <span class="badge badge-{emp["payment_status"]}" style="font-size:13px;padding:7px 14px;">{emp["payment_status"]}</span>
+        <span id="payBadge" class="badge badge-{emp["payment_status"]}" style="font-size:13px;padding:7px 14px;">{emp["payment_status"]}</span>
       </div>
     </div>
     <div style="display:grid;grid-template-columns:1fr 1fr;gap:24px;" class="dg">
@@ -1170,10 +1838,8 @@ def employee_detail(eid):
                   <option value="suspended" {sel(emp["status"],"suspended")}>&#10005; Suspended</option>
                 </select></div>
               <div class="form-group"><label class="form-label">Payment</label>
-                <select name="payment_status" class="form-control">
-                  <option value="paid" {sel(emp["payment_status"],"paid")}>&#10003; Paid</option>
-                  <option value="unpaid" {sel(emp["payment_status"],"unpaid")}>&#9675; Unpaid</option>
-                </select></div>
+                <input class="form-control" value="{emp["payment_status"].capitalize()} this period" disabled
+                       title="Set by recording a payment; resets when a new pay period starts"/></div>
             </div>
             <div class="form-group"><label class="form-label">Email</label>
               <input class="form-control" value="{escape(emp["email"])}" disabled/></div>
@@ -1182,39 +1848,38 @@ def employee_detail(eid):
         </div>
         <div class="card">
           <div class="card-header"><div class="card-title">{I["nte"]} Notes</div></div>
-          <form method="POST" class="mb-3">
+          <form method="POST" class="mb-3" data-frag-post="/employees/{eid}/notes{qs}" data-frag-target="notes">
             <input type="hidden" name="action" value="add_note"/>
             <div class="form-group">
               <textarea name="note_content" class="form-control"
                         placeholder="Add a note about this employee…" rows="3"></textarea></div>
             <button type="submit" class="btn btn-secondary btn-sm">{I["plus"]} Add Note</button>
           </form>
-          <div style="display:flex;flex-direction:column;gap:10px;">{nhtml}</div>
+          {frag("notes")}
         </div>
       </div>
       <div>
         <div class="card">
           <div class="card-header">
             <div class="card-title">{I["crd"]} Payments</div>
-            <button type="button" class="btn btn-primary btn-sm" data-modal="payModal">{I["plus"]} Record</button>
+            <div class="d-flex gap-2">{hist_link(f"/employees/{eid}",arch,u["id"])}
+            <button type="button" class="btn btn-primary btn-sm" data-modal="payModal">{I["plus"]} Record</button></div>
           </div>
-          <div class="table-wrap"><table>
-            <thead><tr><th>Period</th><th>Amount</th><th>Method</th><th>Date</th></tr></thead>
-            <tbody>{prows}</tbody></table></div>
-          {trow}
+          {frag("payments")}
+          {frag("totals")}
         </div>
       </div>
     </div>
     <div id="payModal" class="modal-overlay">
       <div class="modal-box">
         <h3 class="modal-title">{I["cash"]} Record Payment</h3>
-        <form method="POST">
+        <form method="POST" data-frag-post="/employees/{eid}/payments{qs}" data-frag-target="payments" data-frag-also="totals">
           <input type="hidden" name="action" value="add_payment"/>
           <div class="form-row">
             <div class="form-group"><label class="form-label">Amount</label>
               <input type="number" name="amount" class="form-control" step="0.01" placeholder="0.00" required min="0"/></div>
             <div class="form-group"><label class="form-label">Currency</label>
-              <select name="currency" class="form-control"><option>USD</option><option>EUR</option><option>GBP</option><option>CAD</option></select></div>
+              <select name="currency" class="form-control">{cur_options()}</select></div>
           </div>
           <div class="form-row">
             <div class="form-group"><label class="form-label">Period</label>
@@ -1237,19 +1902,106 @@ def employee_detail(eid):
     <script>
     async function delNote(id){{
       if(!confirm("Delete this note?"))return;
-      const r=await fetch("/api/notes/"+id+"/delete",{{method:"DELETE"}});
-      const d=await r.json();
-      if(d.ok){{const el=document.getElementById("note-"+id);
-        if(el){{el.style.transition="opacity .3s,transform .3s";el.style.opacity="0";el.style.transform="scale(.95)";
-          setTimeout(()=>el.remove(),300);}}}}
+      const r=await fetch("/employees/{eid}/notes/"+id+"{qs}",{{method:"DELETE"}});
+      if(r.ok)document.getElementById("frag-notes").innerHTML=await r.text();
     }}
+    document.addEventListener("DOMContentLoaded",()=>live({{
+      payment:d=>{{
+        const tb=document.getElementById("payRows");
+        if(d.employee_id!=={eid}||!tb||document.getElementById("pay-"+d.id))return;
+        if(tb.querySelector("td[colspan]"))tb.innerHTML="";
+        tb.insertAdjacentHTML("afterbegin",`<tr id="pay-${{d.id}}">
+          <td><div style="font-weight:600;">${{esc(d.period||"—")}}</div>
+              ${{d.reference?`<div class="text-xs text-muted">Ref: ${{esc(d.reference)}}</div>`:""}}</td>
+          <td><span style="font-weight:700;color:var(--success);">${{esc(d.amount)}}</span></td>
+          <td>${{esc(d.method||"—")}}</td><td class="text-muted text-sm">${{esc(d.paid_on)}}</td></tr>`);
+        const t=document.getElementById("frag-totals");if(t.dataset.loaded)loadFrag(t);
+      }},
+      paid:d=>{{if(d.id==={eid}){{const b=document.getElementById("payBadge");b.className=b.className.replace("badge-unpaid","badge-paid");b.textContent="paid";}}}},
+      note:d=>{{
+        const nl=document.getElementById("noteList");
+        if(d.employee_id!=={eid}||!nl||document.getElementById("note-"+d.id))return;
+        if(nl.querySelector("p.text-center"))nl.innerHTML="";
+        nl.insertAdjacentHTML("afterbegin",`<div id="note-${{d.id}}" style="padding:12px 14px;background:rgba(245,158,11,.06);
+          border:1px solid rgba(245,158,11,.15);border-radius:var(--radius-md);">
+          <p style="font-size:13px;color:var(--gray-700);">${{esc(d.content)}}</p>
+          <div style="display:flex;justify-content:space-between;align-items:center;">
+            <span class="text-xs text-muted">${{esc(d.author)}} · ${{esc(d.created_at)}}</span>
+            <button onclick="delNote(${{d.id}})" class="btn btn-danger btn-sm btn-icon">{I["del"]}</button>
+          </div></div>`);
+      }},
+      note_deleted:d=>{{const el=document.getElementById("note-"+d.id);if(el)el.remove();}},
+    }}));
     </script>"""
     return layout(emp["full_name"],cnt,u,"/employees")
 
+# Fragments of employee_detail, loaded when scrolled into view and swapped in place after a
+# mutation. Conditional GETs (ETag) let the browser revalidate them without a re-download.
+def fragment(html,code=200):
+    r=make_response(html,code); r.headers["Cache-Control"]="private, no-cache"
+    if code!=200: return r
+    r.add_etag(); return r.make_conditional(request)
+
+def payments_frag(oid,eid,arch):
+    rows="".join(f"""<tr id="pay-{p["id"]}">
+      <td><div style="font-weight:600;">{escape(p["period"] or "—")}</div>
+          {f'<div class="text-xs text-muted">Ref: {escape(p["reference"])}</div>' if p["reference"] else ""}</td>
+      <td><span style="font-weight:700;color:var(--success);">{money(p["amount_minor"],p["currency"])}</span></td>
+      <td>{escape(p["method"] or "—")}</td>
+      <td class="text-muted text-sm">{fdate(p["paid_on"])}</td></tr>""" for p in emp_payments(oid,eid,archived=arch)) or \
+      '<tr><td colspan="4" class="text-center text-muted" style="padding:30px;">No payments yet.</td></tr>'
+    return f"""<div class="table-wrap"><table>
+      <thead><tr><th>Period</th><th>Amount</th><th>Method</th><th>Date</th></tr></thead>
+      <tbody id="payRows">{rows}</tbody></table></div>"""
+
+def totals_frag(oid,eid,arch):
+    totals=pay_totals(oid,eid,archived=arch)
+    if not totals: return ""
+    return f"""<div style="margin-top:16px;padding:14px 16px;background:rgba(16,185,129,.08);
+      border-radius:var(--radius-md);display:flex;justify-content:space-between;align-items:center;">
+      <span style="font-weight:600;">Total Paid</span>
+      <span style="font-size:18px;font-weight:800;color:var(--success);text-align:right;">{"<br/>".join(money(t["total"],t["currency"]) for t in totals)}</span></div>"""
+
+def notes_frag(oid,eid,arch):
+    html="".join(f"""<div id="note-{n["id"]}" style="padding:12px 14px;background:rgba(245,158,11,.06);
+      border:1px solid rgba(245,158,11,.15);border-radius:var(--radius-md);">
+      <p style="font-size:13px;color:var(--gray-700);">{escape(n["content"])}</p>
+      <div style="display:flex;justify-content:space-between;align-items:center;">
+        <span class="text-xs text-muted">{escape(n["aname"])} · {fdate(n["created_at"])}</span>
+        <button onclick="delNote({n["id"]})" class="btn btn-danger btn-sm btn-icon">{I["del"]}</button>
+      </div></div>""" for n in emp_notes(oid,eid,author=True,archived=arch)) or '<p class="text-muted text-sm text-center" style="padding:16px;">No notes yet.</p>'
+    return f'<div id="noteList" style="display:flex;flex-direction:column;gap:10px;">{html}</div>'
+
+FRAGMENTS={"payments":payments_frag,"totals":totals_frag,"notes":notes_frag}
+
+@app.route("/employees/<int:eid>/<any(payments,totals,notes):name>", methods=["GET","POST"])
+@owner_req
+def employee_fragment(eid,name):
+    """GET renders one section; POST adds a payment or note and returns the refreshed section."""
+    u=me(); arch=request.args.get("history")=="all"
+    if not get_employee(u["id"],eid): return fragment("Employee not found.",404)
+    if request.method=="POST":
+        f=request.form
+        if name=="payments":
+            try: add_payment(u["id"],eid,f.get("amount",0),f.get("currency","USD"),f.get("period",""),
+                             f.get("method",""),f.get("reference",""),f.get("payment_notes",""))
+            except ValueError: return fragment("Invalid amount.",400)
+        elif name=="notes" and f.get("note_content","").strip(): add_note(u["id"],eid,u["id"],f["note_content"].strip())
+        elif name=="notes": return fragment("Note is empty.",400)
+        else: return fragment("Method not allowed.",405)
+    return fragment(FRAGMENTS[name](u["id"],eid,arch))
+
+@app.route("/employees/<int:eid>/notes/<int:nid>", methods=["DELETE"])
+@owner_req
+def employee_note_delete(eid,nid):
+    u=me()
+    m("DELETE FROM notes WHERE id=? AND owner_id=? AND employee_id=?",[nid,u["id"],eid],tenant=u["id"],ev=(u["id"],"note_deleted",{"id":nid}))
+    return fragment(notes_frag(u["id"],eid,request.args.get("history")=="all"))
+
 @app.route("/api/notes/<int:nid>/delete", methods=["DELETE"])
 @owner_req
 def del_note(nid):
-    m("DELETE FROM notes WHERE id=?",[nid]); return jsonify({"ok":True})
+    u=me(); m("DELETE FROM notes WHERE id=? AND owner_id=?",[nid,u["id"]],tenant=u["id"],ev=(u["id"],"note_deleted",{"id":nid})); return jsonify({"ok":True})
 
 # ═══════════════════════════════════════════════════════════════════════════
 #  INVITES (owner only)
@@ -1261,41 +2013,21 @@ def gen_code(): return secrets.token_urlsafe(9).upper()[:12]
 def invites():
     u=me()
     if request.method=="POST":
-        label=request.form.get("label","").strip()
-        code=gen_code()
-        m("INSERT INTO invite_codes(code,owner_id,label,is_active,created_at) VALUES(?,?,?,1,?)",
-          [code,u["id"],label or "",now()])
+        _,code=create_invite(u["id"],request.form.get("label","").strip())
         flash(f"Invite code generated: {code}","success")
         return redir("/invites")
-    codes=q("SELECT * FROM invite_codes WHERE owner_id=? ORDER BY created_at DESC",[u["id"]])
-    rows=""
-    for c in codes:
-        ub_html="—"
-        if c["used_by_id"]:
-            r=q("SELECT id,full_name FROM users WHERE id=?",[c["used_by_id"]],one=True)
-            if r: ub_html=f'<a href="/employees/{r["id"]}" style="color:var(--blue-600);font-weight:600;">{escape(r["full_name"])}</a>'
-        valid=c["is_active"] and not c["used_by_id"]
-        badge="badge-active" if valid else "badge-suspended" if not c["is_active"] else "badge-inactive"
-        st="Active" if valid else "Deactivated" if not c["is_active"] else "Used"
-        lbtn=f"""<button onclick="cpLink(\'{c["code"]}\')" class="btn btn-secondary btn-sm">{I["lnk"]} Copy Link</button>""" if valid else '<span class="text-muted text-xs">N/A</span>'
-        dbtn=f"""<form method="POST" action="/invites/{c["id"]}/deactivate" onsubmit="return confirm(\'Deactivate?\')">
-                 <button type="submit" class="btn btn-danger btn-sm btn-icon" title="Deactivate">{I["x"]}</button></form>""" if valid else ""
-        rows+=f"""<tr>
-          <td><span class="code-pill" style="font-size:14px;padding:7px 12px;display:inline-block;">{c["code"]}</span></td>
-          <td class="text-muted text-sm">{escape(c["label"] or "—")}</td>
-          <td><span class="badge {badge}">{st}</span></td>
-          <td>{ub_html}</td>
-          <td class="text-muted text-sm">{fdate(c["created_at"])}</td>
-          <td>{lbtn}</td><td>{dbtn}</td></tr>"""
     host=request.host_url.rstrip("/")
+    cnt=cached(("invites",u["id"],host),(f"invites:{u['id']}",f"emps:{u['id']}"),lambda: invites_body(u["id"],host))
+    return layout("Invite Codes",cnt,u,"/invites")
+
+def invites_body(oid,host):
+    codes=invite_list(oid)
     # Build code cards
     code_cards=""
     for c in codes:
         ub_html=""
-        if c["used_by_id"]:
-            r=q("SELECT id,full_name FROM users WHERE id=?",[c["used_by_id"]],one=True)
-            if r: ub_html=f'<a href="/employees/{r["id"]}" style="color:var(--blue-600);font-weight:600;font-size:12px;">&#10003; Used by {escape(r["full_name"])}</a>'
-            else: ub_html='<span class="text-xs text-muted">&#10003; Used</span>'
+        if c["used_by_name"]: ub_html=f'<a href="/employees/{c["used_by_id"]}" style="color:var(--blue-600);font-weight:600;font-size:12px;">&#10003; Used by {escape(c["used_by_name"])}</a>'
+        elif c["used_by_id"]: ub_html='<span class="text-xs text-muted">&#10003; Used</span>'
         valid=c["is_active"] and not c["used_by_id"]
         border_color="rgba(59,130,246,0.2)" if valid else "rgba(226,232,240,0.8)"
         bg_color="rgba(255,255,255,0.9)" if valid else "rgba(248,250,252,0.7)"
@@ -1307,20 +2039,20 @@ def invites():
           <button type="submit" class="btn btn-danger btn-sm btn-icon" title="Deactivate">{I["x"]}</button></form>""" if valid else ""
         label_disp=f'<span style="font-size:12px;color:var(--gray-400);margin-bottom:6px;display:block;">{escape(c["label"])}</span>' if c["label"] else ""
         code_cards+=f"""
-        <div style="padding:16px 18px;border-radius:14px;background:{bg_color};
+        <div id="inv-{c["id"]}" style="padding:16px 18px;border-radius:14px;background:{bg_color};
           border:1.5px solid {border_color};transition:all .2s;
           box-shadow:0 2px 8px rgba(37,99,235,0.06);">
           {label_disp}
           <div style="display:flex;align-items:center;justify-content:space-between;gap:12px;flex-wrap:wrap;">
             <span class="code-pill" style="font-size:16px;">{c["code"]}</span>
-            <span class="badge {badge_cls}" style="flex-shrink:0;">{badge_lbl}</span>
+            <span class="badge {badge_cls}" style="flex-shrink:0;" data-badge>{badge_lbl}</span>
           </div>
           <div style="margin-top:10px;display:flex;align-items:center;justify-content:space-between;flex-wrap:wrap;gap:8px;">
-            <div style="font-size:12px;color:var(--gray-400);">
+            <div style="font-size:12px;color:var(--gray-400);" data-meta>
               {f'Created {fdate(c["created_at"])}'}
               {f" &nbsp;|&nbsp; {ub_html}" if ub_html else ""}
             </div>
-            <div style="display:flex;gap:6px;">{copy_btn}{link_btn}{deact_btn}</div>
+            <div style="display:flex;gap:6px;" data-actions>{copy_btn}{link_btn}{deact_btn}</div>
           </div>
         </div>"""
     if not code_cards:
@@ -1339,7 +2071,7 @@ def invites():
         <div class="card-header">
           <div>
             <div class="card-title">{I["tkt"]} All Codes</div>
-            <div class="card-subtitle">{len(codes)} code{"s" if len(codes)!=1 else ""} total &nbsp;·&nbsp; {sum(1 for c in codes if c["is_active"] and not c["used_by_id"])} active</div>
+            <div class="card-subtitle">{len(codes)} code{"s" if len(codes)!=1 else ""} total &nbsp;·&nbsp; <span data-live="open">{sum(1 for c in codes if c["is_active"] and not c["used_by_id"])}</span> active</div>
           </div>
         </div>
         <div style="display:flex;flex-direction:column;gap:10px;">{code_cards}</div>
@@ -1385,15 +2117,1982 @@ def invites():
         setTimeout(()=>{{btn.textContent=orig;btn.style.color="";}},1800);
       }}).catch(()=>showToast("Could not copy","danger"));
     }}
+    document.addEventListener("DOMContentLoaded",()=>live({{
+      invite_used:d=>{{
+        const c=document.getElementById("inv-"+d.id);if(!c)return;
+        const b=c.querySelector("[data-badge]");b.className="badge badge-inactive";b.textContent="Used";
+        c.querySelector("[data-actions]").innerHTML="";
+        c.querySelector("[data-meta]").insertAdjacentHTML("beforeend",` &nbsp;|&nbsp; <a href="/employees/${{d.used_by_id}}" style="color:var(--blue-600);font-weight:600;font-size:12px;">&#10003; Used by ${{esc(d.name)}}</a>`);
+        bump("open",-1);
+      }},
+    }}));
     </script>"""
-    return layout("Invite Codes",cnt,u,"/invites")
+    return cnt
 
 @app.route("/invites/<int:cid>/deactivate", methods=["POST"])
 @owner_req
 def deactivate_invite(cid):
-    u=me(); m("UPDATE invite_codes SET is_active=0 WHERE id=? AND owner_id=?",[cid,u["id"]])
+    u=me(); m("UPDATE invite_codes SET is_active=0 WHERE id=? AND owner_id=?",[cid,u["id"]],tags=(f"invites:{u['id']}",))
     flash("Invite code deactivated.","info"); return redir("/invites")
 
+# ═══════════════════════════════════════════════════════════════════════════
+#  JSON API v1 (owner only)
+# ═══════════════════════════════════════════════════════════════════════════
+# resource -> (data-access fn, public columns, list filters from query args)
+API={
+  "users":    (find_employees,"id,email,full_name,role,status,payment_status,position,phone,created_at",
+               lambda a: dict(qp=a.get("q","").strip(),st=a.get("status",""),py=a.get("payment",""))),
+  "payments": (emp_payments,"id,employee_id,amount_minor,currency,period,method,reference,notes,paid_on",
+               lambda a: dict(eid=a.get("employee_id",type=int),archived=a.get("archived")=="1")),
+  "notes":    (emp_notes,"id,employee_id,author_id,content,created_at",
+               lambda a: dict(eid=a.get("employee_id",type=int),archived=a.get("archived")=="1")),
+  "invites":  (owner_codes,"id,code,owner_id,used_by_id,label,is_active,created_at",
+               lambda a: {}),
+}
+API_MAX_LIMIT=1000
+
+class ApiError(Exception):
+    def __init__(self,msg,code=400): super().__init__(msg); self.code=code
+
+@app.errorhandler(ApiError)
+def api_error(e): return api_json({"error":str(e)},e.code)
+
+def api_json(obj,code=200):
+    r=make_response(json.dumps(obj,separators=(",",":"),ensure_ascii=False),code)
+    r.headers["Content-Type"]="application/json"; return r
+
+def api_req(f):
+    @wraps(f)
+    def d(*a,**k):
+        u=me()
+        if not u or u["role"]!="owner": return api_json({"error":"owner login required"},401)
+        return f(*a,**k)
+    return d
+
+def api_res(res):
+    if res not in API: raise ApiError(f"unknown resource '{res}'",404)
+    return API[res]
+
+def api_cols(res):
+    allowed=api_res(res)[1].split(",")
+    want=[c for c in request.args.get("fields","").split(",") if c]
+    bad=[c for c in want if c not in allowed]
+    if bad: raise ApiError(f"unknown field(s): {','.join(bad)}")
+    return ",".join(["id"]+[c for c in want if c!="id"]) if want else ",".join(allowed)
+
+def api_rows(res,**kw):
+    fn,_,filt=api_res(res)
+    return [dict(r) for r in fn(me()["id"],cols=api_cols(res),order="id",**filt(request.args),**kw)]
+
+def api_body(*required):
+    d=request.get_json(silent=True)
+    if not isinstance(d,dict): raise ApiError("JSON object body required")
+    miss=[k for k in required if d.get(k) in (None,"")]
+    if miss: raise ApiError(f"missing field(s): {','.join(miss)}")
+    return d
+
+@app.route("/api/v1/<res>", methods=["GET"])
+@api_req
+def api_list(res):
+    """List with ?fields=, keyset pagination (?after=<id>&limit=) or batch get (?ids=1,2,3)."""
+    ids=request.args.get("ids")
+    if ids is not None:
+        try: ids=[int(x) for x in ids.split(",") if x][:API_MAX_LIMIT]
+        except ValueError: raise ApiError("ids must be integers")
+        return api_json({"data":api_rows(res,ids=ids)})
+    limit=max(1,min(request.args.get("limit",100,type=int),API_MAX_LIMIT))
+    rows=api_rows(res,after=request.args.get("after",type=int),limit=limit+1)
+    more=len(rows)>limit; rows=rows[:limit]
+    return api_json({"data":rows,"next":rows[-1]["id"] if more else None})
+
+@app.route("/api/v1/<res>/<int:rid>", methods=["GET"])
+@api_req
+def api_get(res,rid):
+    rows=api_rows(res,ids=[rid])
+    if not rows: raise ApiError("not found",404)
+    return api_json(rows[0])
+
+@app.route("/api/v1/<res>", methods=["POST"])
+@api_req
+def api_create(res):
+    u=me(); api_res(res)
+    if res=="users":
+        d=api_body("email","password","full_name")
+        email=str(d["email"]).strip().lower(); name=str(d["full_name"]).strip()
+        errs=user_errors(email,str(d["password"]),name)
+        if errs: raise ApiError(" ".join(errs))
+        rid=create_user(email,str(d["password"]),name,"employee",str(d.get("position","")),str(d.get("phone","")),u["id"])
+    elif res in ("payments","notes"):
+        d=api_body("employee_id") if res=="payments" else api_body("employee_id","content")
+        if not isinstance(d["employee_id"],int) or not get_employee(u["id"],d["employee_id"]): raise ApiError("unknown employee_id")
+        if res=="notes": rid=add_note(u["id"],d["employee_id"],u["id"],str(d["content"]).strip())
+        else:
+            # amount_minor (integer minor units) or amount (decimal string in the major unit)
+            cur=str(d.get("currency") or "USD"); amt=d.get("amount_minor")
+            if amt is None and d.get("amount") in (None,""): raise ApiError("missing field(s): amount_minor")
+            if amt is not None and (not isinstance(amt,int) or isinstance(amt,bool)): raise ApiError("amount_minor must be an integer")
+            try: rid=add_payment(u["id"],d["employee_id"],from_minor(amt,cur) if amt is not None else d["amount"],cur,
+                                 *(str(d.get(k,"")) for k in ("period","method","reference","notes")))
+            except (TypeError,ValueError): raise ApiError("invalid amount")
+    else: rid,_=create_invite(u["id"],str((request.get_json(silent=True) or {}).get("label","")).strip())
+    return api_json(api_rows(res,ids=[rid])[0],201)
+
+CHANGE_RES={"users":"users","invite_codes":"invites","payment_records":"payments","notes":"notes"}  # table -> API resource
+
+@app.route("/api/v1/changes")
+@api_req
+def api_changes():
+    """Incremental sync: changes after ?since=<cursor> (oldest first, ?limit=), each with the row's
+    current public fields, or data=null for tombstones (op=delete) and rows since archived or
+    deleted. Pass the returned `next` as the following since. Sharded, the feed is kept per
+    file, so the cursor is "<directory seq>.<tenant seq>"."""
+    oid=me()["id"]; files=[None]+([oid] if SHARDED else [])
+    try: cur=[int(x) for x in request.args["since"].split(".")] if request.args.get("since") else [0]*len(files)
+    except ValueError: cur=None
+    if not cur or len(cur)!=len(files) or min(cur)<0: raise ApiError("since must be a cursor returned as next")
+    limit=max(1,min(request.args.get("limit",100,type=int),API_MAX_LIMIT))
+    feeds=[[(i,r) for r in q("""SELECT seq,tbl,row_id,op,at FROM changes WHERE owner_id=? AND seq>?
+                               AND NOT (tbl='users' AND row_id=owner_id) ORDER BY seq LIMIT ?""",[oid,cur[i],limit+1],tenant=t,rec=True)]
+           for i,t in enumerate(files)]
+    got=list(heapq.merge(*feeds,key=lambda x: x[1]["at"]))  # interleaves files, keeps each file's seq order
+    more=len(got)>limit; got=got[:limit]
+    live={}
+    for tbl in {r["tbl"] for _,r in got}:
+        fn,cols,_=API[CHANGE_RES[tbl]]; ids=sorted({r["row_id"] for _,r in got if r["tbl"]==tbl and r["op"] in ("insert","update")})
+        live.update({(tbl,x["id"]):dict(x) for x in fn(oid,cols=cols,ids=ids)} if ids else {})
+    out=[]
+    for i,r in got:
+        cur[i]=r["seq"]
+        out.append({"seq":r["seq"],"table":CHANGE_RES[r["tbl"]],"id":r["row_id"],"op":r["op"],"at":r["at"],"data":live.get((r["tbl"],r["row_id"]))})
+    return api_json({"changes":out,"next":".".join(map(str,cur)) if SHARDED else cur[0],"more":more})
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  LIVE UPDATES (Server-Sent Events fed by writes through m())
+# ═══════════════════════════════════════════════════════════════════════════
+SSE_BUFFER=int(os.environ.get("BIZ_SSE_BUFFER","64"))  # events queued per connection before it is reset
+SSE_HEARTBEAT=15   # seconds between keep-alive comments
+SSE_MAX_AGE=300    # seconds before the server ends a stream; EventSource reconnects after SSE_RETRY_MS
+SSE_RETRY_MS=2000
+
+class Bus:
+    """In-process pub/sub keyed by owner id, one bounded queue per /events connection. Publishing
+    never blocks: a subscriber whose queue is full is flagged and its stream resets."""
+    def __init__(self): self.lock=threading.Lock(); self.subs={}; self.seq=0
+    def subscribe(self,oid,sub=None):
+        """sub is anything with put_nowait() raising queue.Full; default a bounded queue.Queue."""
+        sub=sub or queue.Queue(SSE_BUFFER); sub.overflow=False
+        with self.lock: self.subs.setdefault(oid,set()).add(sub)
+        return sub
+    def unsubscribe(self,oid,sub):
+        with self.lock:
+            subs=self.subs.get(oid,set()); subs.discard(sub)
+            if not subs: self.subs.pop(oid,None)
+    def publish(self,oid,kind,data):
+        with self.lock: self.seq+=1; ev=(self.seq,kind,data); subs=list(self.subs.get(oid,()))
+        for sub in subs:
+            try: sub.put_nowait(ev)
+            except queue.Full: sub.overflow=True
+BUS=Bus()
+
+def sse_frame(seq,kind,data): return f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data,separators=(',',':'))}\n\n"
+
+@app.route("/events")
+@owner_req
+def events():
+    oid=me()["id"]; sub=BUS.subscribe(oid)
+    def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"; end=time.monotonic()+SSE_MAX_AGE
+            while time.monotonic()<end:
+                try: seq,kind,data=sub.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty: yield ": ping\n\n"; continue
+                if sub.overflow: yield "event: reset\ndata: {}\n\n"; return
+                yield sse_frame(seq,kind,data)
+        finally: BUS.unsubscribe(oid,sub)
+    r=Response(stream(),mimetype="text/event-stream")
+    r.headers["Cache-Control"]="no-cache"; r.headers["X-Accel-Buffering"]="no"; return r
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  FRAGMENT CACHE (rendered HTML reused until a write through m() touches one of its tags)
+# ═══════════════════════════════════════════════════════════════════════════
+# Every entry records the version of each tag it depends on (user:<id>, emps:<owner>,
+# invites:<owner>) as of just before it was rendered. m(...,tags=) bumps those versions after its
+# commit, so stale entries stop matching and age out of the LRU; a write that lands mid-render
+# can't leave a stale entry behind. BIZ_FRAG_CACHE=sqlite keeps entries and versions in
+# fragcache.db so every worker process shares them; BIZ_FRAG_CACHE=off renders every time.
+FRAG_MODE=os.environ.get("BIZ_FRAG_CACHE","memory")
+FRAG_LIMIT=int(os.environ.get("BIZ_FRAG_CACHE_KB","4096"))*1024  # total cached HTML, in characters
+FRAG_PATH=APP_DIR/"fragcache.db"
+
+class FragCache:
+    """In-process LRU bounded by the total size of the cached HTML."""
+    store="memory"
+    def __init__(self,limit):
+        self.limit=limit; self.lock=threading.Lock(); self.items=OrderedDict(); self.size=0; self.ver={}
+        self.stats=dict(hits=0,misses=0,stores=0,evictions=0,invalidations=0)
+    def count(self,k,n=1):
+        with self.lock: self.stats[k]+=n
+    def versions(self,tags):
+        with self.lock: return tuple(self.ver.get(t,0) for t in tags)
+    def get(self,key,tags):
+        with self.lock:
+            e=self.items.get(key); hit=e is not None and e[1]==tuple(self.ver.get(t,0) for t in tags)
+            if hit: self.items.move_to_end(key)
+            self.stats["hits" if hit else "misses"]+=1
+            return e[0] if hit else None
+    def put(self,key,html,snap):
+        with self.lock:
+            old=self.items.pop(key,None); self.size+=len(html)-(len(old[0]) if old else 0)
+            self.items[key]=(html,snap); self.stats["stores"]+=1
+            while self.size>self.limit and self.items:
+                self.size-=len(self.items.popitem(last=False)[1][0]); self.stats["evictions"]+=1
+    def invalidate(self,tags):
+        with self.lock:
+            for t in tags: self.ver[t]=self.ver.get(t,0)+1
+            self.stats["invalidations"]+=len(tags)
+    def clear(self):
+        with self.lock: self.items.clear(); self.size=0
+    def info(self):
+        with self.lock: return dict(self.stats,store=self.store,entries=len(self.items),bytes=self.size,limit=self.limit)
+
+class SharedFragCache(FragCache):
+    """Same interface backed by a SQLite file, so worker processes share entries and tag versions.
+    Hit/miss counters stay per process; entries, bytes and LRU order are shared."""
+    store="sqlite"
+    def __init__(self,limit,path):
+        super().__init__(limit); self.path=path; self.local=threading.local()
+        self.db().executescript("""
+          CREATE TABLE IF NOT EXISTS frags(key TEXT PRIMARY KEY,html TEXT NOT NULL,snap TEXT NOT NULL,
+            size INTEGER NOT NULL,used REAL NOT NULL);
+          CREATE INDEX IF NOT EXISTS frags_used ON frags(used);
+          CREATE TABLE IF NOT EXISTS tags(tag TEXT PRIMARY KEY,version INTEGER NOT NULL) WITHOUT ROWID;""")
+    def db(self):
+        db=getattr(self.local,"db",None)
+        if db is None:
+            db=self.local.db=sqlite3.connect(str(self.path),isolation_level=None,timeout=10)
+            db.execute("PRAGMA journal_mode=WAL"); db.execute("PRAGMA synchronous=OFF")  # a lost cache is just a miss
+        return db
+    def versions(self,tags):
+        v=dict(self.db().execute(f"SELECT tag,version FROM tags WHERE tag IN ({','.join('?'*len(tags))})",tags)) if tags else {}
+        return tuple(v.get(t,0) for t in tags)
+    def get(self,key,tags):
+        k=repr(key); r=self.db().execute("SELECT html,snap FROM frags WHERE key=?",[k]).fetchone()
+        hit=r is not None and tuple(json.loads(r[1]))==self.versions(tags)
+        self.count("hits" if hit else "misses")
+        if not hit: return None
+        t=time.time(); self.db().execute("UPDATE frags SET used=? WHERE key=? AND used<?",[t,k,t-1])  # LRU touch, at most 1/s
+        return r[0]
+    def put(self,key,html,snap):
+        db=self.db(); db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO frags VALUES(?,?,?,?,?)",[repr(key),html,json.dumps(snap),len(html),time.time()])
+            over=db.execute("SELECT SUM(size) FROM frags").fetchone()[0]-self.limit
+            n=db.execute("""DELETE FROM frags WHERE key IN (SELECT key FROM
+                              (SELECT key,SUM(size) OVER (ORDER BY used,key)-size before FROM frags) WHERE before<?)""",
+                         [over]).rowcount if over>0 else 0
+            db.execute("COMMIT")
+        except BaseException: db.execute("ROLLBACK"); raise
+        self.count("stores"); self.count("evictions",n)
+    def invalidate(self,tags):
+        self.db().executemany("INSERT INTO tags VALUES(?,1) ON CONFLICT(tag) DO UPDATE SET version=version+1",[(t,) for t in tags])
+        self.count("invalidations",len(tags))
+    def clear(self): self.db().execute("DELETE FROM frags")
+    def info(self):
+        n,b=self.db().execute("SELECT COUNT(*),COALESCE(SUM(size),0) FROM frags").fetchone()
+        with self.lock: return dict(self.stats,store=self.store,entries=n,bytes=b,limit=self.limit)
+
+FRAGS=(SharedFragCache(FRAG_LIMIT,FRAG_PATH) if FRAG_MODE=="sqlite" else
+       FragCache(FRAG_LIMIT) if FRAG_MODE!="off" else None)
+
+def cached(key,tags,render):
+    """render() once per key, then serve the stored HTML until one of tags is invalidated."""
+    if FRAGS is None: return render()
+    html=FRAGS.get(key,tags)
+    if html is None: snap=FRAGS.versions(tags); html=render(); FRAGS.put(key,html,snap)
+    return html
+
+def invalidate(*tags):
+    if FRAGS is not None: FRAGS.invalidate(tags)
+
+@app.route("/cache/stats")
+@admin_req
+def cache_stats(): return jsonify(fragments=FRAGS.info() if FRAGS else {"store":"off"},employee_ids=IDS.info())
+
+@command("fragcache","[clear] show fragment cache stats, or drop every entry")
+def cmd_fragcache(act=""):
+    if FRAGS is None: print("fragment cache is off (BIZ_FRAG_CACHE=off)"); return
+    if act=="clear": FRAGS.clear()
+    print(" ".join(f"{k}={v}" for k,v in FRAGS.info().items()))
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  ACCESS LOG (one JSON line per request, written off the request path)
+# ═══════════════════════════════════════════════════════════════════════════
+# Each response adds a record (route, status, latency, DB time and query count from q()/mw(),
+# bytes, user, admission queue time) to a bounded queue; one daemon thread appends whatever is
+# queued as a single write to logs/access.jsonl and rotates the file to access.jsonl.1..KEEP past
+# BIZ_ACCESS_LOG_MB. When the queue is full the record is dropped and counted, never waited for.
+# BIZ_ACCESS_LOG=off disables it.
+LOG_DIR=APP_DIR/"logs"
+ACCESS_LOG=os.environ.get("BIZ_ACCESS_LOG","on")!="off"
+ACCESS_LOG_MB=float(os.environ.get("BIZ_ACCESS_LOG_MB","10"))
+ACCESS_LOG_KEEP=5     # rotated files kept
+ACCESS_QUEUE=10000    # records waiting for the writer before new ones are dropped
+ACCESS_BATCH=1000     # most records per write
+
+class AccessLog:
+    """Bounded queue drained by one writer thread, started with the first record."""
+    def __init__(self,size,max_bytes,keep):
+        self.q=queue.Queue(size); self.max_bytes,self.keep=max_bytes,keep
+        self.lock=threading.Lock(); self.thread=None
+        self.stats=dict(written=0,dropped=0,batches=0,rotations=0,errors=0)
+    def path(self): return LOG_DIR/"access.jsonl"
+    def put(self,rec):
+        if self.thread is None: self.start()
+        try: self.q.put_nowait(rec)
+        except queue.Full:
+            with self.lock: self.stats["dropped"]+=1
+    def start(self):
+        with self.lock:
+            if self.thread is None: self.thread=threading.Thread(target=self.run,daemon=True,name="access-log"); self.thread.start()
+    def run(self):
+        f=None
+        while True:
+            batch=[self.q.get()]
+            try:
+                while len(batch)<ACCESS_BATCH: batch.append(self.q.get_nowait())
+            except queue.Empty: pass
+            try:
+                path=self.path()
+                if f is None or f.name!=str(path):
+                    if f: f.close()
+                    path.parent.mkdir(parents=True,exist_ok=True); f=open(path,"a",encoding="utf-8")
+                f.write("".join(json.dumps(r,separators=(",",":"))+"\n" for r in batch)); f.flush(); ok=True
+            except OSError: ok=False; f=None
+            with self.lock:
+                if ok: self.stats["written"]+=len(batch); self.stats["batches"]+=1
+                else: self.stats["errors"]+=1; self.stats["dropped"]+=len(batch)
+            if f is not None and f.tell()>=self.max_bytes:
+                f.close(); f=None
+                try: self.rotate(path)
+                except OSError:
+                    with self.lock: self.stats["errors"]+=1
+            for _ in batch: self.q.task_done()
+    def rotate(self,path):
+        for i in range(self.keep,0,-1):
+            src=path.with_name(f"{path.name}.{i-1}") if i>1 else path
+            if src.exists(): os.replace(src,path.with_name(f"{path.name}.{i}"))
+        with self.lock: self.stats["rotations"]+=1
+    def flush(self):
+        """Block until every queued record has been written (tests and commands)."""
+        if self.thread is not None: self.q.join()
+    def info(self):
+        with self.lock: return dict(self.stats,enabled=ACCESS_LOG,pending=self.q.qsize(),path=str(self.path()))
+
+ACCESS=AccessLog(ACCESS_QUEUE,int(ACCESS_LOG_MB*1024*1024),ACCESS_LOG_KEEP)
+
+@app.before_request
+def access_start(): g.t0=time.perf_counter(); g.db_time=0.0; g.queries=0
+
+@app.after_request
+def access_record(r):
+    if ACCESS_LOG and "t0" in g:
+        u=g.get("me"); queued=g.get("queued"); mem=g.get("mem")
+        rec={"ts":round(time.time(),3),"method":request.method,"path":request.path,
+             "route":request.url_rule.rule if request.url_rule else None,"status":r.status_code,
+             "ms":round((time.perf_counter()-g.t0)*1000,2),"db_ms":round(g.get("db_time",0.0)*1000,2),
+             "queries":g.get("queries",0),"bytes":r.content_length,"user":u["id"] if u else None,
+             "queue_ms":round(queued*1000,2) if queued is not None else None}
+        if mem: rec["alloc_kb"],rec["peak_kb"]=round(mem[0]/1024,1),round(mem[1]/1024,1)  # BIZ_TRACEMALLOC=1
+        ACCESS.put(rec)
+    return r
+
+@app.route("/logs/stats")
+@admin_req
+def access_stats(): return jsonify(ACCESS.info())
+
+@command("access-report","[file]  per-route requests, p50/p95 latency, DB time and queries from the access log")
+def cmd_access_report(path=None):
+    path=Path(path) if path else ACCESS.path(); by={}
+    if not path.exists(): print(f"no access log at {path}"); return 1
+    with open(path,encoding="utf-8") as f:
+        for line in f:
+            try: r=json.loads(line)
+            except ValueError: continue
+            by.setdefault((r["method"],r["route"] or r["path"]),[]).append(r)
+    print(f"{'route':<44} {'reqs':>6} {'5xx':>5} {'p50 ms':>8} {'p95 ms':>8} {'db ms':>7} {'queries':>7}")
+    for (meth,route),rs in sorted(by.items(),key=lambda kv: -sum(r["ms"] for r in kv[1])):
+        ms=sorted(r["ms"] for r in rs); n=len(rs)
+        print(f"{meth+' '+route:<44} {n:>6} {sum(r['status']>=500 for r in rs):>5} {ms[n//2]:>8.1f} {ms[min(n-1,int(n*.95))]:>8.1f} "
+              f"{sum(r['db_ms'] for r in rs)/n:>7.1f} {sum(r['queries'] for r in rs)/n:>7.1f}")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  MEMORY ACCOUNTING (opt-in tracemalloc peaks per request and per route)
+# ═══════════════════════════════════════════════════════════════════════════
+# BIZ_TRACEMALLOC=1 traces Python allocations for the life of the process (roughly 2x slower
+# allocation and extra memory per block, so it is for diagnosis, not normal running). Each request
+# resets the peak, then records how far the traced total rose above its starting point (peak) and
+# how much it still holds at the end (alloc); both go into the access log and per-endpoint totals
+# at /memory/stats. The traced total and its peak are process-wide, so a request that overlaps
+# another (either way round) can't be told apart from it: it is only counted as overlapped, and
+# the figures come from requests that ran alone. Measure under light, serial load.
+# bench-memory measures the same thing per page at several data sizes, with nothing else running.
+MEM_TRACE=os.environ.get("BIZ_TRACEMALLOC")=="1"
+MEM_FRAMES=int(os.environ.get("BIZ_TRACEMALLOC_FRAMES","1"))  # stack depth kept per allocation
+MEM_ROUTES={}  # endpoint -> {requests, overlapped, peak_max, peak_sum, alloc_sum, last_peak}, in bytes
+MEM_LIVE={}    # in-flight request token -> overlapped another request
+_mem_lock=threading.Lock()
+if MEM_TRACE and not tracemalloc.is_tracing(): tracemalloc.start(MEM_FRAMES)
+
+def mem_reset_peak():
+    """tracemalloc.reset_peak() is Python 3.9+. On 3.8, restarting tracing is the only way to reset the
+    peak; it also forgets what was traced so far, so ?top= then only sees later allocations."""
+    if hasattr(tracemalloc,"reset_peak"): tracemalloc.reset_peak()
+    else: n=tracemalloc.get_traceback_limit(); tracemalloc.stop(); tracemalloc.start(n)
+
+@app.before_request
+def mem_start():
+    if not MEM_TRACE: return
+    with _mem_lock:
+        g.mem_tok=tok=object(); alone=not MEM_LIVE
+        for k in MEM_LIVE: MEM_LIVE[k]=True
+        MEM_LIVE[tok]=not alone
+        if alone: mem_reset_peak(); g.mem0=tracemalloc.get_traced_memory()[0]
+
+@app.after_request
+def mem_finish(r):
+    tok=g.pop("mem_tok",None)
+    if tok is None: return r
+    with _mem_lock:
+        over=MEM_LIVE.pop(tok,True)
+        s=MEM_ROUTES.setdefault(request.endpoint or "none",dict(requests=0,overlapped=0,peak_max=0,peak_sum=0,alloc_sum=0,last_peak=0))
+        if over: s["overlapped"]+=1; return r
+        cur,peak=tracemalloc.get_traced_memory(); alloc,peak=cur-g.mem0,peak-g.mem0; g.mem=(alloc,peak)
+        s["requests"]+=1; s["peak_max"]=max(s["peak_max"],peak); s["peak_sum"]+=peak; s["alloc_sum"]+=alloc; s["last_peak"]=peak
+    return r
+
+@app.teardown_request
+def mem_abandon(exc=None):
+    tok=g.pop("mem_tok",None)  # the request failed before after_request ran
+    if tok is not None:
+        with _mem_lock: MEM_LIVE.pop(tok,None)
+
+def max_rss_kb():
+    try: import resource
+    except ImportError: return None  # not on Windows
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//(1 if sys.platform!="darwin" else 1024)
+
+@app.route("/memory/stats")
+@admin_req
+def memory_stats():
+    """Per-endpoint peaks in KB over the requests that ran alone (overlapped ones are only counted);
+    ?top=N adds the N source lines holding the most traced memory."""
+    kb=lambda b: round(b/1024,1); n=lambda s: max(s["requests"],1)
+    with _mem_lock:
+        routes={ep:{"requests":s["requests"],"overlapped":s["overlapped"],"peak_kb_max":kb(s["peak_max"]),"peak_kb_avg":kb(s["peak_sum"]/n(s)),
+                    "alloc_kb_avg":kb(s["alloc_sum"]/n(s)),"peak_kb_last":kb(s["last_peak"])}
+                for ep,s in sorted(MEM_ROUTES.items(),key=lambda kv: -kv[1]["peak_max"])}
+    out={"enabled":MEM_TRACE,"max_rss_kb":max_rss_kb(),"routes":routes}
+    if MEM_TRACE:
+        cur,_=tracemalloc.get_traced_memory(); out["traced_kb"]=kb(cur)
+        top=request.args.get("top",0,type=int)
+        if top: out["top"]=[{"where":str(st.traceback[0]),"kb":kb(st.size),"blocks":st.count}
+                            for st in tracemalloc.take_snapshot().statistics("lineno")[:min(top,100)]]
+    return jsonify(out)
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  ADMISSION CONTROL (per-class concurrency limits with short wait queues; the excess gets a fast 503)
+# ═══════════════════════════════════════════════════════════════════════════
+# Each endpoint belongs to a class: "auth" (password hashing, CPU-bound), "heavy" (list pages and
+# API reads that scan per-owner data) or "cheap" (everything else). A class runs at most `limit`
+# requests at once; up to `queue` more wait at most `wait` seconds for a slot, and anything beyond
+# that is answered 503 + Retry-After straight away, so a login storm or a pile of list renders
+# can't starve the cheap pages. BIZ_ADMIT_<CLASS>="limit,queue,wait" overrides a class;
+# BIZ_ADMIT=off disables the limiter. /events streams are long-lived and never counted.
+ADMIT_ON=os.environ.get("BIZ_ADMIT","on")!="off"
+ADMIT_CLASS={"login":"auth","register_owner":"auth","register_employee":"auth","profile":"auth","api_create":"auth",
+             "employees":"heavy","invites":"heavy","analytics":"heavy","jobs":"heavy","api_list":"heavy","api_changes":"heavy"}
+ADMIT_EXEMPT={"events","static"}
+
+class Gate:
+    """Counting semaphore with a bounded, time-limited wait and queue-time stats."""
+    def __init__(self,name,limit,queue,wait):
+        self.name,self.limit,self.queue,self.wait=name,limit,queue,wait
+        self.cv=threading.Condition(); self.running=self.waiting=self.peak=0; self.waits=deque(maxlen=1024)
+        self.stats=dict(admitted=0,queued=0,shed_full=0,shed_timeout=0,wait_total=0.0,wait_max=0.0)
+    def enter(self):
+        """Take a slot; returns seconds spent queued, or None if the request should be shed."""
+        t0=time.perf_counter()
+        with self.cv:
+            if self.running>=self.limit or self.waiting:
+                if self.waiting>=self.queue: self.stats["shed_full"]+=1; return None
+                self.waiting+=1; self.peak=max(self.peak,self.waiting); self.stats["queued"]+=1
+                try: ok=self.cv.wait_for(lambda: self.running<self.limit,self.wait)
+                finally: self.waiting-=1
+                if not ok: self.stats["shed_timeout"]+=1; return None
+            self.running+=1
+            if self.waiting and self.running<self.limit: self.cv.notify()  # pass on a slot freed meanwhile
+            w=time.perf_counter()-t0; s=self.stats
+            s["admitted"]+=1; s["wait_total"]+=w; s["wait_max"]=max(s["wait_max"],w); self.waits.append(w)
+            return w
+    def leave(self):
+        with self.cv: self.running-=1; self.cv.notify()
+    def info(self):
+        with self.cv:
+            w=sorted(self.waits); pct=lambda p: round(w[min(len(w)-1,int(p*len(w)))]*1000,2) if w else 0
+            s=self.stats
+            return dict(limit=self.limit,queue=self.queue,wait=self.wait,running=self.running,waiting=self.waiting,
+                        peak_waiting=self.peak,admitted=s["admitted"],queued=s["queued"],shed_full=s["shed_full"],
+                        shed_timeout=s["shed_timeout"],wait_ms_avg=round(s["wait_total"]*1000/max(1,s["admitted"]),2),
+                        wait_ms_p50=pct(.5),wait_ms_p95=pct(.95),wait_ms_max=round(s["wait_max"]*1000,2))
+
+def admit_gate(name,limit,queue,wait):
+    v=os.environ.get(f"BIZ_ADMIT_{name.upper()}")
+    if v: limit,queue,wait=v.split(","); limit,queue,wait=int(limit),int(queue),float(wait)
+    return Gate(name,limit,queue,wait)
+
+CPUS=os.cpu_count() or 2
+GATES={x.name:x for x in (admit_gate("auth",CPUS,4*CPUS,5),admit_gate("heavy",4,16,2),admit_gate("cheap",32,128,1))}
+
+@app.before_request
+def admit():
+    ep=request.endpoint
+    if not ADMIT_ON or ep is None or ep in ADMIT_EXEMPT: return None
+    cls=ADMIT_CLASS.get(ep,"cheap")
+    if cls=="auth" and request.method not in ("POST","PUT"): cls="cheap"  # the forms themselves are cheap
+    gate=GATES[cls]; w=gate.enter()
+    if w is None:
+        r=(api_json({"error":"server busy, retry shortly"},503) if ep.startswith("api_")
+           else make_response("Server busy, please retry shortly.",503))
+        r.headers["Retry-After"]=str(max(1,round(gate.wait))); return r
+    g.gate=gate; g.queued=w
+
+@app.after_request
+def admit_headers(r):
+    if "queued" in g: r.headers["X-Queue-Time"]=f"{g.queued*1000:.1f}"
+    return r
+
+@app.teardown_request
+def admit_release(exc=None):
+    gate=g.pop("gate",None)
+    if gate: gate.leave()
+
+@app.route("/admission/stats")
+@admin_req
+def admission_stats(): return jsonify(enabled=ADMIT_ON,classes={k:v.info() for k,v in GATES.items()})
+
+@command("bench-overload","[logins] [pages]  cheap-page latency during a login storm, limiter off vs on")
+def cmd_bench_overload(logins="24",pages="40"):
+    """`logins` threads keep posting /login (PBKDF2) while one client times `pages` GETs of the login
+    form. Without the limiter every hash competes for the CPU with the cheap page."""
+    global ADMIT_ON
+    logins,pages=int(logins),int(pages); real=ADMIT_ON; restore=bench_db()
+    try:
+        with app.app_context(): create_user("bench@example.com","benchpass1","Bench Owner","owner")
+        for mode in (False,True):
+            ADMIT_ON=mode; stop=threading.Event(); codes=[]
+            def storm():
+                while not stop.is_set():  # a fresh client each time, so every post really hashes
+                    codes.append(app.test_client().post("/login",data={"email":"bench@example.com","password":"benchpass1"}).status_code)
+                    if codes[-1]==503: time.sleep(0.1)  # a shed client backs off
+            ts=[threading.Thread(target=storm) for _ in range(logins)]
+            for t in ts: t.start()
+            time.sleep(0.5); c=app.test_client(); lat=[]
+            for _ in range(pages): t0=time.perf_counter(); c.get("/login"); lat.append(time.perf_counter()-t0); time.sleep(0.05)
+            stop.set()
+            for t in ts: t.join()
+            lat.sort(); ok=sum(1 for s in codes if s<500)
+            print(f"limiter {'on ' if mode else 'off'}  GET /login p50 {lat[len(lat)//2]*1000:7.1f} ms  p95 {lat[int(len(lat)*.95)]*1000:7.1f} ms  "
+                  f"logins {ok} served, {len(codes)-ok} shed")
+    finally: ADMIT_ON=real; restore()
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  REQUEST PROFILER (one request at a time, on demand, for signed-in owners holding the token)
+# ═══════════════════════════════════════════════════════════════════════════
+# Send X-Profile: <BIZ_PROFILE_TOKEN> (or ?_profile=<token>) as an owner and that request is
+# profiled: a sampler thread records the request thread's stack every BIZ_PROFILE_INTERVAL_MS
+# (or, with X-Profile-Mode: cprofile / ?_profile_mode=cprofile, cProfile traces every call), and
+# every q()/mw() call lands on a timeline. The result goes to profiles/<id>.json plus a
+# collapsed-stack file (flamegraph.pl, speedscope) or a .pstats dump; the response carries
+# X-Profile-Url pointing at the summary page. Without the token set, nothing is ever profiled, and
+# other requests only pay for one header lookup.
+PROFILE_TOKEN=os.environ.get("BIZ_PROFILE_TOKEN","")
+PROFILE_INTERVAL=float(os.environ.get("BIZ_PROFILE_INTERVAL_MS","1"))/1000
+PROFILE_DIR=APP_DIR/"profiles"
+PROFILE_KEEP=100  # newest profiles kept
+
+class Sampler:
+    """Samples one thread's stack on a timer into collapsed-stack counts ("a;b;c" -> samples).
+    While any sampler runs the GIL switch interval drops below the sampling interval; at the
+    default 5 ms a CPU-bound request would starve the sampler. The interval is process-wide, so
+    running samplers are counted and the last one to stop puts the original back."""
+    active=0; switch=None; lock=threading.Lock()
+    def __init__(self,tid,interval):
+        self.tid,self.interval=tid,interval; self.stacks={}; self.halt=threading.Event()
+        self.thread=threading.Thread(target=self.run,daemon=True,name="profile-sampler")
+    def start(self):
+        with Sampler.lock:
+            if not Sampler.active: Sampler.switch=sys.getswitchinterval()
+            Sampler.active+=1; sys.setswitchinterval(min(sys.getswitchinterval(),self.interval/2))
+        self.thread.start(); return self
+    def run(self):
+        while not self.halt.wait(self.interval):
+            f=sys._current_frames().get(self.tid); st=[]
+            while f is not None: c=f.f_code; st.append(f"{getattr(c,'co_qualname',c.co_name)} ({Path(c.co_filename).name}:{c.co_firstlineno})"); f=f.f_back
+            st.reverse(); top=next((i for i,n in enumerate(st) if n.startswith("Flask.wsgi_app ")),0)  # drop server frames
+            k=";".join(st[top:]); self.stacks[k]=self.stacks.get(k,0)+1
+    def stop(self):
+        self.halt.set(); self.thread.join()
+        with Sampler.lock:
+            Sampler.active-=1
+            if not Sampler.active: sys.setswitchinterval(Sampler.switch)
+
+@app.before_request
+def profile_start():
+    tok=request.headers.get("X-Profile") or request.args.get("_profile")
+    if not tok or not PROFILE_TOKEN or not hmac.compare_digest(tok,PROFILE_TOKEN): return None
+    u=me()
+    if not u or u["role"]!="owner": return None
+    mode=request.headers.get("X-Profile-Mode") or request.args.get("_profile_mode") or "sample"
+    if mode=="cprofile":
+        import cProfile
+        g.profiler=cProfile.Profile(); g.profiler.enable()
+    else: g.profiler=Sampler(threading.get_ident(),PROFILE_INTERVAL).start()
+    g.prof_sql=[]; g.prof_t0=time.perf_counter()
+
+@app.after_request
+def profile_finish(r):
+    p=g.pop("profiler",None)
+    if p is None: return r
+    wall=time.perf_counter()-g.prof_t0
+    if isinstance(p,Sampler): p.stop()
+    else: p.disable()
+    pid=f"{int(time.time())}-{request.endpoint or 'none'}-{secrets.token_hex(3)}"
+    save_profile(pid,p,wall,r.status_code); r.headers["X-Profile-Id"]=pid; r.headers["X-Profile-Url"]=f"/profiles/{pid}"
+    return r
+
+@app.teardown_request
+def profile_abandon(exc=None):
+    p=g.pop("profiler",None)  # the request failed before after_request ran
+    if isinstance(p,Sampler): p.stop()
+    elif p is not None: p.disable()
+
+def save_profile(pid,p,wall,status):
+    PROFILE_DIR.mkdir(exist_ok=True); t0=g.prof_t0
+    qs=urllib.parse.urlencode([(k,v) for k,v in request.args.items(multi=True) if k not in ("_profile","_profile_mode")])  # never store the token
+    meta={"id":pid,"url":request.path+(f"?{qs}" if qs else ""),"method":request.method,"endpoint":request.endpoint,"status":status,
+          "user":me()["id"],"at":now(),"wall_ms":round(wall*1000,2),"mode":"sample" if isinstance(p,Sampler) else "cprofile",
+          "queries":[{"at_ms":round((a-t0)*1000,3),"ms":round(dt*1000,3),"sql":" ".join(str(s).split())[:300]} for a,dt,s in g.prof_sql]}
+    if isinstance(p,Sampler):
+        meta["samples"]=sum(p.stacks.values()); meta["interval_ms"]=PROFILE_INTERVAL*1000
+        (PROFILE_DIR/f"{pid}.collapsed").write_text("".join(f"{k} {n}\n" for k,n in sorted(p.stacks.items())),encoding="utf-8")
+    else:
+        import pstats
+        out=io.StringIO(); pstats.Stats(p,stream=out).sort_stats("cumulative").print_stats(40); meta["pstats"]=out.getvalue()
+        p.dump_stats(str(PROFILE_DIR/f"{pid}.pstats"))
+    (PROFILE_DIR/f"{pid}.json").write_text(json.dumps(meta),encoding="utf-8")
+    for old in sorted(PROFILE_DIR.glob("*.json"),key=lambda f: f.stat().st_mtime)[:-PROFILE_KEEP]:
+        for f in PROFILE_DIR.glob(old.stem+".*"): f.unlink(missing_ok=True)
+
+def load_profile(pid,uid):
+    f=PROFILE_DIR/f"{pid}.json"
+    if not re.fullmatch(r"[\w.-]+",pid) or not f.is_file(): return None
+    meta=json.loads(f.read_text(encoding="utf-8")); return meta if meta["user"]==uid else None
+
+def profile_stacks(pid):
+    f=PROFILE_DIR/f"{pid}.collapsed"; out={}
+    if f.is_file():
+        for line in f.read_text(encoding="utf-8").splitlines():
+            k,_,n=line.rpartition(" "); out[k]=int(n)
+    return out
+
+def flame_html(stacks):
+    """Icicle graph (root on top) of collapsed stacks as nested flex boxes; frames under 0.5% are cut."""
+    total=sum(stacks.values()) or 1; tree={}
+    for k,n in stacks.items():
+        node=tree
+        for fr in k.split(";"): e=node.setdefault(fr,[0,{}]); e[0]+=n; node=e[1]
+    def render(node,parent,depth):
+        out=""
+        for fr,(n,kids) in sorted(node.items(),key=lambda kv: -kv[1][0]):
+            if n/total<0.005: continue
+            out+=(f'<div class="fl" style="width:{100*n/parent:.2f}%"><div class="fn" style="background:hsl({20+depth*7%40},85%,{72-depth%3*5}%)" '
+                  f'title="{escape(fr)} &mdash; {n} samples, {100*n/total:.1f}%">{escape(fr.split(" (")[0])}</div>'
+                  f'<div class="fk">{render(kids,n,depth+1)}</div></div>')
+        return out
+    return f'<div class="fk">{render(tree,total,0)}</div>'
+
+def top_frames(stacks,n=20):
+    """(frame, self samples, inclusive samples) for the n frames with most self time."""
+    own,incl={},{}
+    for k,c in stacks.items():
+        fr=k.split(";"); own[fr[-1]]=own.get(fr[-1],0)+c
+        for f in set(fr): incl[f]=incl.get(f,0)+c
+    return [(f,own[f],incl[f]) for f in sorted(own,key=own.get,reverse=True)[:n]]
+
+@app.route("/profiles")
+@owner_req
+def profiles():
+    u=me(); rows=""
+    for f in sorted(PROFILE_DIR.glob("*.json"),key=lambda f: f.stat().st_mtime,reverse=True) if PROFILE_DIR.is_dir() else []:
+        p=load_profile(f.stem,u["id"])
+        if p: rows+=f"""<tr><td><a href="/profiles/{p["id"]}">{escape(p["method"])} {escape(p["url"])}</a></td><td>{p["status"]}</td>
+          <td>{p["wall_ms"]:.1f} ms</td><td>{len(p["queries"])}</td><td>{p["mode"]}</td><td class="text-muted">{fdate(p["at"])}</td></tr>"""
+    rows=rows or f'<tr><td colspan="6" class="text-center text-muted" style="padding:30px;">No profiles yet. Send <code>X-Profile: &lt;token&gt;</code> with a request{"" if PROFILE_TOKEN else " (set BIZ_PROFILE_TOKEN first)"}.</td></tr>'
+    cnt=f"""<div class="topbar"><div><div class="page-title">Profiles</div><div class="page-subtitle">Requests profiled on demand</div></div></div>
+    <div class="card"><div class="table-wrap"><table><thead><tr><th>Request</th><th>Status</th><th>Wall</th><th>Queries</th><th>Mode</th><th>When</th></tr></thead>
+    <tbody>{rows}</tbody></table></div></div>"""
+    return layout("Profiles",cnt,u,"/profiles")
+
+@app.route("/profiles/<pid>")
+@owner_req
+def profile_view(pid):
+    u=me(); p=load_profile(pid,u["id"])
+    if not p: flash("Profile not found.","danger"); return redir("/profiles")
+    wall=max(p["wall_ms"],0.001); db=sum(x["ms"] for x in p["queries"])
+    bars="".join(f"""<tr><td class="text-muted">{x["at_ms"]:.2f}</td><td>{x["ms"]:.2f}</td>
+      <td style="width:40%;"><div style="margin-left:{100*x["at_ms"]/wall:.2f}%;width:{max(.3,100*x["ms"]/wall):.2f}%;height:10px;background:var(--blue-600);border-radius:2px;"></div></td>
+      <td><code style="font-size:11px;">{escape(x["sql"])}</code></td></tr>""" for x in p["queries"])
+    if p["mode"]=="sample":
+        st=profile_stacks(pid)
+        body=f"""<div class="card mb-3"><div class="card-header"><div class="card-title">Flame graph</div>
+          <a href="/profiles/{pid}/collapsed" class="btn btn-ghost btn-sm">{I["arr"]} Collapsed stacks</a></div>
+          <div class="flame">{flame_html(st) if st else '<p class="text-muted">No samples: the request finished within one sampling interval.</p>'}</div></div>
+        <div class="card mb-3"><div class="card-title mb-3">Hottest frames</div><div class="table-wrap"><table>
+          <thead><tr><th>Frame</th><th>Self</th><th>Total</th></tr></thead><tbody>{"".join(
+            f'<tr><td><code style="font-size:11px;">{escape(f)}</code></td><td>{100*s/p["samples"]:.1f}%</td><td>{100*t/p["samples"]:.1f}%</td></tr>'
+            for f,s,t in top_frames(st))}</tbody></table></div></div>"""
+    else:
+        body=f"""<div class="card mb-3"><div class="card-header"><div class="card-title">cProfile (by cumulative time)</div>
+          <a href="/profiles/{pid}/collapsed" class="btn btn-ghost btn-sm">{I["arr"]} .pstats</a></div>
+          <pre style="font-size:11px;overflow:auto;">{escape(p["pstats"])}</pre></div>"""
+    cnt=f"""<div class="topbar"><div><div class="page-title">{escape(p["method"])} {escape(p["url"])}</div>
+      <div class="page-subtitle">{p["status"]} &middot; {p["wall_ms"]:.1f} ms wall &middot; {len(p["queries"])} queries, {db:.1f} ms in the database
+      &middot; {p["mode"]}{f', {p["samples"]} samples every {p["interval_ms"]:g} ms' if p["mode"]=="sample" else ""}</div></div>
+      <div class="topbar-actions"><a href="/profiles" class="btn btn-secondary btn-sm">All profiles</a></div></div>
+    {body}
+    <div class="card"><div class="card-title mb-3">Query timeline</div><div class="table-wrap"><table>
+      <thead><tr><th>At ms</th><th>ms</th><th></th><th>SQL</th></tr></thead><tbody>{bars}</tbody></table></div></div>
+    <style>.flame{{overflow-x:auto;font:11px/18px monospace;}}.fk{{display:flex;}}.fl{{overflow:hidden;}}
+    .fn{{height:18px;padding:0 3px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;border:1px solid #fff;color:#1e293b;}}</style>"""
+    return layout("Profile",cnt,u,"/profiles")
+
+@app.route("/profiles/<pid>/collapsed")
+@owner_req
+def profile_download(pid):
+    if not load_profile(pid,me()["id"]): flash("Profile not found.","danger"); return redir("/profiles")
+    f=next((PROFILE_DIR/f"{pid}{ext}" for ext in (".collapsed",".pstats") if (PROFILE_DIR/f"{pid}{ext}").is_file()),None)
+    if f is None: flash("Profile not found.","danger"); return redir("/profiles")
+    return send_file(f,mimetype="text/plain" if f.suffix==".collapsed" else "application/octet-stream",as_attachment=True,download_name=f.name)
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  BACKGROUND JOBS (durable queue in the jobs table, drained by worker threads)
+# ═══════════════════════════════════════════════════════════════════════════
+JOB_WORKERS=int(os.environ.get("BIZ_JOB_WORKERS","2"))
+JOB_POLL=1.0
+PAY_PERIOD_CHECK=3600  # how often the scheduler looks for pay periods whose cycle has ended
+EXPORT_DIR=APP_DIR/"exports"
+IMPORT_KEEP=86400  # import results list temporary passwords: deleted on first download, or by maintenance after this
+JOB_KINDS={}
+OWNER_JOBS={"export_payments","bulk_payroll","import_employees","payslips","rebuild_rollups"}  # the rest span every tenant: scheduler and CLI only
+SCHEDULE={}  # kind -> (interval, idle) in seconds, for system jobs queued by the scheduler
+LAST_REQUEST=0.0  # epoch seconds of the latest request, for jobs that prefer idle time
+_job_wake=threading.Event()
+
+def job(kind,label):
+    """Register fn(jid,payload)->result as the handler for a job kind."""
+    def reg(fn): JOB_KINDS[kind]=(fn,label); return fn
+    return reg
+
+def enqueue(kind,payload=None,owner_id=None,max_attempts=3,delay=0):
+    jid=m("INSERT INTO jobs(kind,owner_id,payload,max_attempts,run_after,created_at,updated_at) VALUES(?,?,?,?,?,?,?)",
+          [kind,owner_id,json.dumps(payload or {}),max_attempts,now(delay),now(),now()])
+    _job_wake.set(); return jid
+
+def job_progress(jid,done,total=1,msg=""):
+    m("UPDATE jobs SET progress=?,message=?,updated_at=? WHERE id=?",[min(1.0,done/max(total,1)),msg,now(),jid])
+
+def claim_job():
+    while True:
+        j=q("SELECT * FROM jobs WHERE status='queued' AND run_after<=? ORDER BY id LIMIT 1",[now()],one=True)
+        if not j: return None
+        claimed=mw(lambda db: db.execute("UPDATE jobs SET status='running',attempts=attempts+1,updated_at=? WHERE id=? AND status='queued'",
+                                         [now(),j["id"]]).rowcount)
+        if claimed: return q("SELECT * FROM jobs WHERE id=?",[j["id"]],one=True)
+
+def run_job(j):
+    fn,_=JOB_KINDS.get(j["kind"],(None,None))
+    try:
+        if not fn: raise RuntimeError(f"unknown job kind {j['kind']!r}")
+        p=json.loads(j["payload"] or "{}"); p.setdefault("owner_id",j["owner_id"])
+        res=fn(j["id"],p)
+        m("UPDATE jobs SET status='done',progress=1,result=?,updated_at=? WHERE id=?",[str(res or ""),now(),j["id"]])
+    except Exception as e:
+        retry=fn is not None and j["attempts"]<j["max_attempts"]
+        m("UPDATE jobs SET status=?,message=?,run_after=?,updated_at=? WHERE id=?",
+          ["queued" if retry else "failed",f"{type(e).__name__}: {e}",now(5*2**j["attempts"] if retry else 0),now(),j["id"]])
+
+def job_worker():
+    while True:
+        with app.app_context():
+            j=claim_job()
+            if j: run_job(j); continue
+        _job_wake.wait(JOB_POLL); _job_wake.clear()
+
+def schedule(kind,seconds,idle=0):
+    """Run kind every `seconds`; with idle>0 also run it early once requests have stopped for `idle`
+    seconds, if any arrived since its last run (so a quiet app isn't maintained over and over)."""
+    if seconds>0: SCHEDULE[kind]=(seconds,idle)
+
+@app.before_request
+def note_request():
+    global LAST_REQUEST
+    LAST_REQUEST=time.time()
+
+def enqueue_due():
+    """Queue every scheduled kind that is due; state lives in jobs, so restarts don't reset it."""
+    for kind,(every,idle) in SCHEDULE.items():
+        if q("SELECT 1 FROM jobs WHERE kind=? AND owner_id IS NULL AND status IN ('queued','running') LIMIT 1",[kind],one=True): continue
+        last=q("SELECT MAX(created_at) t FROM jobs WHERE kind=? AND owner_id IS NULL",[kind],one=True)["t"] or 0
+        if last<now(-every) or (idle and LAST_REQUEST>last and time.time()-LAST_REQUEST>=idle): enqueue(kind)
+
+def scheduler(poll=30):
+    while True:
+        with app.app_context(): enqueue_due()
+        time.sleep(poll)
+
+def start_workers(n=JOB_WORKERS):
+    with app.app_context():  # jobs interrupted by a crash/restart go back in the queue
+        m("UPDATE jobs SET status='queued',updated_at=? WHERE status='running'",[now()])
+    for _ in range(n): threading.Thread(target=job_worker,daemon=True,name="job-worker").start()
+    if SCHEDULE: threading.Thread(target=scheduler,daemon=True,name="job-scheduler").start()
+    if REPLICA_DIR: threading.Thread(target=replica_publisher,daemon=True,name="replica-publisher").start()
+
+@job("export_payments","Export payments (CSV)")
+def job_export_payments(jid,p):
+    import csv
+    EXPORT_DIR.mkdir(exist_ok=True); path=EXPORT_DIR/f"payments-{jid}.csv"
+    oid=p["owner_id"]; names={e["id"]:e["full_name"] for e in find_employees(oid,cols="id,full_name")}
+    total=q(f"SELECT COUNT(*) c FROM {history('payment_records',get_db(oid))} WHERE owner_id=?",[oid],one=True,tenant=oid)["c"]; done=0; after=0
+    with open(path,"w",newline="",encoding="utf-8") as f:
+        w=csv.writer(f); w.writerow(["id","employee","amount","currency","period","method","reference","notes","paid_on"])
+        while True:
+            rows=emp_payments(oid,archived=True,order="id",after=after,limit=500)
+            if not rows: break
+            for r in rows:
+                w.writerow([r["id"],names.get(r["employee_id"],r["employee_id"]),from_minor(r["amount_minor"],r["currency"]),r["currency"],
+                            r["period"],r["method"],r["reference"],r["notes"],fts(r["paid_on"])])
+            after=rows[-1]["id"]; done+=len(rows); job_progress(jid,done,total,f"{done}/{total} rows")
+    return path.name
+
+@job("bulk_payroll","Bulk payroll run")
+def job_bulk_payroll(jid,p):
+    oid=p["owner_id"]; emps=find_employees(oid,st=p.get("status","active"),cols="id",order="id"); ref=f"job:{jid}"
+    done={r["employee_id"] for r in q("SELECT employee_id FROM payment_records WHERE owner_id=? AND reference=?",[oid,ref],tenant=oid)}  # retry-safe
+    for i,e in enumerate(emps,1):
+        if e["id"] not in done:
+            add_payment(oid,e["id"],p["amount"],p.get("currency","USD"),p.get("period",""),p.get("method",""),ref,p.get("notes",""))
+        if i%25==0 or i==len(emps): job_progress(jid,i,len(emps),f"{i}/{len(emps)} employees")
+    return f"{len(emps)} employees paid"
+
+@job("pay_periods","Pay period rollover")
+def job_pay_periods(jid,p):
+    """Roll over every open period whose cycle has ended, starting the new one at the boundary it
+    passed (the latest, if the app was down for several)."""
+    n=0
+    for r in q("SELECT owner_id,starts_at,cycle FROM pay_periods WHERE ends_at IS NULL AND cycle!='manual'",rec=True):
+        at=None; nxt=period_end(r["starts_at"],r["cycle"])
+        while nxt<=now(): at,nxt=nxt,period_end(nxt,r["cycle"])
+        if at: rollover(r["owner_id"],at); n+=1
+    return f"{n} pay periods rolled over"
+
+schedule("pay_periods",PAY_PERIOD_CHECK)
+
+@job("import_employees","Import employees (CSV)")
+def job_import_employees(jid,p):
+    """Retry-safe like bulk_payroll: the result file is appended to, each created row is written (and
+    flushed) before its account, and a retry skips recorded rows, creating any recorded account that
+    doesn't exist yet with the password the file already hands out."""
+    import csv
+    src=EXPORT_DIR/p["file"]; out=EXPORT_DIR/f"import-{jid}.csv"
+    with open(src,newline="",encoding="utf-8-sig") as f: rows=list(csv.DictReader(f))
+    done={}
+    if out.exists():
+        with open(out,newline="",encoding="utf-8") as f: done={int(r["row"]):r for r in csv.DictReader(f) if r.get("row","").isdigit()}
+    with open(out,"a",newline="",encoding="utf-8") as f:
+        w=csv.writer(f)
+        if not f.tell(): w.writerow(["row","email","full_name","result","temporary_password"])
+        for i,r in enumerate(rows,1):
+            email=(r.get("email") or "").strip().lower(); name=(r.get("full_name") or "").strip()
+            given=(r.get("password") or "").strip(); extra=((r.get("position") or "").strip(),(r.get("phone") or "").strip(),p["owner_id"])
+            d=done.get(i)
+            if d:
+                if d["result"]=="created" and not q("SELECT id FROM users WHERE email=?",[email],one=True):
+                    create_user(email,d["temporary_password"] or given,name,"employee",*extra)
+            else:
+                pw=given or secrets.token_urlsafe(9); errs=user_errors(email,pw,name)
+                w.writerow([i,email,name," ".join(errs) or "created","" if errs or given else pw]); f.flush(); os.fsync(f.fileno())
+                if not errs: create_user(email,pw,name,"employee",*extra)
+            if i%25==0 or i==len(rows): job_progress(jid,i,len(rows),f"{i}/{len(rows)} rows")
+    job_progress(jid,1,1,f"{len(rows)} rows. The result lists temporary passwords: it can be downloaded once, "
+                         f"within {IMPORT_KEEP//3600} hours.")
+    src.unlink()
+    return out.name
+
+@job("archive","Archive old payments & notes")
+def job_archive(jid,p):
+    return f"{archive_rows(p.get('days'))} rows archived"
+
+@command("archive","[days]  move payments/notes older than days (default BIZ_ARCHIVE_AFTER_DAYS) into archive files")
+def cmd_archive(days=None): print(f"{archive_rows(int(days) if days else None)} rows archived")
+
+def job_row(j):
+    pct=int(j["progress"]*100); label=JOB_KINDS.get(j["kind"],(None,j["kind"]))[1]
+    badge={"done":"badge-active","failed":"badge-suspended","running":"badge-employee"}.get(j["status"],"badge-unpaid")
+    return f"""<tr>
+      <td><a href="/jobs/{j["id"]}" style="color:var(--blue-600);font-weight:600;">#{j["id"]} {escape(label)}</a></td>
+      <td><span class="badge {badge}">{j["status"]}</span></td>
+      <td style="min-width:120px;"><div style="height:6px;background:var(--gray-200);border-radius:3px;">
+        <div style="height:6px;width:{pct}%;background:var(--blue-500);border-radius:3px;"></div></div></td>
+      <td class="text-muted text-sm">{fdate(j["created_at"])}</td></tr>"""
+
+@app.route("/jobs", methods=["GET","POST"])
+@owner_req
+def jobs():
+    u=me()
+    if request.method=="POST":
+        kind=request.form.get("kind",""); p={}
+        if kind=="bulk_payroll":
+            p={k:request.form.get(k,"").strip() for k in ("amount","currency","period","method","notes")}
+            try: to_minor(p["amount"],p["currency"] or "USD")
+            except ValueError: flash("Invalid amount.","danger"); return redir("/jobs")
+        elif kind=="payslips":
+            p={"period":request.form.get("period",type=int)}
+        elif kind=="import_employees":
+            f=request.files.get("csv")
+            if not f or not f.filename: flash("Choose a CSV file.","danger"); return redir("/jobs")
+            EXPORT_DIR.mkdir(exist_ok=True); p={"file":f"upload-{secrets.token_hex(8)}.csv"}; f.save(str(EXPORT_DIR/p["file"]))
+        elif kind not in OWNER_JOBS: flash("Unknown job.","danger"); return redir("/jobs")
+        jid=enqueue(kind,p,u["id"]); flash(f"{JOB_KINDS[kind][1]} queued.","success")
+        return redir(f"/jobs/{jid}")
+    js=q("SELECT * FROM jobs WHERE owner_id=? ORDER BY id DESC LIMIT 50",[u["id"]])
+    rows="".join(job_row(j) for j in js) or '<tr><td colspan="4" class="text-center text-muted" style="padding:30px;">No jobs yet.</td></tr>'
+    periods="".join(f'<option value="{r["id"]}">{fdate(r["starts_at"])} – {fdate(r["ends_at"]-1) if r["ends_at"] else "now (open)"}</option>'
+                    for r in q("SELECT id,starts_at,ends_at FROM pay_periods WHERE owner_id=? ORDER BY ends_at IS NULL,starts_at DESC LIMIT 12",[u["id"]]))
+    cnt=f"""
+    <div class="topbar">
+      <div><div class="page-title">Background Jobs</div><div class="page-subtitle">Heavy work runs here instead of inside page loads</div></div>
+    </div>
+    <div style="display:grid;grid-template-columns:1fr 340px;gap:20px;align-items:start;" class="jb-grid">
+      <div class="card"><div class="card-header"><div class="card-title">{I["clk"]} Recent Jobs</div></div>
+        <div class="table-wrap"><table><thead><tr><th>Job</th><th>Status</th><th>Progress</th><th>Queued</th></tr></thead>
+        <tbody>{rows}</tbody></table></div></div>
+      <div style="display:flex;flex-direction:column;gap:16px;">
+        <form method="POST" class="card"><input type="hidden" name="kind" value="bulk_payroll"/>
+          <div class="card-title mb-3">{I["cash"]} Bulk Payroll</div>
+          <div class="form-row">
+            <div class="form-group"><label class="form-label">Amount</label>
+              <input type="number" name="amount" class="form-control" step="0.01" min="0" required/></div>
+            <div class="form-group"><label class="form-label">Currency</label>
+              <select name="currency" class="form-control">{cur_options()}</select></div>
+          </div>
+          <div class="form-row">
+            <div class="form-group"><label class="form-label">Period</label><input type="text" name="period" class="form-control" placeholder="e.g. March 2025"/></div>
+            <div class="form-group"><label class="form-label">Method</label><input type="text" name="method" class="form-control" placeholder="Bank Transfer…"/></div>
+          </div>
+          <div class="form-hint mb-3">Pays every active employee.</div>
+          <button type="submit" class="btn btn-primary w-100">{I["chk"]} Queue Payroll</button></form>
+        <form method="POST" enctype="multipart/form-data" class="card"><input type="hidden" name="kind" value="import_employees"/>
+          <div class="card-title mb-3">{I["ppl"]} Import Employees</div>
+          <div class="form-group"><input type="file" name="csv" accept=".csv" class="form-control"/>
+            <div class="form-hint">Columns: email, full_name, position, phone, password (optional)</div></div>
+          <button type="submit" class="btn btn-secondary w-100">{I["plus"]} Queue Import</button></form>
+        <form method="POST" class="card"><input type="hidden" name="kind" value="payslips"/>
+          <div class="card-title mb-3">{I["crd"]} Payslips</div>
+          <div class="form-group"><select name="period" class="form-control">{periods or '<option value="">Month to date</option>'}</select>
+            <div class="form-hint">One HTML payslip per employee paid in the period, as a ZIP.</div></div>
+          <button type="submit" class="btn btn-secondary w-100">{I["arr"]} Generate Payslips</button></form>
+        <div class="card d-flex gap-2" style="flex-wrap:wrap;">
+          <form method="POST"><input type="hidden" name="kind" value="export_payments"/>
+            <button type="submit" class="btn btn-ghost btn-sm">{I["crd"]} Export Payments</button></form>
+        </div>
+      </div>
+    </div>
+    <style>@media(max-width:900px){{.jb-grid{{grid-template-columns:1fr!important;}}}}</style>"""
+    return layout("Jobs",cnt,u,"/jobs")
+
+@app.route("/jobs/<int:jid>")
+@owner_req
+def job_status(jid):
+    u=me(); j=q("SELECT * FROM jobs WHERE id=? AND owner_id=?",[jid,u["id"]],one=True)
+    if not j: flash("Job not found.","danger"); return redir("/jobs")
+    if request.args.get("format")=="json":
+        return jsonify({k:j[k] for k in ("id","kind","status","attempts","max_attempts","progress","message","result","updated_at")})
+    dl=f'<a href="/jobs/{jid}/download" class="btn btn-primary btn-sm">{I["arr"]} Download</a>' if j["status"]=="done" and j["result"].endswith((".csv",".zip")) else ""
+    cnt=f"""
+    <div class="topbar">
+      <div style="display:flex;align-items:center;gap:16px;">
+        <a href="/jobs" class="btn btn-ghost btn-sm btn-icon">{I["bck"]}</a>
+        <div><div class="page-title">Job #{jid}</div><div class="page-subtitle">{escape(JOB_KINDS.get(j["kind"],(None,j["kind"]))[1])}</div></div>
+      </div>{dl}
+    </div>
+    <div class="card" style="max-width:580px;">
+      <div class="d-flex justify-between align-center mb-3"><span id="jst" class="badge badge-employee">{j["status"]}</span>
+        <span class="text-muted text-sm">Attempt <span id="jat">{j["attempts"]}</span> of {j["max_attempts"]}</span></div>
+      <div style="height:10px;background:var(--gray-200);border-radius:5px;">
+        <div id="jbar" style="height:10px;width:{int(j["progress"]*100)}%;background:var(--blue-500);border-radius:5px;transition:width .3s;"></div></div>
+      <div id="jmsg" class="text-sm text-muted mt-3">{escape(j["message"] or "")}</div>
+      <div id="jres" class="text-sm mt-2">{escape(j["result"] or "")}</div>
+    </div>
+    <script>
+    (function poll(){{
+      fetch("/jobs/{jid}?format=json").then(r=>r.json()).then(j=>{{
+        document.getElementById("jst").textContent=j.status;document.getElementById("jat").textContent=j.attempts;
+        document.getElementById("jbar").style.width=Math.round(j.progress*100)+"%";
+        document.getElementById("jmsg").textContent=j.message||"";document.getElementById("jres").textContent=j.result||"";
+        if(j.status==="queued"||j.status==="running")setTimeout(poll,1500);
+        else if(j.status==="done"&&{"true" if j["status"] in ("queued","running") else "false"})location.reload();
+      }}).catch(()=>setTimeout(poll,5000));
+    }})();
+    </script>"""
+    return layout(f"Job #{jid}",cnt,u,"/jobs")
+
+@app.route("/jobs/<int:jid>/download")
+@owner_req
+def job_download(jid):
+    u=me(); j=q("SELECT * FROM jobs WHERE id=? AND owner_id=? AND status='done'",[jid,u["id"]],one=True)
+    path=EXPORT_DIR/(j["result"] if j else "-")
+    if not j or path.suffix not in (".csv",".zip") or not path.is_file(): flash("Nothing to download.","danger"); return redir("/jobs")
+    if path.name.startswith("import-"):  # temporary passwords: hand them over once
+        data=path.read_bytes(); path.unlink()
+        return send_file(io.BytesIO(data),mimetype="text/csv",as_attachment=True,download_name=path.name)
+    return send_file(path,mimetype="text/csv" if path.suffix==".csv" else "application/zip",as_attachment=True,download_name=path.name)
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  BACKUP (online snapshots via the sqlite3 backup API)
+# ═══════════════════════════════════════════════════════════════════════════
+BACKUP_DIR=APP_DIR/"backups"
+BACKUP_KEEP=int(os.environ.get("BIZ_BACKUP_KEEP","7"))
+BACKUP_EVERY=float(os.environ.get("BIZ_BACKUP_EVERY_HOURS","24"))*3600
+BACKUP_PAGES=256     # pages copied per step
+BACKUP_PAUSE=0.005   # seconds yielded to writers between steps
+schedule("backup",BACKUP_EVERY)
+
+class StallProbe(threading.Thread):
+    """Repeatedly takes and releases the write lock on its own connection. The slowest acquisition is the
+    worst stall a writer saw during the copy, including any contention with the app's own writers."""
+    def __init__(self,path,every=0.02):
+        super().__init__(daemon=True); self.path,self.every,self.max=path,every,0.0; self.halt=threading.Event()
+    def run(self):
+        db=sqlite3.connect(str(self.path),timeout=30,isolation_level=None)
+        while not self.halt.is_set():
+            t=time.perf_counter(); db.execute("BEGIN IMMEDIATE"); db.execute("ROLLBACK")
+            self.max=max(self.max,time.perf_counter()-t); self.halt.wait(self.every)
+        db.close()
+
+def copy_db(src_path,dst_path,pages=BACKUP_PAGES,pause=BACKUP_PAUSE):
+    """Incremental online copy; sleeps between steps so writers are never starved. Returns pages copied.
+    The source read transaction stays open for the whole copy, so the result is one point in time and
+    concurrent commits (which would otherwise restart the backup) only land in the WAL meanwhile."""
+    src=sqlite3.connect(str(src_path),isolation_level=None); dst=sqlite3.connect(str(dst_path)); total=[0]
+    def step(status,remaining,count): total[0]=count; time.sleep(pause)
+    try:
+        src.execute("BEGIN"); src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst,pages=pages,progress=step); src.execute("COMMIT")
+    finally: dst.close(); src.close()
+    return total[0]
+
+def verify_db(path):
+    db=sqlite3.connect(str(path))
+    try: return db.execute("PRAGMA integrity_check").fetchone()[0]=="ok"
+    finally: db.close()
+
+def snapshot(pages=BACKUP_PAGES,pause=BACKUP_PAUSE):
+    """Write backups/<stamp>/ holding the database plus archive years, verify each file and prune old snapshots."""
+    stamp=datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S"); tmp=BACKUP_DIR/f".{stamp}"; tmp.mkdir(parents=True)
+    files=db_files()+sorted(ARCHIVE_DIR.glob("*.db"))
+    probe=StallProbe(DB_PATH); probe.start(); t=time.perf_counter(); size=0
+    try:
+        for f in files:
+            (tmp/f.parent.relative_to(DB_PATH.parent)).mkdir(exist_ok=True); out=tmp/f.relative_to(DB_PATH.parent)
+            copy_db(f,out,pages,pause)
+            if not verify_db(out): raise RuntimeError(f"integrity check failed for {out.name}")
+            size+=out.stat().st_size
+    except Exception:
+        shutil.rmtree(tmp,ignore_errors=True); raise
+    finally: probe.halt.set(); probe.join()
+    secs=time.perf_counter()-t
+    stats={"snapshot":stamp,"files":len(files),"bytes":size,"seconds":round(secs,3),
+           "mb_per_s":round(size/1e6/max(secs,1e-9),2),"max_writer_stall_ms":round(probe.max*1000,2)}
+    (tmp/"snapshot.json").write_text(json.dumps(stats)); tmp.rename(BACKUP_DIR/stamp)
+    prune_snapshots(); return stats
+
+def snapshots(): return sorted(p for p in BACKUP_DIR.glob("[0-9]*-[0-9]*") if p.is_dir())
+
+def prune_snapshots(keep=BACKUP_KEEP):
+    for p in snapshots()[:-keep] if keep>0 else []: shutil.rmtree(p,ignore_errors=True)
+
+def restore(snap):
+    """Copy a verified snapshot back over the live database and archive files; database files the snapshot
+    doesn't have are renamed to *.pre-restore. Stop the server first."""
+    snap=Path(snap) if Path(snap).is_dir() else BACKUP_DIR/snap
+    files=[p for p in snap.rglob("*.db")]
+    if not files: raise SystemExit(f"no snapshot at {snap}")
+    for f in files:
+        if not verify_db(f): raise SystemExit(f"{f} fails integrity check; not restoring")
+    # Archive years and shards newer than the snapshot would otherwise be read back next to it.
+    keep={DB_PATH.parent/f.relative_to(snap) for f in files}
+    for f in sorted(ARCHIVE_DIR.glob("*.db"))+sorted(TENANT_DIR.glob("owner-*.db")):
+        if f not in keep:
+            for side in (f,Path(f"{f}-wal"),Path(f"{f}-shm")):
+                if side.exists(): side.rename(side.with_name(side.name+".pre-restore"))
+    for f in files:
+        dst=DB_PATH.parent/f.relative_to(snap); dst.parent.mkdir(exist_ok=True); copy_db(f,dst,pause=0)
+    if FRAGS is not None: FRAGS.clear()  # a shared fragcache.db outlives the server
+    return len(files)
+
+def backup_summary(st):
+    return (f"snapshot {st['snapshot']}: {st['bytes']/1e6:.1f} MB in {st['seconds']}s "
+            f"({st['mb_per_s']} MB/s), max writer stall {st['max_writer_stall_ms']} ms")
+
+@job("backup","Backup snapshot")
+def job_backup(jid,p): return backup_summary(snapshot())
+
+@command("backup","take a verified snapshot now")
+def cmd_backup(): print(backup_summary(snapshot()))
+
+@command("snapshots","list snapshots")
+def cmd_snapshots():
+    for p in snapshots():
+        st=json.loads((p/"snapshot.json").read_text()) if (p/"snapshot.json").exists() else None
+        print(backup_summary(st) if st else p.name)
+
+@command("restore","<snapshot> restore a snapshot (server must be stopped)")
+def cmd_restore(snap=None):
+    if not snap:
+        print("usage: BizManager_1.py restore <snapshot>\navailable:"); cmd_snapshots(); return 1
+    print(f"restored {restore(snap)} file(s) from {snap}")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  DATABASE MAINTENANCE (statistics, incremental vacuum, WAL checkpoints, size history)
+# ═══════════════════════════════════════════════════════════════════════════
+MAINT_EVERY=float(os.environ.get("BIZ_MAINT_EVERY_HOURS","6"))*3600
+MAINT_IDLE=int(os.environ.get("BIZ_MAINT_IDLE","300"))      # also run after this many quiet seconds (0 = schedule only)
+MAINT_WAL_MB=float(os.environ.get("BIZ_MAINT_WAL_MB","64"))  # truncate the WAL once it grows past this
+MAINT_VACUUM_PAGES=int(os.environ.get("BIZ_MAINT_VACUUM_PAGES","4096"))  # freelist pages returned per file per run
+MAINT_VACUUM_STEP=256  # pages per incremental_vacuum; the write lock is released between steps
+MAINT_KEEP_DAYS=90     # maint_log history
+schedule("maintenance",MAINT_EVERY,MAINT_IDLE)
+
+def wal_bytes(path): w=Path(f"{path}-wal"); return w.stat().st_size if w.exists() else 0
+
+def maintain(path):
+    """One pass over a database file on its own connection: refresh planner statistics, return up to
+    MAINT_VACUUM_PAGES free pages to the filesystem, checkpoint the WAL (TRUNCATE past MAINT_WAL_MB,
+    else PASSIVE). Returns the maint_log row."""
+    db=sqlite3.connect(str(path),isolation_level=None,timeout=30); vac=0
+    try:
+        db.execute("PRAGMA analysis_limit=400"); db.execute("ANALYZE"); db.execute("PRAGMA optimize")
+        if db.execute("PRAGMA auto_vacuum").fetchone()[0]==2:
+            while vac<MAINT_VACUUM_PAGES:
+                n=min(MAINT_VACUUM_STEP,MAINT_VACUUM_PAGES-vac,db.execute("PRAGMA freelist_count").fetchone()[0])
+                if n<=0: break
+                db.execute(f"PRAGMA incremental_vacuum({n})").fetchall(); vac+=n; time.sleep(BACKUP_PAUSE)
+        mode="TRUNCATE" if wal_bytes(path)>MAINT_WAL_MB*1e6 else "PASSIVE"
+        busy,_,_=db.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        free=db.execute("PRAGMA freelist_count").fetchone()[0]
+    finally: db.close()
+    return dict(at=now(),file=path.name,db_bytes=path.stat().st_size,wal_bytes=wal_bytes(path),free_pages=free,
+                vacuumed=vac,checkpoint=mode.lower()+(" (busy)" if busy else ""))
+
+def maintain_all():
+    rows=[maintain(p) for p in db_files()]
+    for r in rows: m(f"INSERT INTO maint_log({','.join(r)}) VALUES({','.join('?'*len(r))})",list(r.values()))
+    m("DELETE FROM maint_log WHERE at<?",[now(-86400*MAINT_KEEP_DAYS)])
+    return rows
+
+def size_trend(file,days=30):
+    """(first, latest) maint_log rows for file within the window, or None."""
+    rows=q("SELECT * FROM maint_log WHERE file=? AND at>=? ORDER BY at",[file,now(-86400*days)])
+    return (rows[0],rows[-1]) if rows else None
+
+def maint_summary(r,days=30):
+    mb=lambda b: f"{b/1e6:.1f} MB"; tr=size_trend(r["file"],days); first=tr[0] if tr else r
+    return (f"{r['file']}: db {mb(r['db_bytes'])} ({(r['db_bytes']-first['db_bytes'])/1e6:+.1f} MB/{days}d), "
+            f"wal {mb(r['wal_bytes'])} ({(r['wal_bytes']-first['wal_bytes'])/1e6:+.1f}), {r['free_pages']} free pages, "
+            f"{r['vacuumed']} vacuumed, checkpoint {r['checkpoint']}")
+
+@job("maintenance","Database maintenance")
+def job_maintenance(jid,p): return "; ".join([maint_summary(r) for r in maintain_all()]+[f"{expire_imports()} import result(s) expired"])
+
+def expire_imports():
+    """Delete import results (temporary passwords) nobody downloaded within IMPORT_KEEP."""
+    old=[f for f in EXPORT_DIR.glob("import-*.csv") if f.stat().st_mtime<time.time()-IMPORT_KEEP] if EXPORT_DIR.is_dir() else []
+    for f in old: f.unlink(missing_ok=True)
+    return len(old)
+
+@command("maintain","run database maintenance now")
+def cmd_maintain():
+    with app.app_context():
+        for r in maintain_all(): print(maint_summary(r))
+
+@command("dbstats","[days]  database and WAL size trend from maintenance runs")
+def cmd_dbstats(days="30"):
+    with app.app_context():
+        for f in [p.name for p in db_files()]:
+            rows=q("SELECT * FROM maint_log WHERE file=? AND at>=? ORDER BY at",[f,now(-86400*int(days))])
+            for r in rows: print(f"{fts(r['at'])}  {f:<20} db {r['db_bytes']/1e6:8.1f} MB  wal {r['wal_bytes']/1e6:7.1f} MB  "
+                                 f"free {r['free_pages']:6d}  vacuumed {r['vacuumed']:6d}  {r['checkpoint']}")
+            if rows: print(maint_summary(rows[-1],int(days)))
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  READ REPLICAS (followers serve GETs from published snapshots and forward writes)
+# ═══════════════════════════════════════════════════════════════════════════
+# The primary (BIZ_REPLICA_DIR set) copies every database file into that directory with the backup
+# API whenever something was committed, at most every BIZ_REPLICA_EVERY seconds, and points
+# current.json at the copy; when nothing changed it only re-stamps current.json. A follower
+# (BIZ_REPLICA_OF=<primary URL>, the same BIZ_REPLICA_DIR and BIZ_SECRET_KEY) copies each new
+# snapshot into its own directory, swaps it in by rename and serves GETs from it read-only.
+# Forwarded to the primary instead: every non-GET, the REPLICA_FORWARD endpoints, everything while
+# the snapshot is more than BIZ_REPLICA_MAX_LAG seconds behind, and a client's reads after it
+# wrote until a snapshot taken after that write arrives (read-your-writes, via the _w cookie).
+REPLICA_DIR=Path(os.environ["BIZ_REPLICA_DIR"]) if os.environ.get("BIZ_REPLICA_DIR") else None
+REPLICA_OF=os.environ.get("BIZ_REPLICA_OF","").rstrip("/")
+REPLICA_EVERY=float(os.environ.get("BIZ_REPLICA_EVERY","5"))
+REPLICA_MAX_LAG=float(os.environ.get("BIZ_REPLICA_MAX_LAG","30"))
+REPLICA_KEEP=3        # published snapshots kept, so a follower mid-copy isn't pulled out from under
+REPLICA_TIMEOUT=60    # seconds for a forwarded request (longer than SSE_HEARTBEAT)
+REPLICA_FORWARD={"events","job_download"}  # live streams and files that only exist on the primary
+REPLICA={"snapshot":None,"taken_at":0.0,"pulled_at":0.0}
+
+if REPLICA_OF:
+    if not REPLICA_DIR: raise SystemExit("BIZ_REPLICA_OF needs BIZ_REPLICA_DIR")
+    _local=Path(os.environ.get("BIZ_REPLICA_LOCAL") or APP_DIR/"replica")
+    DB_PATH,TENANT_DIR,ARCHIVE_DIR,LOG_DIR=_local/DB_PATH.name,_local/TENANT_DIR.name,_local/ARCHIVE_DIR.name,_local/LOG_DIR.name
+    if FRAGS is not None and FRAGS.store!="memory": FRAGS=FragCache(FRAG_LIMIT)  # don't mix replica renders into the primary's store
+
+def replica_connect(path):
+    """Snapshot files are replaced by rename and never written, so followers open them immutable.
+    A tenant shard the primary hasn't created yet reads as an empty in-memory schema."""
+    if path.exists(): db=sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro&immutable=1",uri=True)
+    else: db=sqlite3.connect(":memory:"); db.executescript(SCHEMA)
+    db.row_factory=sqlite3.Row; return db
+
+def replica_lag(): return time.time()-REPLICA["taken_at"]
+
+def replica_files(): return db_files()+sorted(ARCHIVE_DIR.glob("*.db"))
+
+_pub_conns={}
+def replica_signature():
+    """PRAGMA data_version per file, read on connections kept open for the purpose: it changes
+    exactly when another connection commits to that file."""
+    sig=[]
+    for f in replica_files():
+        if f not in _pub_conns: _pub_conns[f]=sqlite3.connect(str(f),check_same_thread=False)
+        sig.append((str(f),_pub_conns[f].execute("PRAGMA data_version").fetchone()[0]))
+    return tuple(sig)
+
+def replica_current(snap,taken_at):
+    tmp=REPLICA_DIR/".current.json"; tmp.write_text(json.dumps({"snapshot":snap,"taken_at":taken_at}))
+    os.replace(tmp,REPLICA_DIR/"current.json")
+
+def publish_replica(taken_at):
+    """Copy every database file into REPLICA_DIR/<ms>/ (journal_mode=DELETE, so readers need no WAL)."""
+    snap=str(int(taken_at*1000)); tmp=REPLICA_DIR/f".{snap}"
+    try:
+        for f in replica_files():
+            out=tmp/f.relative_to(DB_PATH.parent); out.parent.mkdir(parents=True,exist_ok=True); copy_db(f,out,pause=0)
+            db=sqlite3.connect(str(out)); db.execute("PRAGMA journal_mode=DELETE"); db.close()
+        tmp.rename(REPLICA_DIR/snap)
+    except Exception: shutil.rmtree(tmp,ignore_errors=True); raise
+    replica_current(snap,taken_at)
+    for p in sorted(p for p in REPLICA_DIR.iterdir() if p.is_dir() and p.name.isdigit())[:-REPLICA_KEEP]: shutil.rmtree(p,ignore_errors=True)
+    return snap
+
+def replica_publisher():
+    REPLICA_DIR.mkdir(parents=True,exist_ok=True); last=snap=None
+    while True:
+        t=time.time()  # a snapshot is current as of a time taken before its signature was read
+        try:
+            sig=replica_signature()
+            if sig!=last: snap=publish_replica(t); last=sig
+            else: replica_current(snap,t)
+        except Exception as e: print(f"replica publish failed: {type(e).__name__}: {e}")
+        time.sleep(REPLICA_EVERY)
+
+def pull_replica():
+    """Bring the local copy up to the published snapshot. Files are copied to a staging dir then
+    renamed over the live ones; open connections keep reading the file they opened."""
+    cur=json.loads((REPLICA_DIR/"current.json").read_text())
+    if cur["snapshot"]!=REPLICA["snapshot"]:
+        src=REPLICA_DIR/cur["snapshot"]; stage=DB_PATH.parent/f".stage-{cur['snapshot']}"
+        try:
+            rel=[f.relative_to(src) for f in src.rglob("*.db")]
+            for r in rel: (stage/r).parent.mkdir(parents=True,exist_ok=True); shutil.copyfile(src/r,stage/r)
+            for r in rel: (DB_PATH.parent/r).parent.mkdir(parents=True,exist_ok=True); os.replace(stage/r,DB_PATH.parent/r)
+        finally: shutil.rmtree(stage,ignore_errors=True)
+        if FRAGS is not None: FRAGS.clear()
+        IDS.bump()
+    REPLICA.update(snapshot=cur["snapshot"],taken_at=cur["taken_at"],pulled_at=time.time())
+
+def start_follower(wait=60):
+    DB_PATH.parent.mkdir(parents=True,exist_ok=True); end=time.time()+wait
+    while True:
+        try: pull_replica(); break
+        except (OSError,ValueError,KeyError):
+            if time.time()>end: raise SystemExit(f"no snapshot published in {REPLICA_DIR}")
+            time.sleep(0.5)
+    def loop():
+        while True:
+            time.sleep(min(1.0,REPLICA_EVERY/2))
+            try: pull_replica()
+            except Exception as e: print(f"replica pull failed: {type(e).__name__}: {e}")
+    threading.Thread(target=loop,daemon=True,name="replica-puller").start()
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self,*a,**k): return None  # hand 3xx back to the client untouched
+_forwarder=urllib.request.build_opener(_NoRedirect)
+FORWARD_REQ={"cookie","content-type","accept","last-event-id","if-none-match","user-agent"}
+FORWARD_RESP={"content-type","location","set-cookie","cache-control","etag","content-disposition","retry-after","x-accel-buffering"}
+
+def forward():
+    """Replay the request against the primary and stream its response back."""
+    req=urllib.request.Request(REPLICA_OF+request.full_path.rstrip("?"),method=request.method,
+                               data=request.get_data() if request.method not in ("GET","HEAD") else None,
+                               headers={k:v for k,v in request.headers.items() if k.lower() in FORWARD_REQ})
+    try: resp=_forwarder.open(req,timeout=REPLICA_TIMEOUT)
+    except urllib.error.HTTPError as e: resp=e
+    except OSError:
+        r=make_response("Primary unavailable",503); r.headers["Retry-After"]="5"; return r
+    def body():
+        try: yield from (iter(lambda: resp.read1(65536),b"") if hasattr(resp,"read1") else [resp.read()])
+        except (OSError,http.client.HTTPException): pass  # primary went away mid-stream; the client reconnects
+        finally: resp.close()
+    r=Response(body(),status=resp.code)
+    for k,v in resp.headers.items():
+        if k.lower() in FORWARD_RESP: r.headers.add(k,v)
+    r.headers["X-Replica"]="forwarded"
+    if request.method not in ("GET","HEAD"):
+        r.set_cookie("_w",resp.headers.get("X-Primary-Time") or f"{time.time():.3f}",max_age=int(REPLICA_MAX_LAG)+60,httponly=True,samesite="Lax")
+    return r
+
+@app.before_request
+def replica_route():
+    if not REPLICA_OF or request.endpoint=="replica_status": return None
+    try: wrote=float(request.cookies.get("_w") or 0)
+    except ValueError: wrote=0
+    if (request.method not in ("GET","HEAD") or request.endpoint in REPLICA_FORWARD
+            or replica_lag()>REPLICA_MAX_LAG or wrote>REPLICA["taken_at"]): return forward()
+
+@app.after_request
+def replica_headers(r):
+    if REPLICA_OF: r.headers["X-Replica-Lag"]=f"{replica_lag():.1f}"
+    elif REPLICA_DIR: r.headers["X-Primary-Time"]=f"{time.time():.3f}"
+    return r
+
+@app.route("/replica/status")
+@admin_req
+def replica_status():
+    role="follower" if REPLICA_OF else "primary" if REPLICA_DIR else "standalone"
+    return jsonify(role=role,snapshot=REPLICA["snapshot"],lag=round(replica_lag(),3) if REPLICA_OF else 0,max_lag=REPLICA_MAX_LAG)
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  SHARDING (one-off move of tenant rows into per-owner files)
+# ═══════════════════════════════════════════════════════════════════════════
+@command("shard","move payments/notes from the directory database into per-owner files (BIZ_SHARDED=1)")
+def cmd_shard():
+    """Run once, with the server stopped, before switching BIZ_SHARDED on. Archive years already
+    written for the directory database stay there; run it before the first archival."""
+    if not SHARDED: raise SystemExit("set BIZ_SHARDED=1 first")
+    db=sqlite3.connect(str(DB_PATH),isolation_level=None); moved=0
+    try:
+        owners=[r[0] for r in db.execute(" UNION ".join(f"SELECT owner_id FROM {t} WHERE owner_id IS NOT NULL" for t in TENANT_TABLES))]
+        for oid in owners:
+            path=db_file(oid); connect(path).close()
+            db.execute("ATTACH DATABASE ? AS shard",[str(path)]); db.execute("BEGIN IMMEDIATE")
+            try:
+                for t in TENANT_TABLES:
+                    cols=",".join(table_cols(db,t))
+                    db.execute(f"INSERT OR IGNORE INTO shard.{t}({cols}) SELECT {cols} FROM main.{t} WHERE owner_id=?",[oid])
+                    moved+=db.execute(f"DELETE FROM main.{t} WHERE owner_id=?",[oid]).rowcount
+                    db.execute("DELETE FROM main.changes WHERE owner_id=? AND tbl=?",[oid,t])  # the shard's feed logged them as inserts
+                db.execute("COMMIT")
+            except Exception: db.execute("ROLLBACK"); raise
+            finally: db.execute("DETACH DATABASE shard")
+    finally: db.close()
+    print(f"moved {moved} rows into {len(owners)} tenant file(s)")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  PAYROLL ANALYTICS (payroll_monthly rollup, kept current by a trigger on payment inserts)
+# ═══════════════════════════════════════════════════════════════════════════
+def rebuild_rollups(db,oid=None):
+    """Recompute payroll_monthly from every payment, hot and archived (one owner's rows, given oid).
+    Archiving only deletes hot rows, so the rollup keeps counting archived payments without a rebuild."""
+    src=history("payment_records",db); where,args=("WHERE owner_id=?",[oid]) if oid is not None else ("",[])
+    db.execute(f"DELETE FROM payroll_monthly {where}",args)
+    db.execute(f"""INSERT INTO payroll_monthly(owner_id,month,currency,period,method,total,payments)
+        SELECT COALESCE(owner_id,0),strftime('%Y-%m',paid_on,'unixepoch'),currency,COALESCE(period,''),COALESCE(method,''),SUM(amount_minor),COUNT(*)
+        FROM {src} {where} GROUP BY 1,2,3,4,5""",args)
+    db.commit()
+
+@job("rebuild_rollups","Rebuild payroll analytics")
+def job_rebuild_rollups(jid,p):
+    db=sqlite3.connect(str(db_file(p.get("owner_id")))); rebuild_rollups(db,p.get("owner_id")); db.close(); return "rebuilt"
+
+@command("rollups","rebuild payroll analytics rollups from all payments")
+def cmd_rollups():
+    for path in db_files():
+        db=sqlite3.connect(str(path)); rebuild_rollups(db); db.close()
+    print(f"rebuilt rollups in {len(db_files())} file(s)")
+
+def month_add(ym,n):
+    y,mo=divmod(int(ym[:4])*12+int(ym[5:7])-1+n,12); return f"{y:04d}-{mo+1:02d}"
+
+def bars(rows,key,val,fmt):
+    top=max([r[val] or 0 for r in rows]+[1e-9])
+    return "".join(f"""<div style="display:flex;align-items:center;gap:10px;font-size:12px;">
+      <span style="width:90px;flex-shrink:0;color:var(--gray-500);">{escape(r[key] or "—")}</span>
+      <div style="flex:1;height:14px;background:var(--gray-100);border-radius:4px;">
+        <div style="height:14px;width:{100*(r[val] or 0)/top:.1f}%;background:linear-gradient(90deg,var(--blue-400),var(--blue-600));border-radius:4px;"></div></div>
+      <span style="width:110px;text-align:right;font-weight:700;">{fmt(r)}</span></div>""" for r in rows)
+
+@app.route("/analytics")
+@owner_req
+def analytics():
+    u=me(); oid=u["id"]; this=fts(now())[:7]
+    ym=lambda k: v if re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])",v:=request.args.get(k,"")) else None
+    to=ym("to") or this; frm=ym("from") or month_add(to,-11)
+    cur=request.args.get("currency","")
+    currencies=[r["currency"] for r in q("SELECT currency,SUM(total) t FROM payroll_monthly WHERE owner_id=? GROUP BY currency ORDER BY t DESC",[oid],tenant=oid)]
+    cur=cur if cur in currencies else (currencies[0] if currencies else "USD")
+    # Month series with year-to-date running totals (window function, over every month so a range
+    # starting mid-year still counts January on) and the same month a year earlier.
+    months=q("""WITH mt AS (SELECT month,SUM(total) total,SUM(payments) payments FROM payroll_monthly
+                            WHERE owner_id=? AND currency=? GROUP BY month),
+             yt AS (SELECT *,SUM(total) OVER (PARTITION BY substr(month,1,4) ORDER BY month) ytd FROM mt)
+        SELECT m.month,m.total,m.payments,m.ytd,p.total prev
+        FROM yt m LEFT JOIN mt p ON p.month=printf('%04d',substr(m.month,1,4)-1)||substr(m.month,5)
+        WHERE m.month BETWEEN ? AND ? ORDER BY m.month""",[oid,cur,frm,to],tenant=oid)
+    def split(col):
+        return q(f"""SELECT {col} k,SUM(total) total,SUM(payments) payments FROM payroll_monthly
+                     WHERE owner_id=? AND currency=? AND month BETWEEN ? AND ? GROUP BY {col} ORDER BY total DESC LIMIT 12""",
+                 [oid,cur,frm,to],tenant=oid)
+    by_period,by_method=split("period"),split("method")
+    fmt=lambda r: money(r["total"],cur); num=lambda v: money(v,cur).split(" ",1)[1]
+    total=sum(r["total"] for r in months); pays=sum(r["payments"] for r in months)
+    yoy=[r for r in months if r["prev"]]
+    growth=(sum(r["total"] for r in yoy)/sum(r["prev"] for r in yoy)-1)*100 if yoy else None
+    mrows="".join(f"""<tr><td class="fw-bold">{r["month"]}</td><td>{money(r["total"],cur)}</td><td class="text-muted">{r["payments"]}</td>
+      <td>{money(r["ytd"],cur)}</td>
+      <td class="text-muted">{f'{(r["total"]/r["prev"]-1)*100:+.1f}%' if r["prev"] else "—"}</td></tr>""" for r in reversed(months)) or \
+      '<tr><td colspan="5" class="text-center text-muted" style="padding:30px;">No payments in this range.</td></tr>'
+    copts="".join(f'<option {"selected" if c==cur else ""}>{escape(c)}</option>' for c in currencies or ["USD"])
+    empty='<p class="text-muted text-sm">No data.</p>'
+    cnt=f"""
+    <div class="topbar">
+      <div><div class="page-title">Payroll Analytics</div><div class="page-subtitle">{frm} to {to} · {escape(cur)}</div></div>
+      <form method="POST" action="/jobs"><input type="hidden" name="kind" value="rebuild_rollups"/>
+        <button type="submit" class="btn btn-ghost btn-sm">{I["clk"]} Rebuild</button></form>
+    </div>
+    <form class="search-bar card" method="GET">
+      <label class="text-sm fw-bold">From</label><input type="month" name="from" value="{frm}" class="form-control" style="width:auto;"/>
+      <label class="text-sm fw-bold">To</label><input type="month" name="to" value="{to}" class="form-control" style="width:auto;"/>
+      <select name="currency" class="form-control" style="width:auto;">{copts}</select>
+      <button type="submit" class="btn btn-primary">{I["chart"]} Show</button>
+    </form>
+    <div class="stats-grid">
+      <div class="stat-card"><div class="stat-icon green">{I["cash"]}</div>
+        <div class="stat-value" style="font-size:24px;">{num(total)}</div><div class="stat-label">Total paid ({escape(cur)})</div></div>
+      <div class="stat-card"><div class="stat-icon blue">{I["crd"]}</div>
+        <div class="stat-value">{pays}</div><div class="stat-label">Payments</div></div>
+      <div class="stat-card"><div class="stat-icon purple">{I["chart"]}</div>
+        <div class="stat-value" style="font-size:24px;">{f"{growth:+.1f}%" if growth is not None else "—"}</div><div class="stat-label">Year over year</div></div>
+      <div class="stat-card"><div class="stat-icon orange">{I["ppl"]}</div>
+        <div class="stat-value" style="font-size:24px;">{num(round(total/len(months)) if months else 0)}</div><div class="stat-label">Avg per month</div></div>
+    </div>
+    <div style="display:grid;grid-template-columns:1fr 1fr;gap:20px;" class="an-grid">
+      <div class="card"><div class="card-header"><div class="card-title">{I["chart"]} By month</div></div>
+        <div style="display:flex;flex-direction:column;gap:6px;">{bars(months,"month","total",fmt) or empty}</div></div>
+      <div style="display:flex;flex-direction:column;gap:20px;">
+        <div class="card"><div class="card-header"><div class="card-title">By period</div></div>
+          <div style="display:flex;flex-direction:column;gap:6px;">{bars(by_period,"k","total",fmt) or empty}</div></div>
+        <div class="card"><div class="card-header"><div class="card-title">By method</div></div>
+          <div style="display:flex;flex-direction:column;gap:6px;">{bars(by_method,"k","total",fmt) or empty}</div></div>
+      </div>
+    </div>
+    <div class="card mt-4"><div class="table-wrap"><table>
+      <thead><tr><th>Month</th><th>Total</th><th>Payments</th><th>Year to date</th><th>vs last year</th></tr></thead>
+      <tbody>{mrows}</tbody></table></div></div>
+    <style>@media(max-width:900px){{.an-grid{{grid-template-columns:1fr!important;}}}}</style>"""
+    return layout("Analytics",cnt,u,"/analytics")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  PAYSLIPS (one HTML payslip per paid employee per pay period, rendered across a process pool)
+# ═══════════════════════════════════════════════════════════════════════════
+# The parent only lists who was paid in the period and hands out chunks of employee ids; each
+# worker process opens its own read-only connections, renders its chunk and sends back the
+# finished documents. The parent appends them to a ZIP on disk as they arrive, keeping at most
+# two chunks per worker in flight, so memory stays flat however many employees there are. Workers
+# are spawned rather than forked: the server process has writer, job and SSE threads running.
+PAYSLIP_WORKERS=int(os.environ.get("BIZ_PAYSLIP_WORKERS","0")) or os.cpu_count() or 2
+PAYSLIP_CHUNK=200  # employees per task
+
+def payslip_range(oid,pid=None):
+    """(start, end, label) for pay period pid, or by default the latest closed period, then the open
+    one, then the month to date for owners who haven't started pay periods."""
+    p=q("SELECT id,starts_at,ends_at FROM pay_periods WHERE owner_id=? AND id=?",[oid,pid],one=True) if pid else \
+      q("SELECT id,starts_at,ends_at FROM pay_periods WHERE owner_id=? ORDER BY ends_at IS NULL,starts_at DESC LIMIT 1",[oid],one=True)
+    if pid and not p: raise ValueError(f"no pay period {pid}")
+    if p: end=p["ends_at"] or now(); return p["starts_at"],end,f"{fdate(p['starts_at'])} – {fdate(end-1)}"
+    d=datetime.now(timezone.utc); start=int(datetime(d.year,d.month,1,tzinfo=timezone.utc).timestamp())
+    return start,now()+1,f"{d:%B %Y} to date"
+
+def payslip_html(company,label,e,lines,ytd):
+    rows="".join(f"""<tr><td>{fdate(p[6])}</td><td>{escape(p[3] or "Payment")}</td><td>{escape(p[4] or "—")}</td>
+      <td>{escape(p[5] or "")}</td><td class="r">{money(p[1],p[2])}</td></tr>""" for p in lines)
+    tot=lambda ps: "<br>".join(money(sum(p[1] for p in ps if p[2]==c),c) for c in sorted({p[2] for p in ps}))
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Payslip {escape(e[1])} {label}</title><style>
+body{{font:14px/1.5 system-ui,sans-serif;color:#0f172a;max-width:760px;margin:40px auto;padding:0 24px;}}
+h1{{font-size:22px;margin:0;}}.muted{{color:#64748b;}}table{{width:100%;border-collapse:collapse;margin:20px 0;}}
+th,td{{text-align:left;padding:8px;border-bottom:1px solid #e2e8f0;}}.r{{text-align:right;}}
+.tot{{display:flex;justify-content:space-between;gap:24px;padding:14px;background:#f1f5f9;border-radius:8px;}}
+@media print{{body{{margin:0;}}}}</style></head><body>
+<div style="display:flex;justify-content:space-between;align-items:flex-start;">
+<div><h1>{escape(company)}</h1><div class="muted">Payslip &middot; {label}</div></div>
+<div class="r"><b>{escape(e[1])}</b><br><span class="muted">{escape(e[3] or "")}<br>{escape(e[2])}<br>Employee #{e[0]}</span></div></div>
+<table><thead><tr><th>Paid on</th><th>Period</th><th>Method</th><th>Reference</th><th class="r">Amount</th></tr></thead>
+<tbody>{rows}</tbody></table>
+<div class="tot"><div><div class="muted">This period</div><b>{tot(lines)}</b></div>
+<div class="r"><div class="muted">Year to date</div><b>{tot(ytd)}</b></div></div></body></html>"""
+
+def payslip_chunk(task):
+    """Pool worker: render one chunk; returns [(zip member name, html bytes)]. Only paths and ids
+    cross the process boundary. Payments come from the tenant file plus any archive years given."""
+    users_db,pay_dbs,oid,ids,start,end,company,label=task
+    ro=lambda p: sqlite3.connect(f"{Path(p).resolve().as_uri()}?mode=ro",uri=True)
+    marks=",".join("?"*len(ids)); ystart=int(datetime(datetime.fromtimestamp(start,timezone.utc).year,1,1,tzinfo=timezone.utc).timestamp())
+    db=ro(users_db)
+    try: emps=db.execute(f"SELECT id,full_name,email,position FROM users WHERE owner_id=? AND id IN ({marks}) ORDER BY id",[oid]+ids).fetchall()
+    finally: db.close()
+    db=ro(pay_dbs[0]); pays={}
+    try:
+        for i,p in enumerate(pay_dbs[1:]): db.execute(f"ATTACH DATABASE ? AS a{i}",[f"{Path(p).resolve().as_uri()}?mode=ro"])
+        src=" UNION ALL ".join(f"""SELECT employee_id,amount_minor,currency,period,method,reference,paid_on FROM {s}.payment_records
+                                  WHERE owner_id=? AND employee_id IN ({marks}) AND paid_on>=? AND paid_on<?"""
+                               for s in ["main"]+[f"a{i}" for i in range(len(pay_dbs)-1)])
+        for r in db.execute(src+" ORDER BY 1,7",([oid]+ids+[ystart,end])*len(pay_dbs)): pays.setdefault(r[0],[]).append(r)
+    finally: db.close()
+    out=[]
+    for e in emps:
+        ytd=pays.get(e[0],[]); lines=[p for p in ytd if p[6]>=start]
+        name=re.sub(r"[^a-z0-9]+","-",e[1].lower()).strip("-") or "employee"
+        out.append((f"{e[0]:06d}-{name}.html",payslip_html(company,label,e,lines,ytd).encode()))
+    return out
+
+def make_payslips(oid,path,pid=None,workers=PAYSLIP_WORKERS,progress=None):
+    """Write every payslip for the period to a ZIP at path; returns (payslips, seconds).
+    progress(done,total,rate) is called as chunks land."""
+    import zipfile,multiprocessing
+    from concurrent.futures import ProcessPoolExecutor,wait,FIRST_COMPLETED
+    start,end,label=payslip_range(oid,pid)
+    ids=[r["e"] for r in q(f"SELECT DISTINCT employee_id e FROM {history('payment_records',get_db(oid))} WHERE owner_id=? AND paid_on>=? AND paid_on<? ORDER BY 1",
+                           [oid,start,end],tenant=oid)]
+    years=range(datetime.fromtimestamp(start,timezone.utc).year,datetime.fromtimestamp(end,timezone.utc).year+1)  # covers the year to date
+    pay_dbs=[str(db_file(oid))]+[str(a) for a in (archive_path(y,db_file(oid).stem) for y in years) if a.exists()]
+    company=q("SELECT full_name FROM users WHERE id=?",[oid],one=True)["full_name"]
+    tasks=iter([(str(DB_PATH),pay_dbs,oid,ids[i:i+PAYSLIP_CHUNK],start,end,company,label) for i in range(0,len(ids),PAYSLIP_CHUNK)])
+    tmp=path.with_name(path.name+".part"); path.parent.mkdir(parents=True,exist_ok=True); done=0; t0=time.perf_counter()
+    with zipfile.ZipFile(tmp,"w",zipfile.ZIP_DEFLATED,compresslevel=6) as zf, \
+         ProcessPoolExecutor(max(1,workers),mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending=set()
+        while True:
+            for t in tasks:
+                pending.add(pool.submit(payslip_chunk,t))
+                if len(pending)>=2*workers: break
+            if not pending: break
+            finished,pending=wait(pending,return_when=FIRST_COMPLETED)
+            for f in finished:
+                slips=f.result(); done+=len(slips)
+                for name,data in slips: zf.writestr(name,data)
+            if progress: progress(done,len(ids),done/(time.perf_counter()-t0))
+    os.replace(tmp,path)
+    return done,time.perf_counter()-t0
+
+@job("payslips","Payslips (ZIP)")
+def job_payslips(jid,p):
+    EXPORT_DIR.mkdir(exist_ok=True); path=EXPORT_DIR/f"payslips-{jid}.zip"
+    make_payslips(p["owner_id"],path,p.get("period"),
+                  progress=lambda d,t,r: job_progress(jid,d,t,f"{d}/{t} payslips, {r:.0f}/s"))
+    return path.name
+
+@command("payslips","<owner_id> [period_id] [workers]  write that period's payslips to exports/ as a ZIP")
+def cmd_payslips(oid,pid=None,workers=None):
+    oid,pid=int(oid),int(pid) if pid else None; path=EXPORT_DIR/f"payslips-{oid}-{pid or 'latest'}.zip"
+    with app.app_context():
+        n,dt=make_payslips(oid,path,pid,int(workers or PAYSLIP_WORKERS),
+                           progress=lambda d,t,r: print(f"\r{d}/{t} payslips  {r:7.0f}/s",end="",flush=True))
+    print(f"\n{n} payslips in {dt:.2f}s -> {path}")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  ASGI SERVING (serve-asgi / `uvicorn BizManager_1:asgi`)
+# ═══════════════════════════════════════════════════════════════════════════
+# The Flask routes run unchanged on a small thread pool; /events is served natively as a
+# coroutine, so an idle live-update connection costs a coroutine rather than a parked thread.
+# POSTs to the login/register pages (PBKDF2) go to a separate CPU pool so hashing can't starve I/O.
+ASGI_THREADS=int(os.environ.get("BIZ_ASGI_THREADS","16"))
+ASGI_CPU_PATHS=("/login","/register/")
+_io_pool=ThreadPoolExecutor(ASGI_THREADS,thread_name_prefix="asgi-io")
+_cpu_pool=ThreadPoolExecutor(max(2,os.cpu_count() or 2),thread_name_prefix="asgi-cpu")
+
+async def run_sync(fn,*a,pool=None):
+    return await asyncio.get_running_loop().run_in_executor(pool or _io_pool,partial(fn,*a))
+
+def in_app(fn):
+    @wraps(fn)
+    def d(*a,**k):
+        with app.app_context(): return fn(*a,**k)
+    return d
+
+async def aq(sql,args=(),one=False,tenant=None): return await run_sync(in_app(partial(q,sql,args,one,tenant)))
+
+class LoopQueue:
+    """Bus subscriber for a coroutine: publishers on any thread hand events to the loop."""
+    def __init__(self,loop): self.loop=loop; self.q=asyncio.Queue()
+    def put_nowait(self,ev):
+        if self.q.qsize()>=SSE_BUFFER: raise queue.Full
+        self.loop.call_soon_threadsafe(self.q.put_nowait,ev)
+
+def asgi_environ(scope,body):
+    env={"REQUEST_METHOD":scope["method"],"SCRIPT_NAME":scope.get("root_path",""),
+         "PATH_INFO":scope["path"].encode().decode("latin1"),"QUERY_STRING":scope.get("query_string",b"").decode("latin1"),
+         "SERVER_PROTOCOL":f"HTTP/{scope.get('http_version','1.1')}","wsgi.version":(1,0),
+         "wsgi.url_scheme":scope.get("scheme","http"),"wsgi.input":io.BytesIO(body),"wsgi.errors":sys.stderr,
+         "wsgi.multithread":True,"wsgi.multiprocess":False,"wsgi.run_once":False}
+    env["SERVER_NAME"],env["SERVER_PORT"]=map(str,scope.get("server") or ("localhost",80))
+    if scope.get("client"): env["REMOTE_ADDR"]=scope["client"][0]
+    for k,v in scope.get("headers",[]):
+        k,v=k.decode("latin1").lower(),v.decode("latin1")
+        key={"content-type":"CONTENT_TYPE","content-length":"CONTENT_LENGTH"}.get(k,"HTTP_"+k.upper().replace("-","_"))
+        env[key]=env[key]+","+v if key in env else v
+    env["CONTENT_LENGTH"]=str(len(body))  # the body is already buffered (and may have arrived chunked)
+    return env
+
+async def asgi_wsgi(scope,receive,send):
+    """Run the Flask app for one request on a pool thread, streaming its body chunk by chunk."""
+    body=b""; more=True
+    while more: msg=await receive(); body+=msg.get("body",b""); more=msg.get("more_body",False)
+    pool=_cpu_pool if scope["method"]=="POST" and scope["path"].startswith(ASGI_CPU_PATHS) else _io_pool
+    head={}
+    def start_response(status,headers,exc_info=None):
+        head["status"]=int(status[:3]); head["headers"]=[(k.lower().encode("latin1"),v.encode("latin1")) for k,v in headers]
+    it=await run_sync(app,asgi_environ(scope,body),start_response,pool=pool); chunks=iter(it)
+    try:
+        chunk=await run_sync(next,chunks,None,pool=pool)
+        await send({"type":"http.response.start","status":head["status"],"headers":head["headers"]})
+        while chunk is not None:
+            if chunk: await send({"type":"http.response.body","body":chunk,"more_body":True})
+            chunk=await run_sync(next,chunks,None,pool=pool)
+        await send({"type":"http.response.body","body":b""})
+    finally:
+        if hasattr(it,"close"): await run_sync(it.close,pool=pool)
+
+async def asgi_owner(scope):
+    """Owner id from the signed session cookie, or None."""
+    from werkzeug.http import parse_cookie
+    raw=parse_cookie(asgi_environ(scope,b"").get("HTTP_COOKIE","")).get(app.config["SESSION_COOKIE_NAME"])
+    try: uid=app.session_interface.get_signing_serializer(app).loads(raw).get("user_id") if raw else None
+    except Exception: return None
+    u=await aq("SELECT id,role FROM users WHERE id=?",[uid],one=True) if uid else None
+    return u["id"] if u and u["role"]=="owner" else None
+
+async def asgi_events(scope,receive,send):
+    oid=await asgi_owner(scope)
+    if not oid:
+        await send({"type":"http.response.start","status":401,"headers":[(b"content-type",b"text/plain")]})
+        return await send({"type":"http.response.body","body":b"owner login required"})
+    loop=asyncio.get_running_loop(); sub=LoopQueue(loop); BUS.subscribe(oid,sub)
+    gone=asyncio.ensure_future(receive())  # completes with http.disconnect
+    await send({"type":"http.response.start","status":200,"headers":[(b"content-type",b"text/event-stream; charset=utf-8"),
+                                                                     (b"cache-control",b"no-cache"),(b"x-accel-buffering",b"no")]})
+    try:
+        frame=f"retry: {SSE_RETRY_MS}\n\n"; end=loop.time()+SSE_MAX_AGE
+        while True:
+            await send({"type":"http.response.body","body":frame.encode(),"more_body":True})
+            if sub.overflow or loop.time()>=end: break
+            get=asyncio.ensure_future(sub.q.get())
+            done,_=await asyncio.wait({get,gone},timeout=SSE_HEARTBEAT,return_when=asyncio.FIRST_COMPLETED)
+            if gone in done: get.cancel(); return
+            if get in done: frame="event: reset\ndata: {}\n\n" if sub.overflow else sse_frame(*get.result())
+            else: get.cancel(); frame=": ping\n\n"
+        await send({"type":"http.response.body","body":b""})
+    finally: BUS.unsubscribe(oid,sub); gone.cancel()
+
+async def asgi(scope,receive,send):
+    if scope["type"]=="lifespan":
+        while True:
+            msg=await receive()
+            if msg["type"]=="lifespan.startup":
+                if REPLICA_OF: await run_sync(start_follower)
+                else: await run_sync(init_db); start_workers()
+                await send({"type":"lifespan.startup.complete"})
+            elif msg["type"]=="lifespan.shutdown": return await send({"type":"lifespan.shutdown.complete"})
+    if scope["type"]!="http": return
+    if scope["path"]=="/events" and not REPLICA_OF: return await asgi_events(scope,receive,send)  # followers forward it
+    await asgi_wsgi(scope,receive,send)
+
+@command("serve-asgi","[port]  serve through uvicorn (pip install uvicorn) instead of the threaded server")
+def cmd_serve_asgi(port=None):
+    try: import uvicorn
+    except ImportError: print("serve-asgi needs uvicorn: pip install uvicorn"); return 1
+    uvicorn.run(asgi,host="127.0.0.1",port=int(port or PORT),log_level="warning")
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  QUERY BUDGETS (per-route q()/m() counts against a seeded throwaway database)
+# ═══════════════════════════════════════════════════════════════════════════
+# Most queries any URL of the endpoint may issue on a cold render (caches emptied), as owner or
+# employee, sharded or not. check-budgets also renders every URL at N and 10N employees and fails
+# if a count grows, which is how a per-row query shows up. Every GET endpoint must be listed here.
+QUERY_BUDGETS={
+    "index":1,"login":1,"register_owner":1,"register_employee":1,
+    "dashboard":4,"profile":2,"employees":3,"employee_detail":2,"employee_fragment":4,
+    "invites":2,"api_list":2,"api_get":2,"api_changes":7,"cache_stats":1,
+    "jobs":3,"job_status":2,"job_download":2,"analytics":5,"favicon":0,"replica_status":1,"admission_stats":1,"access_stats":1,"profiles":1,"profile_view":1,"profile_download":1,"memory_stats":1,
+}
+BUDGET_SKIP={"static","events","logout"}  # streaming, or would end the session
+
+def count_queries(fn):
+    """Run fn() with every q()/m() call counted; returns (result, queries, rows read)."""
+    global q,m
+    real_q,real_m=q,m; n=[0,0]
+    def cq(*a,**k):
+        rv=real_q(*a,**k); n[0]+=1; n[1]+=len(rv) if isinstance(rv,list) else rv is not None; return rv
+    def cm(*a,**k): n[0]+=1; return real_m(*a,**k)
+    q,m=cq,cm
+    try: return fn(),n[0],n[1]
+    finally: q,m=real_q,real_m
+
+def budget_seed(n):
+    """Owner with n employees, each with a payment, a note and the invite code they used, plus n
+    open codes and one export job; the owner is an admin. Returns (owner client, employee client, url arguments)."""
+    pw="budgetpass1"; oid=create_user("owner@example.com",pw,"Budget Owner","owner"); h=hash_pw(pw); ts=now(); ADMINS.add("owner@example.com")
+    eid=create_user("emp0@example.com",pw,"Employee 0",owner_id=oid)
+    mw(lambda db: db.executemany("INSERT INTO users(email,password_hash,full_name,position,created_at,owner_id) VALUES(?,?,?,'Staff',?,?)",
+                                 [(f"emp{i}@example.com",h,f"Employee {i}",ts,oid) for i in range(1,n)]))
+    emps=[r["id"] for r in find_employees(oid,cols="id",order="id")]
+    mw(lambda db: (db.executemany("INSERT INTO payment_records(owner_id,employee_id,amount_minor,currency,paid_on) VALUES(?,?,1000,'USD',?)",[(oid,e,ts) for e in emps]),
+                   db.executemany("INSERT INTO notes(owner_id,employee_id,author_id,content,created_at) VALUES(?,?,?,'seed',?)",[(oid,e,oid,ts) for e in emps])),tenant=oid)
+    mw(lambda db: db.executemany("INSERT INTO invite_codes(code,owner_id,used_by_id,is_active,created_at) VALUES(?,?,?,1,?)",
+                                 [(f"SEED{i:08d}",oid,e,ts) for i,e in enumerate(emps+[None]*n)]))
+    nid=q("SELECT MIN(id) i FROM notes WHERE employee_id=?",[eid],one=True,tenant=oid)["i"]
+    args=dict(eid=eid,nid=nid,rid=eid,cid=q("SELECT MIN(id) i FROM invite_codes",one=True)["i"],
+              jid=enqueue("export_payments",{},oid),res=list(API),name=["payments","totals","notes"],pid="none")
+    clients=[]
+    for email in ("owner@example.com","emp0@example.com"):
+        c=app.test_client(); c.post("/login",data={"email":email,"password":pw}); clients.append(c)
+    return clients,args
+
+def budget_urls(args):
+    """endpoint -> concrete GET URLs for every routed endpoint not in BUDGET_SKIP."""
+    import itertools
+    out={}
+    for r in app.url_map.iter_rules():
+        if "GET" not in r.methods or r.endpoint in BUDGET_SKIP: continue
+        keys=sorted(r.arguments); vals=[args[k] if isinstance(args[k],list) else [args[k]] for k in keys]
+        out.setdefault(r.endpoint,[]).extend(app.url_map.bind("localhost").build(r.endpoint,dict(zip(keys,v)))
+                                             for v in itertools.product(*vals))
+    return out
+
+def budget_run(n,measure=count_queries):
+    """{(endpoint, url, role): (a, b, status)} for a database seeded with n employees, where
+    measure(render) returns (response, a, b): queries and rows read by default."""
+    restore=bench_db(); res={}
+    try:
+        with app.app_context(): clients,args=budget_seed(n)
+        for ep,urls in budget_urls(args).items():
+            for url in urls:
+                for role,c in zip(("owner","employee"),clients):
+                    if FRAGS is not None: FRAGS.clear()
+                    IDS.bump()
+                    r,a,b=measure(lambda: c.get(url)); res[ep,url,role]=(a,b,r.status_code)
+    finally: restore()
+    return res
+
+@command("check-budgets","[n]  render every GET route at n and 10n employees; fail on budget overruns or per-row queries")
+def cmd_check_budgets(n="20"):
+    n=int(n); small,big=budget_run(n),budget_run(10*n); bad=0
+    for key in sorted(small):
+        ep,url,role=key; (q1,r1,st),(q2,r2,_)=small[key],big.get(key,(None,None,None)); lim=QUERY_BUDGETS.get(ep)
+        err=("no budget declared" if lim is None else f"over budget {lim}" if max(q1,q2 or 0)>lim else
+             f"grows with data ({q1} -> {q2})" if q2 is None or q2>q1 else "")
+        bad+=bool(err)
+        print(f"{'FAIL' if err else 'ok  '} {url:<34} {role:<8} {st}  queries {q1:>2}/{q2 if q2 is not None else '-':>2}  "
+              f"rows {r1:>5}/{r2 if r2 is not None else '-':>5}  {err}")
+    print(f"{len(small)} renders, {bad} failing")
+    return 1 if bad else 0
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  BENCHMARKS (run against throwaway databases, never the live one)
+# ═══════════════════════════════════════════════════════════════════════════
+def bench_db():
+    """Point DB_PATH, the shard, archive, export, log and profile directories and the fragment cache at a
+    fresh temp dir for the duration of a benchmark, so bench renders never reach a live store; returns a restore fn."""
+    global DB_PATH,TENANT_DIR,ARCHIVE_DIR,EXPORT_DIR,LOG_DIR,PROFILE_DIR,FRAGS
+    import tempfile
+    real=DB_PATH,TENANT_DIR,ARCHIVE_DIR,EXPORT_DIR,LOG_DIR,PROFILE_DIR,FRAGS; admins=set(ADMINS); tmp=Path(tempfile.mkdtemp())
+    DB_PATH=tmp/"bench.db"; TENANT_DIR,ARCHIVE_DIR,EXPORT_DIR,LOG_DIR,PROFILE_DIR=(tmp/d for d in ("tenants","archive","exports","logs","profiles"))
+    FRAGS=(None if FRAGS is None else SharedFragCache(FRAG_LIMIT,tmp/"fragcache.db") if FRAGS.store=="sqlite" else FragCache(FRAG_LIMIT))
+    init_db()
+    def restore():
+        global DB_PATH,TENANT_DIR,ARCHIVE_DIR,EXPORT_DIR,LOG_DIR,PROFILE_DIR,FRAGS
+        ACCESS.flush(); shutil.rmtree(tmp,ignore_errors=True); DB_PATH,TENANT_DIR,ARCHIVE_DIR,EXPORT_DIR,LOG_DIR,PROFILE_DIR,FRAGS=real
+        ADMINS.clear(); ADMINS.update(admins)
+    return restore
+
+@command("bench-writes","[threads] [writes]  writes/s: per-request commits vs the single writer")
+def cmd_bench_writes(threads="8",writes="250"):
+    global SINGLE_WRITER
+    threads,writes=int(threads),int(writes); real=SINGLE_WRITER
+    for mode in (False,True):
+        SINGLE_WRITER=mode; restore=bench_db(); errors=[]
+        def work(i):
+            with app.app_context():
+                for k in range(writes):
+                    try: m("INSERT INTO notes(owner_id,employee_id,author_id,content,created_at) VALUES(1,1,1,?,?)",[f"{i}:{k}",now()])
+                    except sqlite3.OperationalError as e: errors.append(e)
+        ts=[threading.Thread(target=work,args=(i,)) for i in range(threads)]; t0=time.perf_counter()
+        for t in ts: t.start()
+        for t in ts: t.join()
+        dt=time.perf_counter()-t0; ok=threads*writes-len(errors)
+        print(f"{'single writer' if mode else 'per-request commit':<20} {ok/dt:9.0f} writes/s  {len(errors)} failed  ({threads} threads, {dt:.2f}s)")
+        restore()
+    SINGLE_WRITER=real
+
+@command("bench-serve","[idle] [requests]  threads and req/s with idle /events streams: threaded vs ASGI")
+def cmd_bench_serve(idle="200",requests="300"):
+    """In-process: the threaded mode gets a thread per connection (like the dev server), the ASGI
+    mode drives asgi() directly. Both serve /dashboard while `idle` live-update streams stay open."""
+    global SSE_HEARTBEAT
+    idle,n=int(idle),int(requests); restore=bench_db(); hb=SSE_HEARTBEAT; SSE_HEARTBEAT=0.5
+    with app.app_context(): uid=create_user("bench@example.com","benchpass1","Bench Owner","owner")
+    cookie=f"{app.config['SESSION_COOKIE_NAME']}={app.session_interface.get_signing_serializer(app).dumps({'user_id':uid})}"
+    scope=lambda path: {"type":"http","method":"GET","path":path,"query_string":b"","headers":[(b"cookie",cookie.encode())]}
+    def threaded():
+        stop=threading.Event()
+        def conn(path):
+            it=app(asgi_environ(scope(path),b""),lambda *a: None)
+            try:
+                for _ in it:
+                    if stop.is_set(): break
+            finally: it.close()
+        streams=[threading.Thread(target=conn,args=("/events",)) for _ in range(idle)]
+        for t in streams: t.start()
+        time.sleep(0.5); threads=threading.active_count(); t0=time.perf_counter()
+        reqs=[threading.Thread(target=conn,args=("/dashboard",)) for _ in range(n)]
+        for t in reqs: t.start()
+        for t in reqs: t.join()
+        dt=time.perf_counter()-t0; stop.set()
+        for t in streams: t.join()
+        return threads,dt
+    async def native():
+        stop=asyncio.Event()
+        async def conn(path):
+            async def receive():
+                if path=="/events": await stop.wait(); return {"type":"http.disconnect"}
+                return {"type":"http.request","body":b""}
+            async def send(msg): pass
+            await asgi(scope(path),receive,send)
+        streams=[asyncio.ensure_future(conn("/events")) for _ in range(idle)]
+        await asyncio.sleep(0.5); threads=threading.active_count(); t0=time.perf_counter()
+        await asyncio.gather(*(conn("/dashboard") for _ in range(n)))
+        dt=time.perf_counter()-t0; stop.set(); await asyncio.gather(*streams)
+        return threads,dt
+    try:
+        for name,run in (("threaded",threaded),("asgi",lambda: asyncio.run(native()))):
+            threads,dt=run()
+            print(f"{name:<9} {idle} idle streams  {threads:4d} threads alive  {n/dt:7.0f} req/s  ({n} x /dashboard in {dt:.2f}s)")
+    finally: SSE_HEARTBEAT=hb; restore()
+
+@command("bench-rows","[rows]  peak memory and time to load the employee list: sqlite3.Row vs compact records")
+def cmd_bench_rows(rows="100000"):
+    import tracemalloc
+    n=int(rows); restore=bench_db()
+    try:
+        with app.app_context():
+            oid=create_user("bench@example.com","benchpass1","Bench Owner","owner"); ts=now()
+            mw(lambda db: db.executemany("""INSERT INTO users(email,password_hash,full_name,role,position,phone,created_at,owner_id)
+                                            VALUES(?,?,?,'employee','Staff','555-0100',?,?)""",
+                                         ((f"e{i}@example.com","x"*97,f"Employee {i}",ts,oid) for i in range(n))))
+            for name,kw in (("sqlite3.Row  SELECT *",{}),("compact      EMP_CARD",{"cols":EMP_CARD})):
+                t0=time.perf_counter(); got=find_employees(oid,**kw); dt=time.perf_counter()-t0; del got  # untraced timing
+                tracemalloc.start(); got=find_employees(oid,**kw); _,peak=tracemalloc.get_traced_memory(); tracemalloc.stop()
+                print(f"{name}  {len(got)} rows  peak {peak/1e6:7.1f} MB  {peak/len(got):6.0f} B/row  {dt:.3f}s"); del got
+    finally: restore()
+
+def measure_memory(render):
+    """(response, peak bytes traced above the start, bytes still held) for one render; needs
+    tracemalloc running."""
+    mem_reset_peak(); base=tracemalloc.get_traced_memory()[0]
+    r=render(); cur,peak=tracemalloc.get_traced_memory()
+    return r,peak-base,cur-base
+
+# Most a cold render may peak at, in KB: MEMORY_BUDGET_KB flat, plus KB per employee for the pages
+# that list every employee or invite code. bench-memory fails a page over budget at any size.
+MEMORY_BUDGET_KB=1024
+MEMORY_BUDGETS={"invites":20,"employees":8,"dashboard":1}
+
+@command("bench-memory","[sizes]  peak traced memory per page at each employee count (default 20,200,2000); fail on budget overruns")
+def cmd_bench_memory(sizes="20,200,2000"):
+    sizes=[int(x) for x in sizes.split(",")]; was=tracemalloc.is_tracing()
+    if not was: tracemalloc.start(MEM_FRAMES)
+    try: runs=[budget_run(n,measure_memory) for n in sizes]
+    finally:
+        if not was: tracemalloc.stop()
+    bad=0; big=runs[-1]
+    print(f"{'page':<34} {'role':<8} "+" ".join(f"{f'peak@{n}':>11}" for n in sizes)+f" {'held':>9} {'growth':>7}")
+    for key in sorted(big,key=lambda k: -big[k][0]):
+        ep,url,role=key; peaks=[r.get(key,(0,0,0))[0] for r in runs]
+        over=[n for n,p in zip(sizes,peaks) if p>(MEMORY_BUDGET_KB+MEMORY_BUDGETS.get(ep,0)*n)*1024]; bad+=bool(over)
+        print(f"{url:<34} {role:<8} "+" ".join(f"{p/1024:9.0f}KB" for p in peaks)+
+              f" {big[key][1]/1024:7.0f}KB {peaks[-1]/max(peaks[0],1):6.1f}x{f'  over budget at {over[0]}' if over else ''}")
+    print(f"{len(big)} pages at {len(sizes)} sizes, {bad} over budget")
+    return 1 if bad else 0
+
+@command("bench-rollover","[employees]  resetting payment status for a new pay period: per-employee updates vs rollover()")
+def cmd_bench_rollover(n="20000"):
+    n=int(n); restore=bench_db()
+    try:
+        with app.app_context():
+            oid=create_user("bench@example.com","benchpass1","Bench Owner","owner"); ts=now()
+            mw(lambda db: db.executemany("""INSERT INTO users(email,password_hash,full_name,role,payment_status,created_at,owner_id,last_paid_on)
+                                            VALUES(?,'x',?,'employee','paid',?,?,?)""",
+                                         ((f"e{i}@example.com",f"Employee {i}",ts,oid,ts-86400 if i%2 else ts+60) for i in range(n))))
+            ids=[r["id"] for r in find_employees(oid,cols="id",order="id")]
+            t0=time.perf_counter()
+            for e in ids: m("UPDATE users SET payment_status='unpaid' WHERE id=? AND owner_id=?",[e,oid],tags=(f"emps:{oid}",))
+            dt=time.perf_counter()-t0
+            print(f"per employee  {n} updates      {dt:7.2f}s  {n/dt:8.0f} employees/s")
+            m("UPDATE users SET payment_status='paid' WHERE owner_id=? AND role='employee'",[oid])
+            t0=time.perf_counter(); changed=rollover(oid,ts); dt=time.perf_counter()-t0
+            print(f"rollover()    1 UPDATE  {changed:>6} changed  {dt:7.2f}s  {n/dt:8.0f} employees/s")
+    finally: restore()
+
+@command("bench-payslips","[employees] [max workers]  payslips/s and speedup by process pool size")
+def cmd_bench_payslips(n="5000",most=None):
+    n,most=int(n),int(most or os.cpu_count() or 1); restore=bench_db()
+    try:
+        with app.app_context():
+            oid=create_user("bench@example.com","benchpass1","Bench Owner","owner"); rollover(oid,now(-86400)); ts=now(-3600)
+            mw(lambda db: db.executemany("INSERT INTO users(email,password_hash,full_name,role,created_at,owner_id) VALUES(?,'x',?,'employee',?,?)",
+                                         ((f"e{i}@example.com",f"Employee {i}",ts,oid) for i in range(n))))
+            ids=[r["id"] for r in find_employees(oid,cols="id",order="id")]
+            mw(lambda db: db.executemany("INSERT INTO payment_records(owner_id,employee_id,amount_minor,currency,period,method,paid_on) VALUES(?,?,?,'USD','Monthly','Bank',?)",
+                                         ((oid,e,100000+k,ts-k*86400*30) for e in ids for k in range(3))),tenant=oid)
+            base=None; w=1
+            while w<=most:
+                got,dt=make_payslips(oid,DB_PATH.parent/f"slips-{w}.zip",workers=w); base=base or dt
+                print(f"{w:3d} workers  {got} payslips  {dt:6.2f}s  {got/dt:8.0f}/s  speedup {base/dt:4.1f}x")
+                w*=2
+    finally: restore()
+
 # ═══════════════════════════════════════════════════════════════════════════
 #  FAVICON
 # ═══════════════════════════════════════════════════════════════════════════
@@ -1410,7 +4109,13 @@ def open_browser():
     webbrowser.open(f"http://127.0.0.1:{PORT}")
 
 if __name__=="__main__":
-    init_db()
+    if len(sys.argv)>1:
+        if sys.argv[1] not in COMMANDS:
+            print("usage: BizManager_1.py [command]\n"+"\n".join(f"  {n:<12} {u}" for n,(_,u) in sorted(COMMANDS.items())))
+            sys.exit(2)
+        init_db(); sys.exit(COMMANDS[sys.argv[1]][0](*sys.argv[2:]))
+    if REPLICA_OF: start_follower()
+    else: init_db(); start_workers()
     print("""
   ╔══════════════════════════════════════════════════════╗
   ║            BizManager is starting...                 ║